@@ -0,0 +1,243 @@
+"""
+Per-stage benchmarks for the `prepare_form` pipeline over a corpus of synthetic
+PDFs with varying page counts, page sizes and field density.
+
+    python benchmarks/bench_pipeline.py --output baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json
+
+Each stage (rasterization, text extraction, detection per detector/mode,
+widget sorting, signature promotion and the PDF write) is timed separately and
+written as JSON. With `--baseline`, every stage is compared against the output
+of an earlier run on the same machine (timings don't carry across machines),
+and the script exits non-zero if any stage regressed beyond `--tolerance`.
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from pathlib import Path
+
+from commonforms.form_creator import PyPdfFormCreator
+from commonforms.inference import (
+    extract_text_fragments,
+    load_detector,
+    promote_signature_widgets,
+    render_page,
+    render_pdf,
+    sort_widgets,
+)
+from commonforms.utils import Page
+
+from synthetic import make_pdf
+
+import json
+import platform
+import pypdfium2
+import statistics
+import sys
+import tempfile
+import time
+
+# name -> (pages, page size, fields per page)
+CORPUS = {
+    "letter-1p-sparse": (1, "letter", 8),
+    "letter-10p": (10, "letter", 25),
+    "legal-10p-dense": (10, "legal", 70),
+    "a3-4p-dense": (4, "a3", 80),
+    "letter-100p": (100, "letter", 25),
+}
+
+DETECTORS = ["FFDetr", "FFDetr:fast", "FFDNet-S:fast", "FFDNet-L:fast"]
+
+
+def timed(fn, repeat: int):
+    """Run `fn` `repeat` times, returning its last result and timing stats."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, {"median": statistics.median(times), "min": min(times)}
+
+
+def render(pdf_path: Path) -> list:
+    doc = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return [render_page(page) for page in doc]
+    finally:
+        doc.close()
+
+
+def text(pdf_path: Path) -> list:
+    doc = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return [extract_text_fragments(page) for page in doc]
+    finally:
+        doc.close()
+
+
+def write(pdf_path: Path, widgets: dict, output_path: Path) -> None:
+    writer = PyPdfFormCreator(pdf_path)
+    writer.clear_existing_fields()
+    for page_ix, page_widgets in widgets.items():
+        writer.add_widgets(page_ix, page_widgets)
+    writer.save(output_path)
+    writer.close()
+
+
+def bench_case(
+    pdf_path: Path,
+    widgets: dict,
+    detectors: dict,
+    repeat: int,
+    workdir: Path,
+    render_workers: int = 1,
+) -> dict:
+    stages = {}
+
+    images, stages["render_pdf"] = timed(lambda: render(pdf_path), repeat)
+    if render_workers > 1:
+        _, stages[f"render_pdf[workers={render_workers}]"] = timed(
+            lambda: render_pdf(str(pdf_path), workers=render_workers), repeat
+        )
+    fragments, stages["extract_text_fragments"] = timed(lambda: text(pdf_path), repeat)
+    pages = [
+        Page(image=image, width=image.width, height=image.height, text_fragments=f)
+        for image, f in zip(images, fragments)
+    ]
+
+    for name, detector in detectors.items():
+        _, stages[f"extract_widgets[{name}]"] = timed(
+            lambda: detector.extract_widgets(pages), repeat
+        )
+
+    _, stages["sort_widgets"] = timed(
+        lambda: {ix: sort_widgets(w) for ix, w in widgets.items()}, repeat
+    )
+    _, stages["promote_signature_widgets"] = timed(
+        lambda: promote_signature_widgets(
+            pages, {ix: list(w) for ix, w in widgets.items()}
+        ),
+        repeat,
+    )
+    _, stages["write"] = timed(
+        lambda: write(pdf_path, widgets, workdir / "output.pdf"), repeat
+    )
+
+    for stats in stages.values():
+        stats["per_page"] = stats["median"] / len(pages)
+
+    return stages
+
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta: float):
+    """Print a comparison table, returning the list of regressed stages."""
+    regressions = []
+    print(f"{'case':20} {'stage':36} {'base':>9} {'now':>9} {'ratio':>6}")
+    for case, stages in current["cases"].items():
+        for stage, stats in stages.items():
+            base = baseline.get("cases", {}).get(case, {}).get(stage)
+            if base is None:
+                continue
+            ratio = stats["median"] / base["median"] if base["median"] else 1.0
+            regressed = (
+                ratio > 1 + tolerance and stats["median"] - base["median"] > min_delta
+            )
+            if regressed:
+                regressions.append((case, stage, ratio))
+            print(
+                f"{case:20} {stage:36} {base['median']:9.4f} {stats['median']:9.4f}"
+                f" {ratio:6.2f}{'  REGRESSION' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Per-stage benchmarks for prepare_form")
+    parser.add_argument("--output", type=Path, default=None, help="Write results JSON")
+    parser.add_argument(
+        "--baseline", type=Path, default=None, help="Results JSON to compare against"
+    )
+    parser.add_argument(
+        "--cases", nargs="*", default=list(CORPUS), choices=list(CORPUS)
+    )
+    parser.add_argument(
+        "--detectors",
+        nargs="*",
+        default=DETECTORS,
+        help="Detectors to time as MODEL or MODEL:fast (pass no values to skip)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=0,
+        dest="render_workers",
+        help="Also time process-parallel rendering (and text extraction) with this many workers",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown vs the baseline before a stage counts as a regression",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.005,
+        dest="min_delta",
+        help="Ignore regressions smaller than this many seconds (timer noise)",
+    )
+    args = parser.parse_args()
+
+    detectors, load_times, errors = {}, {}, {}
+    for spec in args.detectors:
+        model, _, mode = spec.partition(":")
+        try:
+            detectors[spec], load_times[spec] = timed(
+                lambda: load_detector(model, fast=mode == "fast"), 1
+            )
+        except Exception as e:
+            # e.g. no network to fetch weights; keep benchmarking the other stages
+            errors[spec] = repr(e)
+            print(f"Skipping {spec}: {e}", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "repeat": args.repeat,
+        },
+        "detector_load": load_times,
+        "detector_errors": errors,
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for case in args.cases:
+            num_pages, page_size, fields = CORPUS[case]
+            pdf_path = workdir / f"{case}.pdf"
+            widgets = make_pdf(pdf_path, num_pages, page_size, fields)
+            print(f"Benchmarking {case}...", file=sys.stderr)
+            results["cases"][case] = bench_case(
+                pdf_path, widgets, detectors, args.repeat, workdir, args.render_workers
+            )
+
+    if args.output:
+        with args.output.open("w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with args.baseline.open("r") as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed", file=sys.stderr)
+            sys.exit(1)
+    elif not args.output:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Generate synthetic form PDFs for benchmarking: labelled underlines, checkbox
+squares and a signature line, laid out in rows. The ground-truth widget
+positions are returned alongside, so the post-detection stages can be
+benchmarked without running a model.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from commonforms.utils import BoundingBox, Widget
+
+import random
+
+PAGE_SIZES = {
+    "letter": (612, 792),
+    "legal": (612, 1008),
+    "a3": (842, 1191),
+}
+
+
+def page_content(
+    width: float, height: float, fields: int, page_ix: int, rng: random.Random
+) -> tuple[bytes, list[Widget]]:
+    margin = 54
+    row_height = max(14.0, min(36.0, (height - 2 * margin) / max(fields, 1)))
+    ops, widgets = [], []
+
+    def widget(widget_type: str, x0: float, y0: float, x1: float, y1: float):
+        # PDF space is bottom-left origin; widgets are normalized top-left origin
+        widgets.append(
+            Widget(
+                widget_type=widget_type,
+                bounding_box=BoundingBox(
+                    x0=x0 / width,
+                    y0=1 - y1 / height,
+                    x1=x1 / width,
+                    y1=1 - y0 / height,
+                ),
+                page=page_ix,
+            )
+        )
+
+    y = height - margin
+    for field_ix in range(fields - 1):
+        y -= row_height
+        if y < margin:
+            break
+
+        ops.append(
+            f"BT /F1 9 Tf {margin} {y + 2:.1f} Td (Field {field_ix} label:) Tj ET"
+        )
+        if rng.random() < 0.3:
+            x = margin + 90
+            size = min(10.0, row_height - 4)
+            ops.append(f"0.8 w {x} {y:.1f} {size} {size} re S")
+            widget("ChoiceButton", x, y, x + size, y + size)
+        else:
+            x0 = margin + 90
+            x1 = rng.uniform(x0 + 60, width - margin)
+            ops.append(f"0.5 w {x0} {y:.1f} m {x1:.1f} {y:.1f} l S")
+            widget("TextBox", x0, y, x1, y + row_height * 0.6)
+
+    y = max(margin, y - row_height * 1.5)
+    ops.append(f"BT /F1 9 Tf {margin} {y + 2:.1f} Td (Signature) Tj ET")
+    ops.append(f"0.5 w {margin + 60} {y:.1f} m {margin + 260} {y:.1f} l S")
+    widget("TextBox", margin + 60, y, margin + 260, y + 18)
+
+    return "\n".join(ops).encode(), widgets
+
+
+def make_pdf(
+    path: str | Path,
+    num_pages: int,
+    page_size: str = "letter",
+    fields_per_page: int = 20,
+    seed: int = 0,
+) -> dict[int, list[Widget]]:
+    """Write a synthetic form to `path`, returning its widgets by page."""
+    rng = random.Random(seed)
+    width, height = PAGE_SIZES[page_size]
+
+    writer = PdfWriter()
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+
+    widgets = {}
+    for page_ix in range(num_pages):
+        page = writer.add_blank_page(width=width, height=height)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+            }
+        )
+        content, widgets[page_ix] = page_content(
+            width, height, fields_per_page, page_ix, rng
+        )
+        stream = DecodedStreamObject()
+        stream.set_data(content)
+        page.replace_contents(stream)
+
+    with open(path, "wb") as fp:
+        writer.write(fp)
+
+    return widgets
@@ -1,4 +1,5 @@
-from commonforms.inference import prepare_form
+from commonforms.inference import apply_detections, detect_form, prepare_form
+from commonforms.utils import FormDetections
 
 
 def main():
@@ -7,4 +8,4 @@ def main():
     cli_main()
 
 
-__all__ = ["prepare_form", "main"]
+__all__ = ["prepare_form", "detect_form", "apply_detections", "FormDetections", "main"]
@@ -1,33 +1,27 @@
-from commonforms.inference import prepare_form
-from argparse import ArgumentParser
+from commonforms.inference import apply_detections, detect_form, prepare_form
+from commonforms.batch import open_queue, run_worker
+from commonforms.autotune import main as autotune_main
+from commonforms.escalation import CascadePolicy, EscalationPolicy
+from commonforms.memory import MemoryBudget, parse_size
+from commonforms.instrumentation import (
+    NULL_OBSERVER,
+    MultiObserver,
+    PrometheusExporter,
+    StatsdExporter,
+)
+from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
+import logging
+import sys
 
-def main():
-    parser = ArgumentParser(
-        prog="commonforms", description="Automatically Prepare a Fillable PDF Form"
-    )
-    parser.add_argument(
-        "input",
-        type=Path,
-        help="Path to the input file (only .pdf files are supported for now.)",
-    )
-    parser.add_argument("output", type=Path, help="Path to save the output PDF file.")
+
+def add_detection_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--model",
         type=str,
         default="FFDNet-L",
-        help="Model (FFDNet-L/FFDNet-S) or path to a different .pt model",
-    )
-    parser.add_argument(
-        "--keep-existing-fields",
-        action="store_true",
-        help="If true, keep existing form fields on the PDF",
-    )
-    parser.add_argument(
-        "--use-signature-fields",
-        action="store_true",
-        help="If true, use signature fields instead of text fields for detected signatures",
+        help="Model (FFDNet-L/FFDNet-S), path to a different .pt model, or `vector` to only use the fields drawn on born-digital pages (no model)",
     )
     parser.add_argument(
         "--device", default="cpu", help="Which device to use for inference."
@@ -50,27 +44,353 @@ def main():
         action="store_true",
         help="If running on a CPU, you can use --fast to get a 50%% speedup with a small accuracy penalty",
     )
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="Additionally run the model over overlapping full-resolution tiles of pages larger than the model input (slower, better on large or dense pages)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run every page at a low resolution first and only re-run pages with many low-confidence or tiny detections at full resolution",
+    )
+    parser.add_argument(
+        "--coarse-image-size",
+        type=int,
+        default=640,
+        dest="coarse_image_size",
+        help="Image size for the first pass of --adaptive (default: 640)",
+    )
+    parser.add_argument(
+        "--cascade-to",
+        type=str,
+        default=None,
+        dest="cascade_to",
+        help="Re-run pages that --model is uncertain about with this (larger) model, e.g. --model FFDNet-S --cascade-to FFDetr",
+    )
+    parser.add_argument(
+        "--cascade-threshold",
+        type=float,
+        default=0.2,
+        dest="cascade_threshold",
+        help="Fraction of near-threshold detections above which a page is sent to --cascade-to (default: 0.2)",
+    )
+    parser.add_argument(
+        "--vector-prior",
+        action="store_true",
+        dest="vector_prior",
+        help="Propose fields from the drawings of born-digital pages, skip the model on pages they account for, and snap the model's boxes to them elsewhere",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=None,
+        dest="time_budget",
+        help="Seconds a document may take: when it's projected to run over, the remaining pages fall back to cheaper settings (no TTA, the ONNX model, a lower resolution, then drawn fields only)",
+    )
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="Use the INT8-quantized ONNX FFDNet model created by `python -m commonforms.quantize`",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=parse_size,
+        default=None,
+        dest="memory_budget",
+        help="Cap on memory use (e.g. 2G): render scale, batch size and pages in flight are picked to stay under it",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        dest="batch_size",
+        help="Pages per model batch (default: from the hardware profile saved by `commonforms autotune`, or 4)",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        dest="max_cores",
+        help="Use at most this many cores for the model, e.g. to share a machine between several workers (default: the hardware profile's best setting)",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=1,
+        dest="render_workers",
+        help="Render pages in this many processes (0 for one per core)",
+    )
+    parser.add_argument(
+        "--profile-model",
+        action="store_true",
+        dest="profile_model",
+        help="Include the ONNX Runtime/torch profiler output for the model calls in --profile",
+    )
+    parser.add_argument(
+        "--previous",
+        type=Path,
+        default=None,
+        help="Detections (from `commonforms detect`) or a prepared PDF for an earlier revision of this document: unchanged pages reuse its fields and only new or edited pages are detected",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=None,
+        help="Save detections to this directory as each batch completes, so an interrupted run resumes where it left off",
+    )
+
+
+def add_writing_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--keep-existing-fields",
+        action="store_true",
+        help="If true, keep existing form fields on the PDF",
+    )
+    parser.add_argument(
+        "--use-signature-fields",
+        action="store_true",
+        help="If true, use signature fields instead of text fields for detected signatures",
+    )
     parser.add_argument(
         "--multiline",
         action="store_true",
         help="If you want the detected textboxes to allow multiline inputs.",
     )
 
-    args = parser.parse_args()
 
-    prepare_form(
-        args.input,
-        args.output,
+def add_observability_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        default=None,
+        help="Write per-stage timings, batch sizes and detection counts to this file in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--statsd",
+        type=str,
+        default=None,
+        help="Send the same metrics to a StatsD daemon at HOST:PORT",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=None,
+        help="Write a Chrome trace (chrome://tracing, ui.perfetto.dev) of every stage, page and model batch to this file",
+    )
+
+
+def detection_kwargs(args: Namespace) -> dict:
+    return dict(
         model_or_path=args.model,
-        keep_existing_fields=args.keep_existing_fields,
-        use_signature_fields=args.use_signature_fields,
         device=args.device,
         image_size=args.image_size,
         confidence=args.confidence,
         fast=args.fast,
+        tiled=args.tiled,
+        adaptive=args.adaptive,
+        escalation_policy=EscalationPolicy(coarse_image_size=args.coarse_image_size),
+        cascade_to=args.cascade_to,
+        cascade_policy=CascadePolicy(uncertainty_threshold=args.cascade_threshold),
+        vector_prior=args.vector_prior,
+        time_budget=args.time_budget,
+        int8=args.int8,
+        profile_model=args.profile_model,
+        batch_size=args.batch_size,
+        max_cores=args.max_cores,
+        render_workers=args.render_workers,
+        memory_budget=MemoryBudget(args.memory_budget) if args.memory_budget else None,
+        previous=args.previous,
+        checkpoint=args.checkpoint,
+    )
+
+
+def writing_kwargs(args: Namespace) -> dict:
+    return dict(
+        keep_existing_fields=args.keep_existing_fields,
+        use_signature_fields=args.use_signature_fields,
         multiline=args.multiline,
     )
 
 
+def run_observed(args: Namespace, fn, *fn_args, **kwargs):
+    """Call `fn` with the observers asked for by `add_observability_arguments`."""
+    logging.basicConfig(level=logging.INFO)
+
+    prometheus = PrometheusExporter() if args.metrics else NULL_OBSERVER
+    statsd = NULL_OBSERVER
+    if args.statsd:
+        host, _, port = args.statsd.partition(":")
+        statsd = StatsdExporter(host, int(port or 8125))
+
+    result = fn(
+        *fn_args,
+        observer=MultiObserver(prometheus, statsd),
+        profile=args.profile,
+        **kwargs,
+    )
+
+    if args.metrics:
+        prometheus.write(args.metrics)
+    return result
+
+
+def detect_main(argv: list[str]) -> None:
+    parser = ArgumentParser(
+        prog="commonforms detect",
+        description="Detect form fields and save them, without writing the PDF",
+    )
+    parser.add_argument("input", type=Path, help="Path to the input PDF file.")
+    parser.add_argument(
+        "detections",
+        type=Path,
+        help="Where to write the detections (.json, or .json.gz to compress)",
+    )
+    add_detection_arguments(parser)
+    add_observability_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # fingerprinted, so the detections can be the --previous of a later revision
+    detections = run_observed(
+        args, detect_form, args.input, fingerprint=True, **detection_kwargs(args)
+    )
+    detections.dump(args.detections)
+
+
+def apply_main(argv: list[str]) -> None:
+    parser = ArgumentParser(
+        prog="commonforms apply",
+        description="Write detections from `commonforms detect` into the PDF, without loading a model",
+    )
+    parser.add_argument("input", type=Path, help="Path to the input PDF file.")
+    parser.add_argument(
+        "detections", type=Path, help="Detections from `commonforms detect`"
+    )
+    parser.add_argument("output", type=Path, help="Path to save the output PDF file.")
+    add_writing_arguments(parser)
+    add_observability_arguments(parser)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Apply the detections even if they were made on a different file",
+    )
+    args = parser.parse_args(argv)
+
+    run_observed(
+        args,
+        apply_detections,
+        args.detections,
+        args.input,
+        args.output,
+        check_source=not args.force,
+        **writing_kwargs(args),
+    )
+
+
+def batch_main(argv: list[str]) -> None:
+    parser = ArgumentParser(
+        prog="commonforms batch",
+        description="Prepare many PDFs with workers on one or more machines, coordinated through a shared queue",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Queue PDFs")
+    add.add_argument(
+        "queue", type=Path, help="Queue: a .db file (SQLite) or a shared directory"
+    )
+    add.add_argument("inputs", type=Path, nargs="+", help="PDFs to prepare")
+    add.add_argument(
+        "--output-dir",
+        type=Path,
+        required=True,
+        dest="output_dir",
+        help="Where to write the prepared PDFs (same file names as the inputs)",
+    )
+
+    work = commands.add_parser("work", help="Prepare queued PDFs until none are left")
+    work.add_argument("queue", type=Path, help="Queue to work on")
+    work.add_argument(
+        "--lease",
+        type=float,
+        default=600,
+        help="Seconds without a heartbeat before a job is handed to another worker (default: 600)",
+    )
+    work.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        dest="max_attempts",
+        help="Give up on a document after this many attempts (default: 3)",
+    )
+    add_detection_arguments(work)
+    add_writing_arguments(work)
+
+    status = commands.add_parser("status", help="Count jobs and list failures")
+    status.add_argument("queue", type=Path, help="Queue to report on")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "add":
+        queue = open_queue(args.queue)
+        added = queue.add(
+            (input, (args.output_dir / input.name).resolve())
+            for input in (path.resolve() for path in args.inputs)
+        )
+        print(f"Queued {added} of {len(args.inputs)} PDFs")
+    elif args.command == "work":
+        if args.previous is not None:
+            # every queued document would be compared against the same file
+            work.error("--previous is for one document, not a queue of them")
+        queue = open_queue(
+            args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts
+        )
+        run_worker(queue, **detection_kwargs(args), **writing_kwargs(args))
+    else:
+        queue = open_queue(args.queue)
+        print(" ".join(f"{state}={n}" for state, n in queue.counts().items()))
+        for job in queue.failures():
+            print(f"{job.input}: {job.errors[-1]}")
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    # `commonforms detect ...` / `commonforms apply ...` split the pipeline in two,
+    # `commonforms batch ...` runs a queue of documents, `commonforms autotune ...`
+    # tunes batch size and threads for this machine; anything else is the
+    # original one-shot `commonforms input output`
+    if argv and argv[0] == "detect":
+        return detect_main(argv[1:])
+    if argv and argv[0] == "apply":
+        return apply_main(argv[1:])
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if argv and argv[0] == "autotune":
+        return autotune_main(argv[1:])
+
+    parser = ArgumentParser(
+        prog="commonforms", description="Automatically Prepare a Fillable PDF Form"
+    )
+    parser.add_argument(
+        "input",
+        type=Path,
+        help="Path to the input file (only .pdf files are supported for now.)",
+    )
+    parser.add_argument("output", type=Path, help="Path to save the output PDF file.")
+    add_detection_arguments(parser)
+    add_writing_arguments(parser)
+    add_observability_arguments(parser)
+    args = parser.parse_args(argv)
+
+    run_observed(
+        args,
+        prepare_form,
+        args.input,
+        args.output,
+        **detection_kwargs(args),
+        **writing_kwargs(args),
+    )
+
+
 if __name__ == "__main__":
     main()
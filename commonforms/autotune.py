@@ -0,0 +1,251 @@
+"""
+Find the fastest model batch size and thread counts for this machine, and save
+them as its hardware profile, which `prepare_form`, `detect_form` and the batch
+workers then use (see `commonforms.inference.apply_profile`):
+
+    commonforms autotune sample.pdf --config FFDNet-L:fast@1600 --config FFDetr
+
+For each detector, every intra-op thread count (powers of two up to the number
+of cores) is timed at every batch size, and the best batch size for each thread
+count again with two inter-op threads. The profile keeps all of the
+measurements, so a worker limited to fewer cores (`--cores`) picks the fastest
+setting that fits. Each thread configuration runs in a fresh process, since
+torch's inter-op thread pool can only be sized once per process.
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from commonforms.evaluation import EvalConfig
+from commonforms.hardware import (
+    HardwareProfile,
+    Setting,
+    available_cores,
+    detector_key,
+    machine_id,
+    profile_path,
+    set_torch_threads,
+)
+from commonforms.inference import Detector, load_detector, render_pdf
+from commonforms.utils import Page
+
+import itertools
+import logging
+import multiprocessing
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def thread_counts(cores: int) -> list[int]:
+    """Powers of two below `cores`, and `cores` itself."""
+    counts = [1 << i for i in range(cores.bit_length()) if 1 << i < cores]
+    return counts + [cores]
+
+
+def sample_pages(pdfs: list[Path], num_pages: int, detector: Detector) -> list[Page]:
+    """
+    The first `num_pages` pages of `pdfs`, repeated if they have fewer, rendered
+    for `detector`.
+    """
+    pages = []
+    for pdf in pdfs:
+        pages.extend(
+            render_pdf(
+                str(pdf),
+                max_pages=num_pages - len(pages),
+                vectors=detector.needs_vectors,
+                images=detector.needs_images,
+            )
+        )
+        if len(pages) >= num_pages:
+            break
+    if not pages:
+        raise ValueError("No pages to benchmark on")
+    return list(itertools.islice(itertools.cycle(pages), num_pages))
+
+
+def measure(
+    config: EvalConfig,
+    pdfs: list[Path],
+    intra_op_threads: int,
+    inter_op_threads: int = 1,
+    batch_sizes: tuple[int, ...] = (1, 2, 4, 8),
+    num_pages: int = 16,
+    device: int | str = "cpu",
+    confidence: float = 0.3,
+) -> list[Setting]:
+    """
+    Time `config` on `num_pages` pages of `pdfs` at each batch size, with these
+    thread counts. A batch is run before timing starts, so the lazy
+    initialization of the model is left out.
+    """
+    # before the model is loaded, while torch can still size its inter-op pool
+    set_torch_threads(intra_op_threads, inter_op_threads)
+    detector = load_detector(
+        config.model, device=device, fast=config.fast, int8=config.int8
+    )
+    detector.set_threads(intra_op_threads, inter_op_threads)
+    pages = sample_pages(pdfs, num_pages, detector)
+
+    settings = []
+    for batch_size in batch_sizes:
+        kwargs = dict(
+            confidence=confidence, image_size=config.image_size, batch_size=batch_size
+        )
+        detector.detect(pages[:batch_size], **kwargs)
+        start = time.perf_counter()
+        detector.detect(pages, **kwargs)
+        elapsed = time.perf_counter() - start
+        settings.append(
+            Setting(
+                batch_size=batch_size,
+                intra_op_threads=intra_op_threads,
+                inter_op_threads=inter_op_threads,
+                pages_per_second=len(pages) / elapsed,
+            )
+        )
+        logger.info(
+            f"  {config}: {settings[-1]}: {settings[-1].pages_per_second:.2f} pages/s"
+        )
+    return settings
+
+
+def tune(
+    config: EvalConfig,
+    pdfs: list[Path],
+    max_cores: int | None = None,
+    batch_sizes: tuple[int, ...] = (1, 2, 4, 8),
+    num_pages: int = 16,
+    device: int | str = "cpu",
+    isolate: bool = True,
+) -> list[Setting]:
+    """Every setting measured for `config`, using at most `max_cores` cores."""
+
+    def run(*args, **kwargs):
+        if not isolate:
+            return measure(*args, **kwargs)
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            return executor.submit(measure, *args, **kwargs).result()
+
+    settings = []
+    for threads in thread_counts(max_cores or available_cores()):
+        measured = run(
+            config,
+            pdfs,
+            threads,
+            1,
+            batch_sizes=batch_sizes,
+            num_pages=num_pages,
+            device=device,
+        )
+        settings.extend(measured)
+        if threads > 1:
+            best = max(measured, key=lambda s: s.pages_per_second)
+            settings.extend(
+                run(
+                    config,
+                    pdfs,
+                    threads,
+                    2,
+                    batch_sizes=(best.batch_size,),
+                    num_pages=num_pages,
+                    device=device,
+                )
+            )
+    return settings
+
+
+def format_table(key: str, settings: list[Setting]) -> str:
+    """The settings for `key` as a text table, fastest first, with the best starred."""
+    lines = [
+        f"  {'detector':<24} {'batch':>5} {'intra':>5} {'inter':>5} {'pages/s':>8}"
+    ]
+    ranked = sorted(settings, key=lambda s: -s.pages_per_second)
+    for rank, setting in enumerate(ranked):
+        lines.append(
+            f"{'*' if rank == 0 else ' '} {key:<24} {setting.batch_size:5d} "
+            f"{setting.intra_op_threads:5d} {setting.inter_op_threads:5d} "
+            f"{setting.pages_per_second:8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(
+        prog="commonforms autotune",
+        description="Measure the fastest batch size and thread counts on this machine and save them as its hardware profile",
+    )
+    parser.add_argument(
+        "pdfs",
+        type=Path,
+        nargs="+",
+        help="PDFs to benchmark on, ideally typical of the documents you run",
+    )
+    parser.add_argument(
+        "--config",
+        type=EvalConfig.parse,
+        action="append",
+        dest="configs",
+        default=None,
+        help="Detector to tune, MODEL[:fast][:int8][@IMAGE_SIZE], e.g. FFDNet-L:fast@1600 (repeatable; default: FFDNet-L@1600, the CLI default)",
+    )
+    parser.add_argument(
+        "--max-cores",
+        type=int,
+        default=None,
+        dest="max_cores",
+        help="Only try up to this many threads (default: every core available)",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        dest="batch_sizes",
+        help="Batch sizes to try (default: 1 2 4 8)",
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=16,
+        help="Pages to time each setting on (default: 16)",
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help=f"Where to save the profile (default: {profile_path()}, where it's picked up automatically)",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    # add to this machine's profile, so tuning one detector keeps the others
+    profile = HardwareProfile.load(args.output) or HardwareProfile(
+        machine_id(), available_cores()
+    )
+    for config in args.configs or [EvalConfig("FFDNet-L", image_size=1600)]:
+        settings = tune(
+            config,
+            args.pdfs,
+            max_cores=args.max_cores,
+            batch_sizes=tuple(args.batch_sizes),
+            num_pages=args.pages,
+            device=args.device,
+        )
+        key = detector_key(config.model, config.fast, config.int8)
+        profile.add(key, settings)
+        print(format_table(key, settings))
+
+    profile.dump(args.output)
+    print(f"Saved the hardware profile to {args.output or profile_path()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""
+Work queues for spreading a large batch of PDFs across many worker processes
+and machines, with no coordination service beyond a file system.
+
+`SqliteQueue` keeps the queue in a SQLite database, for workers on one machine.
+`DirectoryQueue` keeps one small JSON file per job in a directory, and relies
+only on atomic renames, so it also works on a shared (e.g. NFS) file system
+where SQLite's locking can't be trusted.
+
+Workers claim a job by taking a lease on it, renew the lease while they work,
+and either complete the job or record a failure. A job whose lease runs out (its
+worker died) is handed to the next worker, and a failed job is retried until it
+has been attempted `max_attempts` times, after which it's kept with its errors.
+Outputs are written to a temporary file and renamed into place, and a job whose
+output already exists is skipped, so running a job twice is harmless.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATES = ("pending", "leased", "done", "failed")
+
+
+@dataclass
+class Job:
+    input: str
+    output: str
+    attempts: int = 0
+    worker: str | None = None
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def id(self) -> str:
+        return hashlib.sha1(f"{self.input}\0{self.output}".encode()).hexdigest()[:20]
+
+
+class WorkQueue:
+    """
+    The operations every queue supports. `claim` returns None once there is
+    nothing left to claim (although leased jobs may still come back if their
+    workers die).
+    """
+
+    def __init__(self, lease_seconds: float = 600, max_attempts: int = 3) -> None:
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def add(self, jobs: Iterable[tuple[str | Path, str | Path]]) -> int:
+        """Queue `(input, output)` pairs, skipping ones already queued."""
+        raise NotImplementedError
+
+    def claim(self, worker: str) -> Job | None:
+        raise NotImplementedError
+
+    def renew(self, job: Job) -> None:
+        """Extend the lease on a claimed job."""
+        raise NotImplementedError
+
+    def complete(self, job: Job) -> None:
+        raise NotImplementedError
+
+    def fail(self, job: Job, error: str) -> None:
+        """Record an error, and queue the job again if it has attempts left."""
+        raise NotImplementedError
+
+    def counts(self) -> dict[str, int]:
+        """The number of jobs in each state."""
+        raise NotImplementedError
+
+    def failures(self) -> list[Job]:
+        """Jobs that used up their attempts, with their errors."""
+        raise NotImplementedError
+
+
+class SqliteQueue(WorkQueue):
+    def __init__(
+        self, path: str | Path, lease_seconds: float = 600, max_attempts: int = 3
+    ) -> None:
+        super().__init__(lease_seconds, max_attempts)
+        self.path = Path(path)
+        with self.connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    input TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL,
+                    errors TEXT NOT NULL DEFAULT '[]'
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    @contextmanager
+    def connect(self):
+        # a connection per call, so the lease renewal thread can use the queue too;
+        # autocommit, with explicit transactions where several statements must agree
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def job(self, row: tuple) -> Job:
+        input, output, attempts, worker, errors = row
+        return Job(input, output, attempts, worker, json.loads(errors))
+
+    def add(self, jobs: Iterable[tuple[str | Path, str | Path]]) -> int:
+        jobs = [Job(str(input), str(output)) for input, output in jobs]
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            added = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO jobs (id, input, output) VALUES (?, ?, ?)",
+                [(job.id, job.input, job.output) for job in jobs],
+            )
+            added = db.total_changes - added
+            db.execute("COMMIT")
+        return added
+
+    def claim(self, worker: str) -> Job | None:
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # jobs whose workers died on their last attempt
+            db.execute(
+                """
+                UPDATE jobs SET state = 'failed',
+                    errors = json_insert(errors, '$[#]', 'lease expired on ' || worker)
+                WHERE state = 'leased' AND lease_until < ? AND attempts >= ?
+                """,
+                (now, self.max_attempts),
+            )
+            row = db.execute(
+                """
+                SELECT id FROM jobs
+                WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)
+                ORDER BY rowid LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                """
+                UPDATE jobs SET state = 'leased', attempts = attempts + 1,
+                    worker = ?, lease_until = ?
+                WHERE id = ?
+                """,
+                (worker, now + self.lease_seconds, row[0]),
+            )
+            job = db.execute(
+                "SELECT input, output, attempts, worker, errors FROM jobs WHERE id = ?",
+                row,
+            ).fetchone()
+            db.execute("COMMIT")
+        return self.job(job)
+
+    def renew(self, job: Job) -> None:
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?",
+                (time.time() + self.lease_seconds, job.id, job.worker),
+            )
+
+    def complete(self, job: Job) -> None:
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'done', lease_until = NULL WHERE id = ?",
+                (job.id,),
+            )
+
+    def fail(self, job: Job, error: str) -> None:
+        job.errors.append(error)
+        state = "failed" if job.attempts >= self.max_attempts else "pending"
+        with self.connect() as db:
+            db.execute(
+                """
+                UPDATE jobs SET state = ?, errors = ?, lease_until = NULL
+                WHERE id = ? AND worker = ?
+                """,
+                (state, json.dumps(job.errors), job.id, job.worker),
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {state: 0 for state in STATES} | dict(rows)
+
+    def failures(self) -> list[Job]:
+        with self.connect() as db:
+            rows = db.execute(
+                """
+                SELECT input, output, attempts, worker, errors FROM jobs
+                WHERE state = 'failed' ORDER BY rowid
+                """
+            ).fetchall()
+        return [self.job(row) for row in rows]
+
+
+class DirectoryQueue(WorkQueue):
+    """
+    Each job is a JSON file in `root/<state>/`. Claiming a job renames it from
+    `pending/` to `leased/`, which exactly one worker can do, and a lease is
+    the leased file's modification time, which its worker keeps touching.
+
+    On the way, the job is renamed to a hidden `.taken` file; one left behind by
+    a worker that died mid-claim is put back once its lease runs out.
+    """
+
+    def __init__(
+        self, root: str | Path, lease_seconds: float = 600, max_attempts: int = 3
+    ) -> None:
+        super().__init__(lease_seconds, max_attempts)
+        self.root = Path(root)
+        for state in STATES:
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+
+    def path(self, state: str, job: Job) -> Path:
+        return self.root / state / f"{job.id}.json"
+
+    def write(self, path: Path, job: Job) -> None:
+        # write-then-rename, so readers never see a half-written job
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(asdict(job)))
+        os.replace(tmp, path)
+
+    def read(self, path: Path) -> Job:
+        return Job(**json.loads(path.read_text()))
+
+    def names(self, state: str) -> list[str]:
+        return sorted(
+            name for name in os.listdir(self.root / state) if not name.startswith(".")
+        )
+
+    def add(self, jobs: Iterable[tuple[str | Path, str | Path]]) -> int:
+        added = 0
+        for input, output in jobs:
+            job = Job(str(input), str(output))
+            if any(self.path(state, job).exists() for state in STATES):
+                continue
+            self.write(self.path("pending", job), job)
+            added += 1
+        return added
+
+    def take(self, source: Path, worker: str) -> tuple[Job, Path] | None:
+        """
+        Atomically move `source` aside for `worker`, or None if another worker
+        got there first. The caller writes the job to its new state and then
+        deletes the returned path. The time it was taken goes in the name, since
+        a rename keeps the old modification time.
+        """
+        taken = source.with_name(f".{source.name}.{worker}.{time.time_ns()}.taken")
+        try:
+            os.rename(source, taken)
+            return self.read(taken), taken
+        except FileNotFoundError:
+            return None
+
+    def taken(self, state: str) -> list[Path]:
+        return [
+            self.root / state / name
+            for name in os.listdir(self.root / state)
+            if name.endswith(".taken")
+        ]
+
+    def recover(self, now: float) -> None:
+        """Put back the jobs taken by workers that died before moving them on."""
+        for state in ("pending", "leased"):
+            for taken in self.taken(state):
+                # `.{id}.json.{worker}.{ns}.taken`; worker IDs may contain dots
+                taken_at = int(taken.name.rsplit(".", 2)[1]) / 1e9
+                if taken_at + self.lease_seconds >= now:
+                    continue
+                original = taken.with_name(
+                    taken.name[1:].split(".json.", 1)[0] + ".json"
+                )
+                try:
+                    os.rename(taken, original)
+                except FileNotFoundError:
+                    # its worker finished after all, or another put it back
+                    continue
+                logger.warning(
+                    f"Recovered {original.name}, its worker died claiming it"
+                )
+
+    def claim(self, worker: str) -> Job | None:
+        now = time.time()
+        self.recover(now)
+        candidates = [self.root / "pending" / name for name in self.names("pending")]
+        for name in self.names("leased"):
+            path = self.root / "leased" / name
+            try:
+                if path.stat().st_mtime + self.lease_seconds < now:
+                    candidates.append(path)
+            except FileNotFoundError:
+                continue
+
+        for path in candidates:
+            taken = self.take(path, worker)
+            if taken is None:
+                continue
+            job, taken = taken
+            if path.parent.name == "leased" and job.attempts >= self.max_attempts:
+                # its worker died on the last attempt
+                job.errors.append(f"lease expired on {job.worker}")
+                self.write(self.path("failed", job), job)
+                taken.unlink(missing_ok=True)
+                continue
+            job.attempts += 1
+            job.worker = worker
+            self.write(self.path("leased", job), job)
+            try:
+                taken.unlink()
+            except FileNotFoundError:
+                # the claim took longer than a lease and the job was put back,
+                # so another worker may have it by now
+                if self.holds_lease(job):
+                    self.path("leased", job).unlink(missing_ok=True)
+                return None
+            return job
+        return None
+
+    def holds_lease(self, job: Job) -> bool:
+        """Whether `job.worker` still holds the lease on `job`."""
+        try:
+            return self.read(self.path("leased", job)).worker == job.worker
+        except FileNotFoundError:
+            return False
+
+    def renew(self, job: Job) -> None:
+        try:
+            os.utime(self.path("leased", job))
+        except FileNotFoundError:
+            # the lease ran out and someone else has the job; outputs are
+            # idempotent, so just carry on
+            pass
+
+    def complete(self, job: Job) -> None:
+        self.write(self.path("done", job), job)
+        # unless the lease ran out and another worker has the job
+        if self.holds_lease(job):
+            self.path("leased", job).unlink(missing_ok=True)
+
+    def fail(self, job: Job, error: str) -> None:
+        if not self.holds_lease(job):
+            logger.warning(f"Lost the lease on {job.input}, not recording the failure")
+            return
+        job.errors.append(error)
+        state = "failed" if job.attempts >= self.max_attempts else "pending"
+        self.write(self.path(state, job), job)
+        self.path("leased", job).unlink(missing_ok=True)
+
+    def counts(self) -> dict[str, int]:
+        counts = {state: len(self.names(state)) for state in STATES}
+        # jobs a worker is moving, or died moving
+        counts["leased"] += len(self.taken("pending")) + len(self.taken("leased"))
+        return counts
+
+    def failures(self) -> list[Job]:
+        return [self.read(self.root / "failed" / name) for name in self.names("failed")]
+
+
+def open_queue(location: str | Path, **kwargs) -> WorkQueue:
+    """A `SqliteQueue` for a `.db`/`.sqlite` path, otherwise a `DirectoryQueue`."""
+    if Path(location).suffix in (".db", ".sqlite", ".sqlite3"):
+        return SqliteQueue(location, **kwargs)
+    return DirectoryQueue(location, **kwargs)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Heartbeat:
+    """Renews the lease on `job` from a background thread until stopped."""
+
+    def __init__(self, queue: WorkQueue, job: Job) -> None:
+        self.queue = queue
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(max(self.queue.lease_seconds / 3, 1)):
+            try:
+                self.queue.renew(self.job)
+            except Exception:
+                logger.exception(f"Could not renew the lease on {self.job.input}")
+
+    def __enter__(self) -> Heartbeat:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(
+    queue: WorkQueue,
+    worker: str | None = None,
+    *,
+    model_or_path: str = "FFDetr",
+    device: int | str = "cpu",
+    fast: bool = False,
+    int8: bool = False,
+    cascade_to: str | None = None,
+    cascade_policy=None,
+    vector_prior: bool = False,
+    vector_policy=None,
+    max_cores: int | None = None,
+    max_jobs: int | None = None,
+    **kwargs,
+) -> int:
+    """
+    Claim and prepare jobs from `queue` until it's empty (or `max_jobs` have
+    run), loading the model once and reusing it for every document. The model
+    runs with this machine's hardware profile (see `commonforms autotune`),
+    within `max_cores` cores when several workers share a machine. Other
+    keyword arguments go to `prepare_form`, except `previous`, which only makes
+    sense for one document. Returns the number of jobs run.
+    """
+    from commonforms.inference import build_detector, prepare_form
+    from commonforms.instrumentation import NULL_OBSERVER
+
+    if kwargs.get("previous") is not None:
+        raise ValueError("previous detections are for one document, not a queue")
+
+    worker = worker or default_worker_id()
+    detector, ran = None, 0
+    while max_jobs is None or ran < max_jobs:
+        job = queue.claim(worker)
+        if job is None:
+            break
+        ran += 1
+
+        output = Path(job.output)
+        if output.exists():
+            logger.info(f"{job.output} already exists, skipping")
+            queue.complete(job)
+            continue
+
+        tmp = output.with_name(f".{output.name}.{worker}.tmp")
+        try:
+            with Heartbeat(queue, job):
+                if detector is None:
+                    detector = build_detector(
+                        model_or_path,
+                        device,
+                        fast,
+                        int8,
+                        cascade_to,
+                        cascade_policy,
+                        NULL_OBSERVER,
+                        vector_prior,
+                        vector_policy,
+                        max_cores,
+                    )
+                output.parent.mkdir(parents=True, exist_ok=True)
+                # the detector settings too, so the checkpoint and the
+                # deadline know what the detector was built with
+                prepare_form(
+                    job.input,
+                    tmp,
+                    model_or_path=model_or_path,
+                    device=device,
+                    fast=fast,
+                    int8=int8,
+                    cascade_to=cascade_to,
+                    cascade_policy=cascade_policy,
+                    vector_prior=vector_prior,
+                    vector_policy=vector_policy,
+                    max_cores=max_cores,
+                    detector=detector,
+                    **kwargs,
+                )
+                os.replace(tmp, output)
+        except Exception as e:
+            logger.exception(f"{job.input} failed (attempt {job.attempts})")
+            queue.fail(job, f"{type(e).__name__}: {e}")
+            tmp.unlink(missing_ok=True)
+            continue
+
+        queue.complete(job)
+        logger.info(f"{job.input} -> {job.output}")
+
+    return ran
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Free lists of preallocated NumPy arrays, keyed by shape and dtype, so the
+    per-page hot loops (rendering, model pre-processing) reuse the same memory
+    instead of allocating (and page-faulting in) a fresh full-page array each time.
+
+    Arrays from `acquire` are uninitialized. Pools are not thread-safe; give each
+    thread or process its own.
+    """
+
+    def __init__(self, max_bytes: int | None = 512 * 2**20) -> None:
+        # free arrays beyond this total are dropped rather than kept for reuse
+        self.max_bytes = max_bytes
+        self.free: dict[tuple, list[np.ndarray]] = defaultdict(list)
+        self.free_bytes = 0
+        self.allocations = 0
+        self.reuses = 0
+
+    def acquire(self, shape: tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype).str)
+        if self.free[key]:
+            array = self.free[key].pop()
+            self.free_bytes -= array.nbytes
+            self.reuses += 1
+            return array
+        self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array: np.ndarray) -> None:
+        if (
+            self.max_bytes is not None
+            and self.free_bytes + array.nbytes > self.max_bytes
+        ):
+            return
+        self.free[(array.shape, array.dtype.str)].append(array)
+        self.free_bytes += array.nbytes
+
+    @contextmanager
+    def borrow(self, shape: tuple[int, ...], dtype=np.uint8):
+        """Acquire an array for the duration of the `with` block."""
+        array = self.acquire(shape, dtype)
+        try:
+            yield array
+        finally:
+            self.release(array)
+
+    def clear(self) -> None:
+        self.free.clear()
+        self.free_bytes = 0
@@ -0,0 +1,117 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any
+
+from commonforms.utils import Widget, widget_from_row, widget_row
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+
+class Checkpoint:
+    """
+    Detections persisted as each batch of pages completes, so a run that is
+    interrupted (a preempted worker, a crash while writing the PDF) can pick up
+    where it left off instead of starting over.
+
+    Each document gets its own append-only JSON lines file in `directory`, named
+    by the document's SHA-256, so one directory can serve a whole queue of
+    documents. The first line records the document and the detection settings; a
+    checkpoint made with different settings is discarded rather than resumed.
+    A batch that was only partly written when the process died, or that is
+    damaged, is dropped along with everything after it.
+    """
+
+    def __init__(
+        self, directory: str | Path, sha256: str, config: dict[str, Any]
+    ) -> None:
+        self.directory = Path(directory)
+        self.path = self.directory / f"{sha256[:32]}.jsonl"
+        # round-tripped so it compares equal to the header read back from disk
+        self.header = json.loads(
+            json.dumps(
+                {
+                    "version": CHECKPOINT_FORMAT_VERSION,
+                    "sha256": sha256,
+                    "config": config,
+                }
+            )
+        )
+        self.fp = None
+
+    def load(self) -> dict[int, list[Widget]]:
+        """
+        The detections saved by a previous run with the same document and
+        settings, and open the checkpoint for appending.
+        """
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        results, end = {}, 0
+        if self.path.exists():
+            with open(self.path, "rb") as fp:
+                lines = fp.read().split(b"\n")
+            # the last element is whatever followed the last newline: empty, or
+            # a batch that was cut off
+            for line_ix, line in enumerate(lines[:-1]):
+                try:
+                    record = json.loads(line)
+                    if line_ix > 0:
+                        batch = {
+                            int(page_ix): [
+                                widget_from_row(row, int(page_ix)) for row in rows
+                            ]
+                            for page_ix, rows in record["pages"].items()
+                        }
+                except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+                    # everything from a damaged line on is detected again
+                    logger.warning(
+                        f"{self.path} is damaged at line {line_ix + 1}, resuming "
+                        "from the batches before it"
+                    )
+                    break
+                if line_ix == 0:
+                    if record != self.header:
+                        logger.warning(
+                            f"{self.path} was made with different settings, starting over"
+                        )
+                        break
+                else:
+                    results.update(batch)
+                end += len(line) + 1
+
+        if end == 0:
+            results = {}
+            with open(self.path, "w") as fp:
+                fp.write(json.dumps(self.header, separators=(",", ":")) + "\n")
+        else:
+            os.truncate(self.path, end)
+
+        self.fp = open(self.path, "a")
+        return results
+
+    def save(self, results: dict[int, list[Widget]]) -> None:
+        """Append a completed batch of pages, and make sure it's on disk."""
+        record = {
+            "pages": {
+                str(page_ix): [widget_row(widget) for widget in widgets]
+                for page_ix, widgets in results.items()
+            }
+        }
+        self.fp.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def remove(self) -> None:
+        """Delete the checkpoint once the document is done."""
+        self.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from dataclasses import dataclass
+
+from commonforms.utils import Detections
+
+import numpy as np
+
+
+@dataclass
+class EscalationPolicy:
+    """
+    Decides whether a page's cheap detections are good enough, or whether the
+    page should be re-run with a more expensive configuration.
+
+    A page escalates when too many of its detections are either low-confidence
+    (below `low_confidence`) or tiny (shorter side under `tiny_box_pixels` at
+    the resolution the model saw the page).
+    """
+
+    coarse_image_size: int = 640
+    low_confidence: float = 0.5
+    max_low_confidence_fraction: float = 0.25
+    tiny_box_pixels: float = 10.0
+    max_tiny_fraction: float = 0.2
+    # pages with fewer detections than this are never escalated on fractions alone
+    min_detections: int = 3
+
+    def low_confidence_fraction(self, detections: Detections) -> float:
+        if len(detections) == 0:
+            return 0.0
+        return float(np.mean(detections.confidence < self.low_confidence))
+
+    def tiny_fraction(
+        self, detections: Detections, width: int, height: int, model_resolution: int
+    ) -> float:
+        if len(detections) == 0:
+            return 0.0
+        # the models letterbox the longest side down to `model_resolution`
+        scale = model_resolution / max(width, height)
+        w = (detections.xyxyn[:, 2] - detections.xyxyn[:, 0]) * width * scale
+        h = (detections.xyxyn[:, 3] - detections.xyxyn[:, 1]) * height * scale
+        return float(np.mean(np.minimum(w, h) < self.tiny_box_pixels))
+
+    def should_escalate(
+        self, detections: Detections, width: int, height: int, model_resolution: int
+    ) -> tuple[bool, str]:
+        """Returns the decision along with a short human-readable reason."""
+        if len(detections) < self.min_detections:
+            return False, f"{len(detections)} detections"
+
+        low = self.low_confidence_fraction(detections)
+        tiny = self.tiny_fraction(detections, width, height, model_resolution)
+        reason = f"{low:.0%} low-confidence, {tiny:.0%} tiny"
+
+        escalate = (
+            low > self.max_low_confidence_fraction or tiny > self.max_tiny_fraction
+        )
+        return escalate, reason
+
+
+@dataclass
+class CascadePolicy:
+    """
+    Decides which pages a cheap detector hands off to a more expensive one.
+
+    The uncertainty of a page is the fraction of its detections whose confidence
+    falls within `margin` of the detection threshold, i.e. boxes the model was
+    barely willing to report. Pages whose uncertainty exceeds
+    `uncertainty_threshold` escalate.
+    """
+
+    uncertainty_threshold: float = 0.2
+    margin: float = 0.15
+    # whether pages where the small model found nothing at all should escalate;
+    # off by default since most empty pages really are empty (cover letters,
+    # instructions)
+    escalate_empty: bool = False
+
+    def uncertainty(self, detections: Detections, confidence: float) -> float:
+        if len(detections) == 0:
+            return 1.0 if self.escalate_empty else 0.0
+        return float(np.mean(detections.confidence < confidence + self.margin))
+
+
+@dataclass
+class VectorPolicy:
+    """
+    Decides which pages the vector candidates of `commonforms.vector` stand in
+    for the model on.
+
+    A page is trusted when it looks born-digital (at least `min_text_chars` of
+    text and raster images covering no more than `max_image_coverage` of it) and
+    its drawings propose at least `min_candidates` fields. The model runs on
+    every other page, and its boxes that overlap a same-class candidate by at
+    least `snap_iou` are snapped to the drawn geometry.
+    """
+
+    min_candidates: int = 3
+    min_text_chars: int = 20
+    max_image_coverage: float = 0.1
+    snap_iou: float = 0.5
+
+    def trust(
+        self, candidates: Detections, image_coverage: float, text_chars: int
+    ) -> tuple[bool, str]:
+        """Returns the decision along with a short human-readable reason."""
+        reason = (
+            f"{len(candidates)} vector candidates, {text_chars} characters, "
+            f"{image_coverage:.0%} images"
+        )
+        trusted = (
+            len(candidates) >= self.min_candidates
+            and text_chars >= self.min_text_chars
+            and image_coverage <= self.max_image_coverage
+        )
+        return trusted, reason
+
+
+# cheaper settings `DeadlinePolicy` falls back to, in the order it tries them:
+# drop test-time augmentation (and tiling/adaptive re-runs), switch to the ONNX
+# model, run at a lower resolution, and finally skip the model and keep only the
+# fields drawn on the page (see `commonforms.vector`)
+DEGRADATION_LEVELS = ("no-tta", "fast", "low-res", "vector")
+
+
+@dataclass
+class DeadlinePolicy:
+    """
+    Decides when a document is going to run over its time budget.
+
+    After every batch of pages, the time the remaining pages would take at the
+    speed of that batch is added to the time spent so far. When the projection
+    goes over `margin` of the budget (the rest is left for writing the PDF), the
+    remaining pages step down to the next of `levels` that changes anything, at
+    `degraded_image_size` for "low-res".
+    """
+
+    margin: float = 0.9
+    degraded_image_size: int = 640
+    levels: tuple[str, ...] = DEGRADATION_LEVELS
+
+    def over_budget(
+        self,
+        elapsed: float,
+        seconds_per_page: float,
+        remaining_pages: int,
+        time_budget: float,
+    ) -> tuple[bool, str]:
+        """Returns the decision along with a short human-readable reason."""
+        projected = elapsed + seconds_per_page * remaining_pages
+        reason = f"{projected:.1f}s projected for a {time_budget:g}s budget"
+        return projected > self.margin * time_budget, reason
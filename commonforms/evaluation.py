@@ -0,0 +1,533 @@
+"""
+Measure what a detection setting costs: run detector configurations over the
+pages of a COCO split built with the dataset prep scripts, and report per-class
+COCO-style AP and recall alongside pages/second and peak memory, marking the
+configurations on the speed/accuracy Pareto front.
+
+    python -m commonforms.evaluation val/annotations.json --images coco/images \\
+        --config FFDetr --config FFDNet-L:fast --config FFDNet-S:fast:int8@640
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from PIL import Image
+
+from commonforms.inference import Detector, batch, load_detector
+from commonforms.memory import MemoryMonitor
+from commonforms.utils import Detections, Page
+
+import csv
+import json
+import logging
+import multiprocessing
+import numpy as np
+import time
+
+# COCO's AP@[.5:.95]
+COCO_IOU_THRESHOLDS = tuple(np.linspace(0.5, 0.95, 10))
+
+
+def read_split_ids(csv_path: str | Path) -> set[str]:
+    """Read the document IDs from one of the dataset/{test,val}.csv split files."""
+    with open(csv_path, "r") as fp:
+        return {row[0].strip() for row in csv.reader(fp) if row}
+
+
+def ground_truth(image: dict, annotations: list[dict]) -> Detections:
+    """COCO annotations of one image as detections normalized to the image."""
+    scale = np.array([image["width"], image["height"]] * 2, dtype=np.float64)
+    xywh = np.array([a["bbox"] for a in annotations], dtype=np.float64).reshape(-1, 4)
+    xyxy = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+    return Detections(
+        xyxyn=xyxy / scale,
+        class_id=np.array([a["category_id"] for a in annotations], dtype=np.int64),
+        confidence=np.ones(len(annotations), dtype=np.float32),
+    )
+
+
+def read_page_records(coco_dir: Path):
+    """
+    The per-page records of a `dataset/generate_coco.py` output directory: from
+    the annotation shards of the PDFs in `manifest.jsonl`, or the per-page JSON
+    files of older versions.
+    """
+    manifest = coco_dir / "manifest.jsonl"
+    if not manifest.exists():
+        for json_path in sorted((coco_dir / "json").glob("*.json")):
+            with json_path.open("r") as fp:
+                yield json.load(fp)
+        return
+
+    with manifest.open("rb") as fp:
+        # a torn last line is a PDF that wasn't finished
+        entries = [json.loads(line) for line in fp if line.endswith(b"\n")]
+    for entry in sorted(entries, key=lambda e: e["name"]):
+        with (coco_dir / "annotations" / entry["shard"]).open("rb") as fp:
+            fp.seek(entry["offset"])
+            for line in fp.read(entry["length"]).splitlines():
+                yield json.loads(line)
+
+
+def read_coco_file(path: Path):
+    """The per-page records of a COCO annotations file, in image order."""
+    with path.open("r") as fp:
+        coco = json.load(fp)
+    annotations = {}
+    for annotation in coco["annotations"]:
+        annotations.setdefault(annotation["image_id"], []).append(annotation)
+    for image in coco["images"]:
+        yield {"image": image, "annotations": annotations.get(image["id"], [])}
+
+
+def load_coco_pages(
+    coco_path: str | Path,
+    split_ids: set[str] | None = None,
+    limit: int | None = None,
+    images_dir: str | Path | None = None,
+) -> list[tuple[Path, Detections]]:
+    """
+    Load (image path, ground truth) pairs from a dataset built by the scripts in
+    `dataset/`: either a COCO annotations file (e.g. `val/annotations.json` from
+    `split_dataset.py`) or the directory written by `generate_coco.py`.
+    Ground-truth boxes are normalized to the image, with a confidence of 1.
+
+    Images are looked up in `images_dir`, by default the `images/` directory next
+    to the annotations file, or in the dataset directory.
+    """
+    coco_path = Path(coco_path)
+    if coco_path.is_file():
+        records = read_coco_file(coco_path)
+        default_images = coco_path.parent / "images"
+    else:
+        records = read_page_records(coco_path)
+        default_images = coco_path / "images"
+    images_dir = Path(images_dir) if images_dir is not None else default_images
+
+    pages = []
+    for record in records:
+        image = record["image"]
+        # images are named {id}-{page}.jpg
+        if split_ids is not None and image["file_name"].split("-")[0] not in split_ids:
+            continue
+
+        pages.append(
+            (
+                images_dir / image["file_name"],
+                ground_truth(image, record["annotations"]),
+            )
+        )
+        if limit is not None and len(pages) >= limit:
+            break
+
+    return pages
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes, as an (N, M) matrix."""
+    ix0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-12)
+
+
+def match_thresholds(
+    predictions: Detections,
+    ground_truth: Detections,
+    iou_thresholds: tuple[float, ...],
+) -> np.ndarray:
+    """
+    Greedily match predictions (highest confidence first) to same-class ground
+    truth boxes at every IoU threshold at once. Returns a (thresholds,
+    predictions) boolean array of true-positive flags.
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    tp = np.zeros((len(thresholds), len(predictions)), dtype=bool)
+    if len(predictions) == 0 or len(ground_truth) == 0:
+        return tp
+
+    # one IoU matrix for every class and threshold; boxes of different classes
+    # never match, so matching all classes together is the same as one by one
+    iou = box_iou(predictions.xyxyn, ground_truth.xyxyn)
+    iou[predictions.class_id[:, None] != ground_truth.class_id[None, :]] = 0.0
+
+    rows = np.arange(len(thresholds))
+    taken = np.zeros((len(thresholds), len(ground_truth)), dtype=bool)
+    for i in np.argsort(-predictions.confidence, kind="stable"):
+        candidates = np.where(taken, 0.0, iou[i])
+        j = np.argmax(candidates, axis=1)
+        hit = candidates[rows, j] >= thresholds
+        tp[hit, i] = True
+        taken[rows[hit], j[hit]] = True
+
+    return tp
+
+
+def match(
+    predictions: Detections, ground_truth: Detections, iou_threshold: float
+) -> np.ndarray:
+    """
+    Greedily match predictions (highest confidence first) to same-class ground
+    truth boxes. Returns a boolean true-positive flag per prediction.
+    """
+    return match_thresholds(predictions, ground_truth, (iou_threshold,))[0]
+
+
+def average_precision(
+    tp: np.ndarray, confidence: np.ndarray, num_ground_truth: int
+) -> tuple[float, float]:
+    """COCO-style 101-point interpolated AP, along with the final recall."""
+    if num_ground_truth == 0:
+        return float("nan"), float("nan")
+    if len(tp) == 0:
+        return 0.0, 0.0
+
+    order = np.argsort(-confidence, kind="stable")
+    tp_cumsum = np.cumsum(tp[order])
+    fp_cumsum = np.cumsum(~tp[order])
+    recall = tp_cumsum / num_ground_truth
+    precision = tp_cumsum / (tp_cumsum + fp_cumsum)
+
+    # make precision monotonically decreasing, then sample at 101 recall points
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    points = np.linspace(0, 1, 101)
+    ix = np.searchsorted(recall, points, side="left")
+    sampled = np.where(
+        ix < len(precision), precision[np.minimum(ix, len(precision) - 1)], 0.0
+    )
+
+    return float(sampled.mean()), float(recall[-1])
+
+
+def evaluate(
+    predictions: list[Detections],
+    ground_truth: list[Detections],
+    class_names: dict[int, str],
+    iou_thresholds: tuple[float, ...] = (0.5,),
+) -> dict[str, dict[str, float]]:
+    """
+    Compute per-class AP (averaged over `iou_thresholds`) and recall (at the
+    first threshold) over a set of pages.
+    """
+    # match each page once, for all classes and thresholds
+    tps = [np.zeros((len(iou_thresholds), 0), dtype=bool)]
+    scores, classes = [np.zeros(0)], [np.zeros(0, dtype=np.int64)]
+    gt_classes = [np.zeros(0, dtype=np.int64)]
+    for pred, gt in zip(predictions, ground_truth):
+        tps.append(match_thresholds(pred, gt, iou_thresholds))
+        scores.append(pred.confidence)
+        classes.append(pred.class_id)
+        gt_classes.append(gt.class_id)
+    tp = np.concatenate(tps, axis=1)
+    scores = np.concatenate(scores)
+    classes = np.concatenate(classes)
+    gt_classes = np.concatenate(gt_classes)
+
+    metrics = {}
+    for class_id, name in class_names.items():
+        selected = classes == class_id
+        num_gt = int(np.count_nonzero(gt_classes == class_id))
+        aps, recalls = zip(
+            *(
+                average_precision(tp[t, selected], scores[selected], num_gt)
+                for t in range(len(iou_thresholds))
+            )
+        )
+        metrics[name] = {"ap": float(np.mean(aps)), "recall": recalls[0]}
+
+    valid = [m["ap"] for m in metrics.values() if not np.isnan(m["ap"])]
+    metrics["all"] = {
+        "ap": float(np.mean(valid)) if valid else float("nan"),
+        "recall": float(
+            np.nanmean([m["recall"] for m in metrics.values()])
+            if valid
+            else float("nan")
+        ),
+    }
+
+    return metrics
+
+
+def predict(
+    detector: Detector,
+    pages: list[tuple[Path, Detections]],
+    confidence: float,
+    batch_size: int = 4,
+    image_size: int = 1024,
+) -> tuple[list[Detections], float]:
+    """
+    Run `detector` over the page images, returning its detections and the seconds
+    spent in the model (decoding the images isn't counted).
+    """
+    predictions = []
+    elapsed = 0.0
+    for b in batch(pages, n=batch_size):
+        images = [Image.open(image_path).convert("RGB") for image_path, _ in b]
+        start = time.perf_counter()
+        predictions.extend(
+            detector.detect(
+                [
+                    Page(
+                        image=image,
+                        width=image.width,
+                        height=image.height,
+                        text_fragments=[],
+                    )
+                    for image in images
+                ],
+                confidence=confidence,
+                image_size=image_size,
+                batch_size=batch_size,
+            )
+        )
+        elapsed += time.perf_counter() - start
+
+    return predictions, elapsed
+
+
+@dataclass
+class EvalConfig:
+    """
+    One detector setting to evaluate, written `MODEL[:fast][:int8][@IMAGE_SIZE]`,
+    e.g. `FFDNet-S:fast:int8@640`.
+    """
+
+    model: str
+    fast: bool = False
+    int8: bool = False
+    image_size: int = 1024
+
+    @classmethod
+    def parse(cls, spec: str) -> EvalConfig:
+        spec, _, image_size = spec.partition("@")
+        model, *flags = spec.split(":")
+        unknown = set(flags) - {"fast", "int8"}
+        if not model or unknown:
+            raise ValueError(f"Invalid configuration: {spec!r}")
+        return cls(
+            model,
+            fast="fast" in flags,
+            int8="int8" in flags,
+            image_size=int(image_size) if image_size else 1024,
+        )
+
+    def __str__(self) -> str:
+        flags = "".join(f":{flag}" for flag in ("fast", "int8") if getattr(self, flag))
+        return f"{self.model}{flags}@{self.image_size}"
+
+
+def run_config(
+    config: EvalConfig,
+    pages: list[tuple[Path, Detections]],
+    confidences: tuple[float, ...] = (0.4,),
+    batch_size: int = 4,
+    device: int | str = "cpu",
+) -> list[dict]:
+    """
+    Evaluate one configuration, returning a result per confidence threshold.
+
+    The detector runs once, at the lowest confidence, and the higher thresholds
+    are scored by dropping the detections below them. The first batch is run
+    before timing starts, so the pages/second leave out the lazy initialization
+    of the model; the peak memory includes loading it.
+    """
+    monitor = MemoryMonitor().start()
+    detector = load_detector(
+        config.model, device=device, fast=config.fast, int8=config.int8
+    )
+    lowest = min(confidences)
+    predict(detector, pages[:batch_size], lowest, batch_size, config.image_size)
+    predictions, elapsed = predict(
+        detector, pages, lowest, batch_size, config.image_size
+    )
+    peak_rss = monitor.stop()
+
+    truth = [gt for _, gt in pages]
+    results = []
+    for confidence in sorted(confidences):
+        metrics = evaluate(
+            [p[p.confidence >= confidence] for p in predictions],
+            truth,
+            detector.id_to_cls,
+            iou_thresholds=COCO_IOU_THRESHOLDS,
+        )
+        results.append(
+            {
+                "config": str(config),
+                **asdict(config),
+                "confidence": confidence,
+                "pages": len(pages),
+                "pages_per_second": len(pages) / elapsed if elapsed else float("nan"),
+                "peak_rss": peak_rss,
+                "metrics": metrics,
+            }
+        )
+    return results
+
+
+def pareto_front(results: list[dict]) -> list[bool]:
+    """
+    Which results are on the speed/accuracy Pareto front: no other result is at
+    least as fast and as accurate (mAP), and strictly better at one of them.
+    """
+    points = np.array(
+        [
+            [r["pages_per_second"], np.nan_to_num(r["metrics"]["all"]["ap"], nan=-1.0)]
+            for r in results
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    at_least = (points[None, :, :] >= points[:, None, :]).all(axis=2)
+    better = (points[None, :, :] > points[:, None, :]).any(axis=2)
+    return (~(at_least & better).any(axis=1)).tolist()
+
+
+def evaluate_configs(
+    configs: list[EvalConfig],
+    pages: list[tuple[Path, Detections]],
+    confidences: tuple[float, ...] = (0.4,),
+    batch_size: int = 4,
+    device: int | str = "cpu",
+    isolate: bool = True,
+) -> list[dict]:
+    """
+    Evaluate every configuration, each with `run_config`, and mark the results on
+    the Pareto front with `"pareto": True`.
+
+    With `isolate`, each configuration runs in a fresh process, so its peak
+    memory isn't inflated by the models that ran before it.
+    """
+    results = []
+    for config in configs:
+        if isolate:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                results.extend(
+                    executor.submit(
+                        run_config, config, pages, confidences, batch_size, device
+                    ).result()
+                )
+        else:
+            results.extend(run_config(config, pages, confidences, batch_size, device))
+
+    for result, on_front in zip(results, pareto_front(results)):
+        result["pareto"] = on_front
+    return results
+
+
+def format_table(results: list[dict]) -> str:
+    """The results as a text table, fastest first, with the Pareto front starred."""
+    class_names = (
+        [name for name in results[0]["metrics"] if name != "all"] if results else []
+    )
+    header = (
+        f"  {'config':<28} {'conf':>6} {'pages/s':>8} {'peak MiB':>9} "
+        f"{'mAP':>6} {'recall':>6}"
+        + "".join(f" {name + ' AP/R':>17}" for name in class_names)
+    )
+    lines = [header]
+    for result in sorted(results, key=lambda r: -r["pages_per_second"]):
+        peak = result["peak_rss"]
+        metrics = result["metrics"]
+        lines.append(
+            f"{'*' if result.get('pareto') else ' '} {result['config']:<28} "
+            f"{result['confidence']:6g} {result['pages_per_second']:8.2f} "
+            f"{peak / 2**20 if peak else float('nan'):9.0f} "
+            f"{metrics['all']['ap']:6.3f} {metrics['all']['recall']:6.3f}"
+            + "".join(
+                f" {metrics[name]['ap']:.3f}/{metrics[name]['recall']:.3f}".rjust(18)
+                for name in class_names
+            )
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(
+        prog="commonforms.evaluation",
+        description="Compare the speed and accuracy of detector configurations on a COCO split",
+    )
+    parser.add_argument(
+        "coco",
+        type=Path,
+        help="COCO annotations file (e.g. val/annotations.json from dataset/split_dataset.py) or a dataset/generate_coco.py output directory",
+    )
+    parser.add_argument(
+        "--images",
+        type=Path,
+        default=None,
+        help="Directory with the page images (default: images/ next to the annotations)",
+    )
+    parser.add_argument(
+        "--split",
+        type=Path,
+        default=None,
+        help="CSV of document IDs to evaluate on (e.g. dataset/val.csv)",
+    )
+    parser.add_argument(
+        "--config",
+        type=EvalConfig.parse,
+        action="append",
+        dest="configs",
+        default=None,
+        help="Configuration to evaluate, MODEL[:fast][:int8][@IMAGE_SIZE], e.g. FFDNet-S:fast@640 (repeatable; default: FFDetr)",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        nargs="+",
+        default=[0.4],
+        help="Confidence thresholds to score each configuration at (default: 0.4)",
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=None,
+        help="Only evaluate the first this many pages",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=4,
+        dest="batch_size",
+        help="Pages per model batch (default: 4)",
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--report", type=Path, default=None, help="Also write the results as JSON"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    split_ids = read_split_ids(args.split) if args.split else None
+    pages = load_coco_pages(
+        args.coco, split_ids=split_ids, limit=args.pages, images_dir=args.images
+    )
+    if not pages:
+        parser.error(f"No pages found in {args.coco}")
+
+    results = evaluate_configs(
+        args.configs or [EvalConfig("FFDetr")],
+        pages,
+        confidences=tuple(args.confidence),
+        batch_size=args.batch_size,
+        device=args.device,
+    )
+    print(f"{len(pages)} pages, AP averaged over IoU 0.50:0.95, recall at IoU 0.50")
+    print(format_table(results))
+    if args.report:
+        with args.report.open("w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,10 @@
 class EncryptedPdfError(Exception):
     pass
+
+
+class DetectionsVersionError(Exception):
+    pass
+
+
+class DetectionsMismatchError(Exception):
+    pass
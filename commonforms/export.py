@@ -0,0 +1,83 @@
+"""
+Export FFDetr (or any RF-DETR Medium checkpoint) to ONNX with a dynamic batch
+dimension, for `FFDetrDetector(..., fast=True)`.
+
+    python -m commonforms.export FFDetr
+
+`FFDetrDetector` does this automatically the first time the fast path is used, so
+running it by hand is only needed to pre-populate the cache (e.g. in a Docker build).
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from pathlib import Path
+
+from commonforms.utils import cache_dir
+
+import hashlib
+import shutil
+import tempfile
+
+
+def onnx_model_path(weights_path: str | Path) -> Path:
+    """
+    Where the ONNX export of a checkpoint is cached. The path of the checkpoint is
+    part of the name, so a new revision of the weights gets a new export.
+    """
+    weights_path = Path(weights_path).resolve()
+    digest = hashlib.sha1(str(weights_path).encode()).hexdigest()[:8]
+    return cache_dir() / f"{weights_path.stem}-{digest}.onnx"
+
+
+def export_ffdetr(weights_path: str | Path, output_path: str | Path) -> Path:
+    from rfdetr import RFDETRMedium
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    model = RFDETRMedium(pretrain_weights=str(weights_path), device="cpu")
+    with tempfile.TemporaryDirectory() as tmp:
+        exported = model.export(output_dir=tmp, dynamic_batch=True, verbose=False)
+        # write-then-rename, so a concurrent reader never sees a partial file
+        partial = output_path.with_suffix(".onnx.partial")
+        shutil.move(str(exported), partial)
+        partial.replace(output_path)
+
+    return output_path
+
+
+def main():
+    parser = ArgumentParser(
+        prog="commonforms.export",
+        description="Export FFDetr to ONNX for fast CPU inference",
+    )
+    parser.add_argument(
+        "model",
+        type=str,
+        nargs="?",
+        default="FFDetr",
+        help="FFDetr or a path to an RF-DETR Medium .pth checkpoint",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Where to write the .onnx file (default: the commonforms cache)",
+    )
+    args = parser.parse_args()
+
+    from huggingface_hub import hf_hub_download
+    from commonforms.inference import models
+
+    if args.model.upper() in ["FFDETR"]:
+        repo_id, filename = models[(args.model.upper(), False)]
+        weights_path = hf_hub_download(repo_id=repo_id, filename=filename)
+    else:
+        weights_path = args.model
+
+    path = export_ffdetr(weights_path, args.output or onnx_model_path(weights_path))
+    print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,121 @@
+from __future__ import annotations
 from pypdf import PdfWriter, PdfReader
 from pypdf.annotations import AnnotationDictionary
 from pypdf.generic import (
     NameObject,
     ArrayObject,
     NumberObject,
+    FloatObject,
     TextStringObject,
     DictionaryObject,
+    DecodedStreamObject,
+    IndirectObject,
 )
 
-from commonforms.utils import BoundingBox
+from pathlib import Path
 
+from commonforms.utils import BoundingBox, Widget
 
-def rect_for(bounding_box: BoundingBox, page) -> ArrayObject:
+import numpy as np
+import re
+
+
+def rects_for(bounding_boxes: list[BoundingBox], page) -> np.ndarray:
+    """
+    Vectorized version of `rect_for`: converts N normalized (top-left origin)
+    bounding boxes into an (N, 4) array of `[x0, y0, x1, y1]` rects in PDF user
+    space for the given page.
+    """
     # because the PDFs are rendered to images with the CropBox, we need to use
     # that as the offset for where we insert the widgets
     page = page.cropbox if page.cropbox else page.mediabox
     # here I'm flipping the page.top/page.bottom to change from top-left origin
     # to bottom-right origin; this results in a negative height, but the math
     # works out in the end
-    page_x0, page_y0, page_x1, page_y1 = (page.left, page.top, page.right, page.bottom)
-    page_width = page_x1 - page_x0
-    page_height = page_y1 - page_y0
-
-    x0 = page_x0 + (bounding_box.x0 * page_width)
-    y0 = page_y0 + (bounding_box.y1 * page_height)
-    x1 = page_x0 + (bounding_box.x1 * page_width)
-    y1 = page_y0 + (bounding_box.y0 * page_height)
-
-    if x0 > x1:
-        x0, x1 = x1, x0
-    if y0 > y1:
-        y0, y1 = y1, y0
-
-    return ArrayObject(
-        [
-            NumberObject(x0),
-            NumberObject(y0),
-            NumberObject(x1),
-            NumberObject(y1),
-        ]
+    page_x0, page_y0, page_x1, page_y1 = (
+        float(page.left),
+        float(page.top),
+        float(page.right),
+        float(page.bottom),
+    )
+
+    boxes = np.array(
+        [[b.x0, b.y0, b.x1, b.y1] for b in bounding_boxes], dtype=np.float64
+    ).reshape(-1, 4)
+
+    xs = page_x0 + boxes[:, [0, 2]] * (page_x1 - page_x0)
+    ys = page_y0 + boxes[:, [3, 1]] * (page_y1 - page_y0)
+
+    return np.stack(
+        [xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1
     )
 
 
+def bounding_box_for(rect, page) -> BoundingBox:
+    """The inverse of `rect_for`: a PDF user space rect back to a normalized box."""
+    page = page.cropbox if page.cropbox else page.mediabox
+    left, top, right, bottom = (
+        float(page.left),
+        float(page.top),
+        float(page.right),
+        float(page.bottom),
+    )
+    x0, y0, x1, y1 = (float(v) for v in rect)
+    return BoundingBox(
+        x0=(min(x0, x1) - left) / (right - left),
+        y0=(top - max(y0, y1)) / (top - bottom),
+        x1=(max(x0, x1) - left) / (right - left),
+        y1=(top - min(y0, y1)) / (top - bottom),
+    )
+
+
+# the names `PyPdfFormCreator.add_widgets` gives the fields it creates
+WIDGET_NAME = re.compile(r"(textbox|choicebutton|signature)_(\d+)_(\d+)")
+WIDGET_TYPES = {
+    "textbox": "TextBox",
+    "choicebutton": "ChoiceButton",
+    "signature": "Signature",
+}
+
+
+def read_widgets(pdf_path: str | Path) -> dict[int, list[Widget]]:
+    """
+    Recover the widgets that `PyPdfFormCreator.add_widgets` wrote into a PDF,
+    by page and in their original order. Other fields are ignored.
+    """
+    reader = PdfReader(pdf_path)
+    widgets = {}
+    for page_ix, page in enumerate(reader.pages):
+        found = []
+        for annotation in page.get("/Annots") or []:
+            annotation = annotation.get_object()
+            if annotation.get("/Subtype") != "/Widget":
+                continue
+            match = WIDGET_NAME.fullmatch(str(annotation.get("/T", "")))
+            if match is None:
+                continue
+            found.append(
+                (
+                    int(match.group(3)),
+                    Widget(
+                        widget_type=WIDGET_TYPES[match.group(1)],
+                        bounding_box=bounding_box_for(annotation["/Rect"], page),
+                        page=page_ix,
+                    ),
+                )
+            )
+        widgets[page_ix] = [widget for _, widget in sorted(found, key=lambda f: f[0])]
+    return widgets
+
+
+def rect_for(bounding_box: BoundingBox, page) -> ArrayObject:
+    return rect_array(rects_for([bounding_box], page)[0])
+
+
+def rect_array(rect: np.ndarray) -> ArrayObject:
+    return ArrayObject([FloatObject(round(float(v), 2)) for v in rect])
+
+
 class Textbox(AnnotationDictionary):
     def __init__(
         self,
@@ -131,16 +205,96 @@ class PyPdfFormCreator:
         )
         self.zapf_font = self.writer._add_object(zapf_font)
 
+        helv_font = DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+                NameObject("/Name"): NameObject("/Helv"),
+                NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+            }
+        )
+        self.helv_font = self.writer._add_object(helv_font)
+
+        # the checkbox appearances are shared by every checkbox in the document;
+        # they are drawn in a unit BBox, which viewers scale to each widget's /Rect
+        self.checkbox_appearance = self._checkbox_appearance()
+        self.acroform = self._acroform()
+        # whether the document's own fields were kept, and may need repairing
+        self.kept_existing_fields = True
+
+    def _checkbox_appearance(self) -> DictionaryObject:
+        def xobject(content: bytes) -> IndirectObject:
+            stream = DecodedStreamObject()
+            stream.set_data(content)
+            stream.update(
+                {
+                    NameObject("/Type"): NameObject("/XObject"),
+                    NameObject("/Subtype"): NameObject("/Form"),
+                    NameObject("/BBox"): ArrayObject(
+                        [
+                            NumberObject(0),
+                            NumberObject(0),
+                            NumberObject(1),
+                            NumberObject(1),
+                        ]
+                    ),
+                    NameObject("/Resources"): DictionaryObject(
+                        {
+                            NameObject("/Font"): DictionaryObject(
+                                {NameObject("/ZaDb"): self.zapf_font}
+                            )
+                        }
+                    ),
+                }
+            )
+            return self.writer._add_object(stream)
+
+        # ZapfDingbats "4" is the check mark glyph
+        on = xobject(b"q 0 g BT /ZaDb 0.8 Tf 0.1 0.2 Td (4) Tj ET Q")
+        off = xobject(b"")
+
+        return DictionaryObject(
+            {
+                NameObject("/N"): DictionaryObject(
+                    {NameObject("/Yes"): on, NameObject("/Off"): off}
+                ),
+            }
+        )
+
+    def _acroform(self) -> DictionaryObject:
+        """Find (or create) the AcroForm dictionary and register the shared fonts."""
+        root = self.writer._root_object
+        if NameObject("/AcroForm") not in root:
+            root[NameObject("/AcroForm")] = self.writer._add_object(DictionaryObject())
+        acroform = root[NameObject("/AcroForm")].get_object()
+
+        if NameObject("/Fields") not in acroform:
+            acroform[NameObject("/Fields")] = ArrayObject()
+        if NameObject("/DA") not in acroform:
+            acroform[NameObject("/DA")] = TextStringObject("/Helv 0 Tf 0 g")
+
+        if NameObject("/DR") not in acroform:
+            acroform[NameObject("/DR")] = DictionaryObject()
+        resources = acroform[NameObject("/DR")].get_object()
+        if NameObject("/Font") not in resources:
+            resources[NameObject("/Font")] = DictionaryObject()
+        fonts = resources[NameObject("/Font")].get_object()
+        # don't clobber fonts the original document already defines
+        fonts.setdefault(NameObject("/Helv"), self.helv_font)
+        fonts.setdefault(NameObject("/ZaDb"), self.zapf_font)
+
+        return acroform
+
+    @property
+    def fields(self) -> ArrayObject:
+        return self.acroform[NameObject("/Fields")].get_object()
+
     def clear_existing_fields(self):
         """Clear all existing form fields from the PDF."""
-        # Get the root form object if it exists
-        if hasattr(self.writer, "_root_object"):
-            root = self.writer._root_object
-            if NameObject("/AcroForm") in root:
-                acroform = root[NameObject("/AcroForm")]
-                if NameObject("/Fields") in acroform:
-                    # Replace with empty array to clear all fields
-                    acroform[NameObject("/Fields")] = ArrayObject()
+        # Replace with empty array to clear all fields
+        self.acroform[NameObject("/Fields")] = ArrayObject()
+        self.kept_existing_fields = False
 
         # Also clear widget annotations from each page
         for i in range(len(self.writer.pages)):
@@ -148,6 +302,63 @@ class PyPdfFormCreator:
             if NameObject("/Annots") in page:
                 page[NameObject("/Annots")] = ArrayObject()
 
+    def _attach(self, page: int, annotations: list[AnnotationDictionary]) -> None:
+        """
+        Insert the widget annotations into the page's /Annots and register them
+        directly in the AcroForm /Fields, so no document-wide reattach is needed.
+        """
+        page_obj = self.writer.pages[page]
+        if page_obj.annotations is None:
+            page_obj[NameObject("/Annots")] = ArrayObject()
+        annots = page_obj.annotations
+        fields = self.fields
+
+        for annotation in annotations:
+            annotation[NameObject("/P")] = page_obj.indirect_reference
+            ref = self.writer._add_object(annotation)
+            annots.append(ref)
+            fields.append(ref)
+
+    def _checkbox(self, name: str, rect: ArrayObject) -> Checkbox:
+        checkbox = Checkbox(name=name, rect=rect)
+        checkbox[NameObject("/AP")] = self.checkbox_appearance
+        checkbox[NameObject("/DA")] = TextStringObject("/ZaDb 0 Tf 0 g")
+        return checkbox
+
+    def add_widgets(
+        self,
+        page: int,
+        widgets: list[Widget],
+        multiline: bool = False,
+        use_signature_fields: bool = False,
+    ) -> None:
+        """
+        Add all of the widgets for a single page at once. Rects are computed in
+        one vectorized pass and the fields are attached without per-widget page
+        lookups.
+        """
+        if not widgets:
+            return
+
+        rects = rects_for([w.bounding_box for w in widgets], self.writer.pages[page])
+
+        annotations = []
+        for i, (widget, rect) in enumerate(zip(widgets, rects)):
+            name = f"{widget.widget_type.lower()}_{widget.page}_{i}"
+            rect = rect_array(rect)
+
+            if widget.widget_type == "TextBox":
+                annotations.append(Textbox(name=name, rect=rect, multiline=multiline))
+            elif widget.widget_type == "ChoiceButton":
+                annotations.append(self._checkbox(name, rect))
+            elif widget.widget_type == "Signature":
+                if use_signature_fields:
+                    annotations.append(Signature(name=name, rect=rect))
+                else:
+                    annotations.append(Textbox(name=name, rect=rect))
+
+        self._attach(page, annotations)
+
     def add_text_box(
         self,
         name: str,
@@ -157,20 +368,22 @@ class PyPdfFormCreator:
     ) -> None:
         rect = rect_for(bounding_box, self.writer.pages[page])
         textbox = Textbox(name=name, rect=rect, multiline=multiline)
-        self.writer.add_annotation(page_number=page, annotation=textbox)
+        self._attach(page, [textbox])
 
     def add_checkbox(self, name: str, page: int, bounding_box: BoundingBox) -> None:
         rect = rect_for(bounding_box, self.writer.pages[page])
-        checkbox = Checkbox(name=name, rect=rect)
-        self.writer.add_annotation(page_number=page, annotation=checkbox)
+        self._attach(page, [self._checkbox(name, rect)])
 
     def add_signature(self, name: str, page: int, bounding_box: BoundingBox) -> None:
         rect = rect_for(bounding_box, self.writer.pages[page])
         signature = Signature(name=name, rect=rect)
-        self.writer.add_annotation(page_number=page, annotation=signature)
+        self._attach(page, [signature])
 
     def save(self, output_path: str) -> None:
-        self.writer.reattach_fields()
+        if self.kept_existing_fields:
+            # the widgets added here are registered already, but the document's
+            # own may be on a page's /Annots and missing from /Fields
+            self.writer.reattach_fields()
         with open(output_path, "wb") as fp:
             self.writer.write(fp)
 
@@ -0,0 +1,171 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from commonforms.utils import cache_dir
+
+import json
+import logging
+import onnxruntime
+import os
+import platform
+
+logger = logging.getLogger(__name__)
+
+HARDWARE_PROFILE_VERSION = 2
+
+# what `prepare_form` runs with when neither the caller nor a profile picks one
+DEFAULT_BATCH_SIZE = 4
+
+
+def profile_path() -> Path:
+    """Where `commonforms autotune` saves the hardware profile of this machine."""
+    return cache_dir() / "hardware.json"
+
+
+def available_cores() -> int:
+    """Cores this process may run on (its CPU affinity, where the OS has one)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def machine_id() -> str:
+    """
+    The CPU model and core count. Profiles are only used on a machine with the
+    same ID, so a cache directory shared between machines doesn't apply one
+    machine's profile to another.
+    """
+    model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as fp:
+            for line in fp:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model} x{available_cores()}"
+
+
+def detector_key(model_or_path: str, fast: bool = False, int8: bool = False) -> str:
+    """How a detector's settings are keyed in a profile, e.g. `FFDNET-L:fast`."""
+    flags = "".join(f":{flag}" for flag, on in (("fast", fast), ("int8", int8)) if on)
+    return f"{Path(model_or_path).name.upper()}{flags}"
+
+
+@dataclass
+class Setting:
+    """One measured batch size and thread configuration."""
+
+    batch_size: int
+    intra_op_threads: int
+    inter_op_threads: int = 1
+    pages_per_second: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"batch size {self.batch_size}, {self.intra_op_threads} intra-op/"
+            f"{self.inter_op_threads} inter-op threads"
+        )
+
+
+@dataclass
+class HardwareProfile:
+    """
+    The throughput of every setting `commonforms autotune` measured on a machine,
+    per detector. Keeping all of them, rather than only the fastest, lets a
+    worker limited to fewer cores pick the best setting that fits.
+    """
+
+    machine: str
+    cores: int
+    # detector key -> the settings measured for it
+    detectors: dict[str, list[dict]] = field(default_factory=dict)
+
+    def add(self, key: str, settings: list[Setting]) -> None:
+        self.detectors[key] = [asdict(setting) for setting in settings]
+
+    def best(self, key: str, max_cores: int | None = None) -> Setting | None:
+        """
+        The fastest setting for `key` using at most `max_cores` threads of either
+        kind, or None if nothing was measured for it within that.
+        """
+        settings = [Setting(**setting) for setting in self.detectors.get(key, [])]
+        if max_cores is not None:
+            settings = [
+                s
+                for s in settings
+                if s.intra_op_threads <= max_cores and s.inter_op_threads <= max_cores
+            ]
+        return max(settings, key=lambda s: s.pages_per_second, default=None)
+
+    def dump(self, path: str | Path | None = None) -> None:
+        path = Path(path or profile_path())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmp.open("w") as fp:
+            json.dump({"version": HARDWARE_PROFILE_VERSION, **asdict(self)}, fp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | Path | None = None) -> HardwareProfile | None:
+        """
+        The profile saved at `path` (default: `profile_path()`), or None if there
+        isn't one, or it was made on a different machine or by another version.
+        """
+        path = Path(path or profile_path())
+        try:
+            with path.open() as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable hardware profile {path}: {e}")
+            return None
+
+        if data.pop("version", None) != HARDWARE_PROFILE_VERSION:
+            logger.warning(f"Ignoring hardware profile {path} from another version")
+            return None
+        profile = cls(**data)
+        if profile.machine != machine_id():
+            logger.warning(
+                f"Ignoring hardware profile {path}, it was made on {profile.machine}; "
+                "run `commonforms autotune` on this machine"
+            )
+            return None
+        return profile
+
+
+def set_torch_threads(intra_op_threads: int, inter_op_threads: int = 1) -> None:
+    """
+    Set torch's thread pools, which are shared by the whole process. The inter-op
+    pool can only be sized before torch first uses it, so later changes to it are
+    skipped with a warning.
+    """
+    import torch
+
+    torch.set_num_threads(intra_op_threads)
+    if torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            logger.warning(
+                f"torch is already running, keeping "
+                f"{torch.get_num_interop_threads()} inter-op threads"
+            )
+
+
+def session_options(
+    intra_op_threads: int | None = None, inter_op_threads: int | None = None
+) -> onnxruntime.SessionOptions:
+    """ONNX Runtime session options with these thread counts (None: its default)."""
+    options = onnxruntime.SessionOptions()
+    if intra_op_threads is not None:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads is not None:
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            # the inter-op pool is only used to run independent nodes in parallel
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+    return options
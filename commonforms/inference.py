@@ -2,18 +2,76 @@ from __future__ import annotations
 from ultralytics import YOLO
 from pathlib import Path
 from huggingface_hub import hf_hub_download
+from huggingface_hub.errors import LocalEntryNotFoundError
 from rfdetr import RFDETRNano, RFDETRBase, RFDETRMedium, RFDETRLarge
 
-from commonforms.utils import BoundingBox, Page, TextFragment, Widget
-from commonforms.form_creator import PyPdfFormCreator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from typing import Callable, Sequence
+from multiprocessing.shared_memory import SharedMemory
+
+from commonforms.utils import (
+    BoundingBox,
+    Detections,
+    FormDetections,
+    Page,
+    TextFragment,
+    Widget,
+    cache_dir,
+    file_sha256,
+)
+from commonforms.form_creator import PyPdfFormCreator, read_widgets
 from commonforms.exceptions import EncryptedPdfError
-
+from commonforms.tiling import merge_tiles, needs_tiling, tile_windows
+from commonforms.escalation import (
+    CascadePolicy,
+    DeadlinePolicy,
+    EscalationPolicy,
+    VectorPolicy,
+)
+from commonforms.buffers import BufferPool
+from commonforms.checkpoint import Checkpoint
+from commonforms.memory import MemoryBudget, MemoryMonitor, MemoryPlan
+from commonforms.export import export_ffdetr, onnx_model_path
+from commonforms.hardware import (
+    DEFAULT_BATCH_SIZE,
+    HardwareProfile,
+    Setting,
+    detector_key,
+    session_options,
+    set_torch_threads,
+)
+from commonforms.vector import PageVectors, page_vectors, snap_to_candidates
+from commonforms.instrumentation import (
+    NULL_OBSERVER,
+    BatchEvent,
+    MultiObserver,
+    Observer,
+    PageEvent,
+    TraceObserver,
+)
+
+import ctypes
+import cv2
+import gc
+import hashlib
+import importlib.metadata
+import inspect
+import math
+import multiprocessing
+import numpy as np
+import onnxruntime
+import os
 import pypdfium2
 import logging
 import PIL
+import supervision
+import tempfile
+import time
 
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 
 # our mapping from (model_name_upper, fast) to (repo_id, filename) for the huggingface hub.
@@ -28,22 +86,423 @@ models = {
 }
 
 
+def quantized_model_path(model_name: str) -> Path:
+    """Path of the INT8 model written by `python -m commonforms.quantize`."""
+    _, filename = models[(model_name.upper(), True)]
+    return cache_dir() / filename.replace(".onnx", "-int8.onnx")
+
+
 def batch(lst: list, n: int = 8):
     l = len(lst)
     for ndx in range(0, l, n):
         yield lst[ndx : min(ndx + n, l)]
 
 
-class FFDetrDetector:
-    def __init__(self, model_or_path: str, device: int | str = "cpu") -> None:
+class Detector:
+    """
+    Shared driver for the detectors: subclasses implement `predict` for a batch of
+    images, and this class takes care of batching, optional tiling and turning
+    the raw detections into sorted `Widget`s.
+    """
+
+    id_to_cls = {0: "TextBox", 1: "ChoiceButton", 2: "Signature"}
+    observer: Observer = NULL_OBSERVER
+    # what `detect` needs from the pages: rendered images, and the field
+    # candidates from their drawings (see `render_pdf`)
+    needs_images = True
+    needs_vectors = False
+    # preferred model batch size, from the hardware profile (see `apply_profile`)
+    batch_size: int | None = None
+    # the ONNX variant a `Deadline` fell back to, kept for the next document
+    fast_fallback: Detector | None = None
+
+    def predict(
+        self,
+        images: list[PIL.Image.Image],
+        confidence: float,
+        image_size: int,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        raise NotImplementedError
+
+    def model_resolution(self, image_size: int) -> int:
+        """The side length (in pixels) the model actually runs at."""
+        return image_size
+
+    def supports_augment(self) -> bool:
+        """Whether `predict(..., augment=True)` runs test-time augmentation."""
+        return False
+
+    def runs_onnx(self) -> bool:
+        """Whether the model already runs on ONNX Runtime (see `fast`)."""
+        return False
+
+    def set_threads(self, intra_op_threads: int, inter_op_threads: int = 1) -> None:
+        """
+        Run the model with this many intra-op (within an operator) and inter-op
+        (between independent operators) threads. Torch's thread pools are shared
+        by the whole process; ONNX Runtime's belong to the detector's session.
+        """
+
+    def release_buffers(self) -> None:
+        """
+        Free the arrays kept for reuse between pages, so a detector reused across
+        documents doesn't hold on to them (see `BufferPool`).
+        """
+
+    def enable_profiling(self) -> bool:
+        """
+        Turn on the ONNX Runtime profiler for the session this detector owns, if it
+        has one. Returns whether profiling was enabled.
+        """
+        return False
+
+    def end_profiling(self) -> str | None:
+        """Stop the ONNX Runtime profiler and return the path of its JSON output."""
+        return None
+
+    def input_shape(
+        self, width: int, height: int, image_size: int
+    ) -> tuple[int, int] | None:
+        """
+        The (height, width) the model will run an image at, if the detector
+        cares. Images are batched by this shape, so batches never mix shapes.
+        """
+        return None
+
+    def detect(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        """
+        Run the model over every page, returning page-normalized detections.
+
+        If `tile_size` is set, pages larger than a tile are additionally split into
+        overlapping `tile_size` crops which are batched alongside the whole pages
+        and merged back with cross-tile NMS. Crops are cut lazily per batch, so
+        memory stays bounded by `batch_size` regardless of the number of tiles.
+
+        `augment` turns test-time augmentation on or off; None leaves it to the
+        detector's default.
+        """
+        # each job is (page_ix, window); a window of None is the whole page
+        jobs: list[tuple[int, tuple[int, int, int, int] | None]] = []
+        windows: dict[int, list[tuple[int, int, int, int]]] = {}
+        for page_ix, page in enumerate(pages):
+            jobs.append((page_ix, None))
+            if tile_size and needs_tiling(page.image, tile_size):
+                windows[page_ix] = tile_windows(
+                    page.image.width, page.image.height, tile_size, tile_overlap
+                )
+                jobs.extend((page_ix, window) for window in windows[page_ix])
+                logger.info(
+                    f"  Page {page_ix}: tiled into {len(windows[page_ix])} tiles"
+                )
+
+        def shape(job: tuple[int, tuple[int, int, int, int] | None]):
+            page_ix, window = job
+            if window is None:
+                width, height = pages[page_ix].image.size
+            else:
+                width, height = window[2] - window[0], window[3] - window[1]
+            return self.input_shape(width, height, image_size) or (0, 0)
+
+        # bucket by input shape so that every batch has a single shape and mixed
+        # orientations don't get padded up to each other
+        jobs.sort(key=shape)
+
+        outputs: dict[tuple[int, tuple[int, int, int, int] | None], Detections] = {}
+        for b in batch(jobs, n=batch_size):
+            images = [
+                pages[page_ix].image
+                if window is None
+                else pages[page_ix].image.crop(window)
+                for page_ix, window in b
+            ]
+            with self.observer.model_call(self):
+                start = time.perf_counter()
+                predictions = self.predict(
+                    images,
+                    confidence=confidence,
+                    image_size=image_size,
+                    augment=augment,
+                )
+            if self.observer.enabled:
+                self.observer.on_batch(
+                    BatchEvent(
+                        start=start,
+                        duration=time.perf_counter() - start,
+                        size=len(b),
+                        image_size=image_size,
+                        pages=sorted({page_ix for page_ix, _ in b}),
+                        tiles=sum(window is not None for _, window in b),
+                    )
+                )
+            for job, detections in zip(b, predictions):
+                outputs[job] = detections
+
+        results = []
+        for page_ix, page in enumerate(pages):
+            detections = outputs[(page_ix, None)]
+            if page_ix in windows:
+                detections = merge_tiles(
+                    page.image.width,
+                    page.image.height,
+                    windows[page_ix],
+                    [outputs[(page_ix, window)] for window in windows[page_ix]],
+                    page_detections=detections,
+                )
+            results.append(detections)
+
+        return results
+
+    def to_widgets(self, detections: Detections, page_ix: int) -> list[Widget]:
+        widgets = [
+            Widget(
+                widget_type=self.id_to_cls[int(class_id)],
+                bounding_box=BoundingBox(
+                    x0=float(box[0]),
+                    y0=float(box[1]),
+                    x1=float(box[2]),
+                    y1=float(box[3]),
+                ),
+                page=page_ix,
+                confidence=float(score),
+            )
+            for class_id, box, score in zip(
+                detections.class_id, detections.xyxyn, detections.confidence
+            )
+        ]
+
+        # do our best to sort the widgets into something resembling reading
+        # order; this is important for being able to Tab/Shift-Tab back and
+        # forth to navigate the page.
+        return sort_widgets(widgets)
+
+    def detect_adaptive(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        policy: EscalationPolicy | None = None,
+    ) -> list[Detections]:
+        """
+        Coarse-to-fine detection: every page is first run at the policy's coarse
+        resolution without test-time augmentation, and only the pages the policy
+        flags are re-run at full `image_size` with the detector's default
+        augmentation. Detectors with a fixed input resolution escalate by tiling
+        the page instead.
+        """
+        policy = policy or EscalationPolicy()
+        coarse_size = min(policy.coarse_image_size, image_size)
+        coarse_resolution = self.model_resolution(coarse_size)
+        fine_resolution = self.model_resolution(image_size)
+
+        results = self.detect(
+            pages,
+            confidence=confidence,
+            image_size=coarse_size,
+            batch_size=batch_size,
+            augment=False,
+        )
+
+        escalated = []
+        for page_ix, (page, detections) in enumerate(zip(pages, results)):
+            escalate, reason = policy.should_escalate(
+                detections, page.image.width, page.image.height, coarse_resolution
+            )
+            logger.info(
+                f"  Page {page_ix}: {'escalating' if escalate else 'keeping coarse result'}"
+                f" at {coarse_resolution}px ({reason})"
+            )
+            if escalate:
+                escalated.append(page_ix)
+
+        if not escalated:
+            return results
+
+        if fine_resolution <= coarse_resolution and not self.supports_augment():
+            # nothing to gain from a re-run at the same resolution, so tile instead
+            tile_size = tile_size or fine_resolution
+
+        fine = self.detect(
+            [pages[page_ix] for page_ix in escalated],
+            confidence=confidence,
+            image_size=image_size,
+            batch_size=batch_size,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+        )
+        for page_ix, detections in zip(escalated, fine):
+            results[page_ix] = detections
+
+        logger.info(f"  Escalated {len(escalated)}/{len(pages)} pages")
+
+        return results
+
+    def extract_widgets(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tiled: bool = False,
+        tile_overlap: float = 0.2,
+        adaptive: bool = False,
+        escalation_policy: EscalationPolicy | None = None,
+        page_indices: Sequence[int] | None = None,
+        augment: bool | None = None,
+    ) -> dict[int, list[Widget]]:
+        """
+        Detect widgets on `pages`, keyed by page index. When only some of the
+        document's pages are passed, `page_indices` are their indices in it.
+        `augment` is passed to `detect` (adaptive detection decides for itself).
+        """
+        tile_size = self.model_resolution(image_size) if tiled else None
+        if adaptive:
+            results = self.detect_adaptive(
+                pages,
+                confidence=confidence,
+                image_size=image_size,
+                batch_size=batch_size,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                policy=escalation_policy,
+            )
+        else:
+            results = self.detect(
+                pages,
+                confidence=confidence,
+                image_size=image_size,
+                batch_size=batch_size,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                augment=augment,
+            )
+
+        widgets = {}
+        if page_indices is None:
+            page_indices = range(len(pages))
+        for page_ix, detections in zip(page_indices, results):
+            logger.info(f"  Page {page_ix}: {len(detections)} fields detected")
+            widgets[page_ix] = self.to_widgets(detections, page_ix)
+            if self.observer.enabled:
+                classes = {}
+                for widget in widgets[page_ix]:
+                    classes[widget.widget_type] = classes.get(widget.widget_type, 0) + 1
+                self.observer.on_page(
+                    PageEvent(
+                        stage="detect",
+                        page=page_ix,
+                        detections=len(detections),
+                        classes=classes,
+                    )
+                )
+
+        return widgets
+
+
+def predict_takes_shape(model) -> bool:
+    """
+    Whether `model.predict` takes an input `shape`. Older rfdetr versions accept
+    any keyword and silently run at the square default resolution instead.
+    """
+    return "shape" in inspect.signature(model.predict).parameters
+
+
+class FFDetrDetector(Detector):
+    # RF-DETR normalizes its inputs with the ImageNet statistics
+    means = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    stds = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    def __init__(
+        self,
+        model_or_path: str,
+        device: int | str = "cpu",
+        fast: bool = False,
+        rectangular: bool = True,
+    ) -> None:
         self.device = device
-        self.model = RFDETRMedium(
-            pretrain_weights=self.get_model_path(model_or_path), device=device
+        self.fast = fast
+        self.buffers = BufferPool()
+        # the ONNX export has fixed spatial dimensions, so it is always square
+        self.rectangular = rectangular and not fast
+
+        self.model_path = self.get_model_path(model_or_path, fast)
+        self.threads = (None, None)
+        if fast:
+            self.model = None
+            self.create_session()
+            self.resolution = self.session.get_inputs()[0].shape[2]
+            self.block_size = 1
+        else:
+            self.model = RFDETRMedium(pretrain_weights=self.model_path, device=device)
+            self.resolution = self.model.model.resolution
+            if self.rectangular and not predict_takes_shape(self.model):
+                logger.warning(
+                    "This rfdetr version can't run rectangular inputs, "
+                    "running pages square; upgrade rfdetr for better accuracy"
+                )
+                self.rectangular = False
+            # input dimensions must be divisible by the windowed patch grid
+            self.block_size = self.model.model_config.patch_size * getattr(
+                self.model.model_config, "num_windows", 1
+            )
+
+    def create_session(self, profiling: bool = False) -> None:
+        # threads and profiling can only be set when the session is created
+        options = session_options(*self.threads)
+        if profiling:
+            options.enable_profiling = True
+            options.profile_file_prefix = str(
+                Path(tempfile.gettempdir()) / "commonforms-ort"
+            )
+        self.session = onnxruntime.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
         )
 
-        self.id_to_cls = {0: "TextBox", 1: "ChoiceButton", 2: "Signature"}
+    def runs_onnx(self) -> bool:
+        return self.fast
+
+    def release_buffers(self) -> None:
+        self.buffers.clear()
+
+    def set_threads(self, intra_op_threads: int, inter_op_threads: int = 1) -> None:
+        self.threads = (intra_op_threads, inter_op_threads)
+        if self.fast:
+            self.create_session(
+                profiling=self.session.get_session_options().enable_profiling
+            )
+        else:
+            set_torch_threads(intra_op_threads, inter_op_threads)
+
+    def enable_profiling(self) -> bool:
+        if not self.fast:
+            return False
+        self.create_session(profiling=True)
+        return True
+
+    def end_profiling(self) -> str | None:
+        if not self.fast or not self.session.get_session_options().enable_profiling:
+            return None
+        return self.session.end_profiling()
 
-    def get_model_path(self, model_or_path: str) -> str:
+    def get_model_path(self, model_or_path: str, fast: bool = False) -> str:
+        """
+        Construct the path to the model weights based on:
+         (a) the requested model (in the package or external path)
+         (b) --fast (if enabled, use an ONNX export of the weights, which is
+             created and cached the first time it's needed)
+        """
         model_upper = model_or_path.upper()
         if model_upper in ["FFDETR"]:
             # download the model, will just use the cached version if it already exists
@@ -52,6 +511,13 @@ class FFDetrDetector:
         else:
             model_path = model_or_path
 
+        if fast and not model_path.endswith(".onnx"):
+            onnx_path = onnx_model_path(model_path)
+            if not onnx_path.exists():
+                logger.info(f"Exporting {model_or_path} to {onnx_path} (one time)")
+                export_ffdetr(model_path, onnx_path)
+            model_path = str(onnx_path)
+
         return model_path
 
     def resize(
@@ -64,73 +530,178 @@ class FFDetrDetector:
 
         return image.resize(size, PIL.Image.Resampling.LANCZOS)
 
-    def extract_widgets(
-        self,
-        pages: list[Page],
-        confidence: float = 0.4,
-        image_size: int = 1120,
-        batch_size: int = 3,
-    ) -> dict[int, list[Widget]]:
-        image_size = 1024
-        results = []
-        for b in batch([p.image for p in pages], n=batch_size):
-            predictions = self.model.predict(
-                b, threshold=confidence, device=self.device
-            )
-            if isinstance(predictions, list):
-                results.extend(predictions)
-            else:
-                results.append(predictions)
+    def model_resolution(self, image_size: int) -> int:
+        if self.fast:
+            # the ONNX export runs at its fixed export resolution
+            return self.resolution
+        return math.ceil(image_size / self.block_size) * self.block_size
 
-        widgets = {}
+    def input_shape(self, width: int, height: int, image_size: int) -> tuple[int, int]:
+        """
+        Scale the longest side to `image_size` and round both sides up to the
+        model stride, keeping the page's aspect ratio (rather than squashing
+        tall pages into a square).
+        """
+        if not self.rectangular:
+            size = self.model_resolution(image_size)
+            return (size, size)
+
+        scale = image_size / max(width, height)
+        return (
+            math.ceil(height * scale / self.block_size) * self.block_size,
+            math.ceil(width * scale / self.block_size) * self.block_size,
+        )
 
-        for page_ix, detections in enumerate(results):
-            logging.info(f"  Page {page_ix}: {len(detections)} fields detected")
-            detections = detections.with_nms(threshold=0.1, class_agnostic=True)
-            logging.info(f"\t\t{len(detections)} after nms")
-            widgets[page_ix] = []
+    def pad_to_shape(
+        self, image: PIL.Image.Image, shape: tuple[int, int]
+    ) -> PIL.Image.Image:
+        """
+        Pad the bottom/right of the page with white so it has exactly the aspect
+        ratio of `shape`, so that the stride rounding doesn't distort it.
+        """
+        height, width = shape
+        padded_width = max(image.width, round(image.height * width / height))
+        padded_height = max(image.height, round(image.width * height / width))
+        if (padded_width, padded_height) == image.size:
+            return image
 
-            for class_id, box in zip(detections.class_id, detections.xyxy):
-                x0, x1 = box[[0, 2]] / pages[page_ix].image.width
-                y0, y1 = box[[1, 3]] / pages[page_ix].image.height
+        canvas = PIL.Image.new("RGB", (padded_width, padded_height), (255, 255, 255))
+        canvas.paste(image.convert("RGB"), (0, 0))
+        return canvas
 
-                widget_type = self.id_to_cls[class_id]
+    def preprocess(self, image: PIL.Image.Image, out: np.ndarray) -> None:
+        """
+        Mirror `RFDETR.predict`: non-antialiased bilinear resize, then normalize,
+        writing the (3, resolution, resolution) result into `out`. All the
+        intermediate arrays come from `self.buffers`.
+        """
+        pixels = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+        size = (self.resolution, self.resolution)
+        with (
+            self.buffers.borrow(pixels.shape, np.float32) as scaled,
+            self.buffers.borrow((*size, 3), np.float32) as resized,
+        ):
+            np.divide(pixels, np.float32(255.0), out=scaled, dtype=np.float32)
+            cv2.resize(scaled, size, dst=resized, interpolation=cv2.INTER_LINEAR)
+            np.subtract(resized, self.means, out=resized)
+            np.divide(resized, self.stds, out=resized)
+            out[...] = resized.transpose(2, 0, 1)
+
+    def predict_onnx(
+        self, images: list[PIL.Image.Image], confidence: float, num_select: int = 300
+    ) -> list[supervision.Detections]:
+        """Run the ONNX export and apply the same top-k post-processing as RF-DETR."""
+        shape = (len(images), 3, self.resolution, self.resolution)
+        with self.buffers.borrow(shape, np.float32) as inputs:
+            for image, out in zip(images, inputs):
+                self.preprocess(image, out)
+            boxes, logits = self.session.run(
+                ["dets", "labels"], {self.session.get_inputs()[0].name: inputs}
+            )
 
-                widgets[page_ix].append(
-                    Widget(
-                        widget_type=widget_type,
-                        bounding_box=BoundingBox(x0=x0, y0=y0, x1=x1, y1=y1),
-                        page=page_ix,
-                    )
+        predictions = []
+        for image, image_boxes, image_logits in zip(images, boxes, logits):
+            num_classes = image_logits.shape[-1]
+            prob = (1 / (1 + np.exp(-image_logits))).reshape(-1)
+            topk = np.argsort(-prob, kind="stable")[:num_select]
+            scores = prob[topk]
+            keep = scores > confidence
+            topk, scores = topk[keep], scores[keep]
+
+            cx, cy, w, h = image_boxes[topk // num_classes].T
+            xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+            scale = np.array([image.width, image.height, image.width, image.height])
+            predictions.append(
+                supervision.Detections(
+                    xyxy=np.clip(xyxy, 0, 1) * scale,
+                    confidence=scores,
+                    class_id=topk % num_classes,
                 )
+            )
 
-            widgets[page_ix] = sort_widgets(widgets[page_ix])
+        return predictions
 
-        return widgets
+    def predict(
+        self,
+        images: list[PIL.Image.Image],
+        confidence: float,
+        image_size: int,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        if self.fast:
+            predictions = self.predict_onnx(images, confidence)
+        else:
+            predictions = [None] * len(images)
+            shapes = [self.input_shape(*image.size, image_size) for image in images]
+            # `Detector.detect` buckets by shape already, but be robust to callers
+            # that mix shapes in one batch
+            for shape in dict.fromkeys(shapes):
+                indices = [i for i, s in enumerate(shapes) if s == shape]
+                padded = [self.pad_to_shape(images[i], shape) for i in indices]
+                group = self.model.predict(
+                    padded, threshold=confidence, shape=shape, device=self.device
+                )
+                if not isinstance(group, list):
+                    group = [group]
+                for i, detections in zip(indices, group):
+                    predictions[i] = detections
+        results = []
+        for image, detections in zip(images, predictions):
+            detections = detections.with_nms(threshold=0.1, class_agnostic=True)
+            # boxes are in the (possibly padded) image's pixels, padding is at the
+            # bottom/right so normalizing by the original size is enough
+            scale = np.array([image.width, image.height, image.width, image.height])
+            results.append(
+                Detections(
+                    xyxyn=np.clip(detections.xyxy / scale, 0, 1),
+                    class_id=detections.class_id,
+                    confidence=detections.confidence,
+                )
+            )
+
+        return results
 
 
-class FFDNetDetector:
+class FFDNetDetector(Detector):
     def __init__(
-        self, model_or_path: str, device: int | str = "cpu", fast: bool = False
+        self,
+        model_or_path: str,
+        device: int | str = "cpu",
+        fast: bool = False,
+        int8: bool = False,
     ) -> None:
         self.device = device
-        self.fast = fast
+        # the INT8 models are ONNX exports, so they always take the fast path
+        self.fast = fast or int8
+        # ONNX Runtime options waiting for ultralytics to create its session
+        self.pending_options = None
 
-        model_path = self.get_model_path(model_or_path, device, fast)
-        self.model = YOLO(model_path, task="detect")
-
-        self.id_to_cls = {0: "TextBox", 1: "ChoiceButton", 2: "Signature"}
+        self.model_path = self.get_model_path(model_or_path, device, fast, int8)
+        self.model = YOLO(self.model_path, task="detect")
 
     def get_model_path(
-        self, model_or_path: str, device: int | str = "cpu", fast: bool = False
+        self,
+        model_or_path: str,
+        device: int | str = "cpu",
+        fast: bool = False,
+        int8: bool = False,
     ) -> str:
         """
         Construct the path to the model weights based on:
          (a) the requested model (in the package or external path)
          (b) --fast (if enabled, use ONNX, otherwise use pt)
+         (c) --int8 (if enabled, use the locally quantized ONNX model)
         """
         model_upper = model_or_path.upper()
-        if model_upper in ["FFDNET-S", "FFDNET-L"]:
+        if int8 and model_upper in ["FFDNET-S", "FFDNET-L"]:
+            model_path = quantized_model_path(model_upper)
+            if not model_path.exists():
+                raise FileNotFoundError(
+                    f"No INT8 model at {model_path}, create one with "
+                    f"`python -m commonforms.quantize {model_or_path} <coco_dir>`"
+                )
+            model_path = str(model_path)
+        elif model_upper in ["FFDNET-S", "FFDNET-L"]:
             # download the model, will just use the cached version if it already exists
             repo_id, filename = models[(model_upper, fast)]
             model_path = hf_hub_download(repo_id=repo_id, filename=filename)
@@ -139,55 +710,346 @@ class FFDNetDetector:
 
         return model_path
 
-    def extract_widgets(
-        self, pages: list[Page], confidence: float = 0.3, image_size: int = 1600
-    ) -> dict[int, list[Widget]]:
+    def model_resolution(self, image_size: int) -> int:
+        # the ONNX export only supports 1216
+        return 1216 if self.fast else image_size
+
+    def supports_augment(self) -> bool:
+        return not self.fast
+
+    def runs_onnx(self) -> bool:
+        return self.fast
+
+    def set_threads(self, intra_op_threads: int, inter_op_threads: int = 1) -> None:
+        # ultralytics pre- and post-processes with torch, even for ONNX models
+        set_torch_threads(intra_op_threads, inter_op_threads)
+        if self.fast:
+            self.pending_options = session_options(intra_op_threads, inter_op_threads)
+            self.replace_session()
+
+    def replace_session(self) -> None:
+        """
+        ultralytics creates its ONNX Runtime session, with the default options,
+        along with the predictor on the first prediction; swap in one with
+        `pending_options` once it exists.
+        """
+        predictor = getattr(self.model, "predictor", None)
+        backend = getattr(getattr(predictor, "model", None), "backend", None)
+        session = getattr(backend, "session", None)
+        if not isinstance(session, onnxruntime.InferenceSession):
+            return
+        backend.session = onnxruntime.InferenceSession(
+            self.model_path, self.pending_options, providers=session.get_providers()
+        )
+        self.pending_options = None
+
+    def predict(
+        self,
+        images: list[PIL.Image.Image],
+        confidence: float,
+        image_size: int,
+        augment: bool | None = None,
+    ) -> list[Detections]:
         if self.fast:
             # overrides the image size to 1216, since that's all ONNX supports
-            results = [
-                self.model.predict(
-                    p.image, iou=1, conf=confidence, augment=False, imgsz=1216
+            results = []
+            for image in images:
+                results.append(
+                    self.model.predict(
+                        image, iou=1, conf=confidence, augment=False, imgsz=1216
+                    )
                 )
-                for p in pages
-            ]
+                if self.pending_options is not None:
+                    self.replace_session()
         else:
             results = self.model.predict(
-                [p.image for p in pages],
+                images,
                 iou=0.1,
                 conf=confidence,
-                augment=True,
+                augment=True if augment is None else augment,
                 imgsz=image_size,
                 device=self.device,
             )
 
-        widgets = {}
-        for page_ix, result in enumerate(results):
+        detections = []
+        for result in results:
             if isinstance(result, list):
                 result = result[0]
-            # no predictions, skip page
+            # no predictions for this image
             if result is None or result.boxes is None:
+                detections.append(Detections.empty())
                 continue
 
-            widgets[page_ix] = []
-            for box in result.boxes.cpu().numpy():
-                x, y, w, h = box.xywhn[0]
-                cls_id = int(box.cls.item())
-                widget_type = self.id_to_cls[cls_id]
+            boxes = result.boxes.cpu().numpy()
+            detections.append(
+                Detections(
+                    xyxyn=boxes.xyxyn,
+                    class_id=boxes.cls.astype(np.int64),
+                    confidence=boxes.conf,
+                )
+            )
 
-                widgets[page_ix].append(
-                    Widget(
-                        widget_type=widget_type,
-                        bounding_box=BoundingBox.from_yolo(cx=x, cy=y, w=w, h=h),
-                        page=page_ix,
-                    )
+        return detections
+
+
+class CascadeDetector(Detector):
+    """
+    Runs a cheap detector (e.g. FFDNet-S) over every page, and re-runs only the
+    pages it is uncertain about with a more expensive one (e.g. FFDNet-L or
+    FFDetr). The number of escalated pages is logged and kept on
+    `pages_escalated`/`pages_seen`.
+    """
+
+    def __init__(
+        self,
+        small: Detector,
+        large: Detector,
+        policy: CascadePolicy | None = None,
+    ) -> None:
+        self.small = small
+        self.large = large
+        self.policy = policy or CascadePolicy()
+        self.batch_size = small.batch_size
+        self.pages_seen = 0
+        self.pages_escalated = 0
+
+    def model_resolution(self, image_size: int) -> int:
+        return self.small.model_resolution(image_size)
+
+    def runs_onnx(self) -> bool:
+        return self.small.runs_onnx() and self.large.runs_onnx()
+
+    def set_threads(self, intra_op_threads: int, inter_op_threads: int = 1) -> None:
+        self.small.set_threads(intra_op_threads, inter_op_threads)
+        self.large.set_threads(intra_op_threads, inter_op_threads)
+
+    def release_buffers(self) -> None:
+        self.small.release_buffers()
+        self.large.release_buffers()
+
+    def detect(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        kwargs = dict(
+            confidence=confidence,
+            image_size=image_size,
+            batch_size=batch_size,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            augment=augment,
+        )
+        self.small.observer = self.large.observer = self.observer
+        results = self.small.detect(pages, **kwargs)
+
+        escalated = []
+        for page_ix, detections in enumerate(results):
+            uncertainty = self.policy.uncertainty(detections, confidence)
+            escalate = uncertainty > self.policy.uncertainty_threshold
+            logger.info(
+                f"  Page {page_ix}: uncertainty {uncertainty:.2f}"
+                f"{', escalating' if escalate else ''}"
+            )
+            if escalate:
+                escalated.append(page_ix)
+
+        if escalated:
+            large = self.large.detect(
+                [pages[page_ix] for page_ix in escalated], **kwargs
+            )
+            for page_ix, detections in zip(escalated, large):
+                results[page_ix] = detections
+
+        self.pages_seen += len(pages)
+        self.pages_escalated += len(escalated)
+        logger.info(f"  Cascade escalated {len(escalated)}/{len(pages)} pages")
+
+        return results
+
+
+def page_vectors_of(page: Page) -> PageVectors:
+    if page.vectors is None:
+        raise ValueError(
+            "Vector candidates are missing: render the pages with `render_pdf(..., vectors=True)`"
+        )
+    return page.vectors
+
+
+class VectorDetector(Detector):
+    """
+    Proposes fields from the drawings and text of born-digital pages alone (see
+    `commonforms.vector`), with no model and without rendering the pages. It
+    only finds fields that are drawn, so it suits large runs where speed
+    matters more than recall.
+    """
+
+    needs_images = False
+    needs_vectors = True
+
+    def detect(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        results = []
+        for page in pages:
+            candidates = page_vectors_of(page).candidates
+            results.append(candidates[candidates.confidence >= confidence])
+        return results
+
+    def detect_adaptive(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        policy: EscalationPolicy | None = None,
+    ) -> list[Detections]:
+        # the drawings don't come in coarse and fine resolutions
+        return self.detect(pages, confidence=confidence)
+
+
+class VectorPriorDetector(Detector):
+    """
+    Uses the vector candidates of the pages (see `commonforms.vector`) as a
+    prior for `model`: pages the policy trusts keep their candidates and skip
+    the model, and on the others the model's boxes are snapped to the
+    candidates they match. The number of skipped pages is logged and kept on
+    `pages_skipped`/`pages_seen`.
+    """
+
+    needs_vectors = True
+
+    def __init__(self, model: Detector, policy: VectorPolicy | None = None) -> None:
+        self.model = model
+        self.policy = policy or VectorPolicy()
+        self.batch_size = model.batch_size
+        self.pages_seen = 0
+        self.pages_skipped = 0
+
+    def model_resolution(self, image_size: int) -> int:
+        return self.model.model_resolution(image_size)
+
+    def set_threads(self, intra_op_threads: int, inter_op_threads: int = 1) -> None:
+        self.model.set_threads(intra_op_threads, inter_op_threads)
+
+    def release_buffers(self) -> None:
+        self.model.release_buffers()
+
+    def supports_augment(self) -> bool:
+        return self.model.supports_augment()
+
+    def runs_onnx(self) -> bool:
+        return self.model.runs_onnx()
+
+    def input_shape(
+        self, width: int, height: int, image_size: int
+    ) -> tuple[int, int] | None:
+        return self.model.input_shape(width, height, image_size)
+
+    def detect(
+        self,
+        pages: list[Page],
+        confidence: float = 0.4,
+        image_size: int = 1024,
+        batch_size: int = 4,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        augment: bool | None = None,
+    ) -> list[Detections]:
+        self.model.observer = self.observer
+        results: list[Detections | None] = [None] * len(pages)
+        rest = []
+        for page_ix, page in enumerate(pages):
+            vectors = page_vectors_of(page)
+            trusted, reason = self.policy.trust(
+                vectors.candidates, vectors.image_coverage, vectors.text_chars
+            )
+            logger.info(
+                f"  Page {page_ix}: {reason}{', skipping the model' if trusted else ''}"
+            )
+            if trusted:
+                candidates = vectors.candidates
+                results[page_ix] = candidates[candidates.confidence >= confidence]
+            else:
+                rest.append(page_ix)
+
+        if rest:
+            detected = self.model.detect(
+                [pages[page_ix] for page_ix in rest],
+                confidence=confidence,
+                image_size=image_size,
+                batch_size=batch_size,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                augment=augment,
+            )
+            for page_ix, detections in zip(rest, detected):
+                results[page_ix] = snap_to_candidates(
+                    detections, pages[page_ix].vectors.candidates, self.policy.snap_iou
                 )
 
-            # do our best to sort the widgets into something resembling reading
-            # order; this is important for being able to Tab/Shift-Tab back and
-            # forth to navigate the page.
-            widgets[page_ix] = sort_widgets(widgets[page_ix])
+        skipped = len(pages) - len(rest)
+        self.pages_seen += len(pages)
+        self.pages_skipped += skipped
+        logger.info(f"  Vector prior skipped the model on {skipped}/{len(pages)} pages")
 
-        return widgets
+        return results
+
+
+def fast_model_ready(model_or_path: str) -> bool:
+    """
+    Whether `fast=True` can load `model_or_path` without exporting it to ONNX
+    first, which takes far longer than a deadline leaves.
+    """
+    model_upper = model_or_path.upper()
+    if model_upper in ["FFDNET-S", "FFDNET-L"] or model_or_path.endswith(".onnx"):
+        # ready-made exports
+        return True
+    if model_upper == "VECTOR" or "FFDNET" in model_upper:
+        return False
+    if model_upper == "FFDETR":
+        repo_id, filename = models[(model_upper, False)]
+        try:
+            model_path = hf_hub_download(
+                repo_id=repo_id, filename=filename, local_files_only=True
+            )
+        except LocalEntryNotFoundError:
+            return False
+    else:
+        model_path = model_or_path
+    return onnx_model_path(model_path).exists()
+
+
+def load_detector(
+    model_or_path: str,
+    device: int | str = "cpu",
+    fast: bool = False,
+    int8: bool = False,
+) -> Detector:
+    if int8 and "FFDNET" not in model_or_path.upper():
+        # rather than record a quantization that never happened
+        raise ValueError(
+            f"int8 is only available for FFDNet models, not {model_or_path}"
+        )
+    if model_or_path.lower() == "vector":
+        return VectorDetector()
+    if "FFDNET" in model_or_path.upper():
+        return FFDNetDetector(model_or_path, device=device, fast=fast, int8=int8)
+    return FFDetrDetector(model_or_path, device=device, fast=fast)
 
 
 def sort_widgets(widgets: list[Widget]) -> list[Widget]:
@@ -271,18 +1133,320 @@ def extract_text_fragments(page: pypdfium2.PdfPage) -> list[TextFragment]:
         textpage.close()
 
 
-def render_pdf(pdf_path: str) -> list[Page]:
+def bitmap_maker(allocate):
+    """
+    A pypdfium2 `bitmap_maker` that has pdfium render straight into the writable
+    buffer returned by `allocate(nbytes)`, instead of a freshly allocated one.
+    """
+
+    def make(width, height, format, rev_byteorder):
+        stride = width * pypdfium2.internal.BitmapTypeToNChannels[format]
+        buffer = (ctypes.c_ubyte * (stride * height)).from_buffer(
+            allocate(stride * height)
+        )
+        return pypdfium2.PdfBitmap.new_native(
+            width, height, format, rev_byteorder, buffer=buffer, stride=stride
+        )
+
+    return make
+
+
+def render_page(
+    page: pypdfium2.PdfPage, scale: float = 2, pool: BufferPool | None = None
+) -> PIL.Image.Image:
+    """
+    Render `page` to an RGB image. With a `pool`, pdfium renders into a reused
+    buffer (in RGB order, so PIL doesn't have to swap channels).
+    """
+    if pool is None:
+        return page.render(scale=scale).to_pil()
+
+    buffers = []
+
+    def allocate(nbytes: int) -> np.ndarray:
+        buffers.append(pool.acquire((nbytes,)))
+        return buffers[-1]
+
+    bitmap = page.render(
+        scale=scale, rev_byteorder=True, bitmap_maker=bitmap_maker(allocate)
+    )
+    try:
+        # PIL copies RGB data out of the buffer, but shares memory for the
+        # 4-channel modes, which must not outlive the pooled buffer
+        image = bitmap.to_pil()
+        return image if image.mode == "RGB" else image.convert("RGB")
+    finally:
+        bitmap.close()
+        for buffer in buffers:
+            pool.release(buffer)
+
+
+def page_sizes(pdf_path: str | Path) -> list[tuple[float, float]]:
+    """The (width, height) of every page in PDF points, without rendering."""
+    doc = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return [doc.get_page_size(page_ix) for page_ix in range(len(doc))]
+    finally:
+        doc.close()
+
+
+@dataclass
+class RenderedPage:
+    """A page rendered in a worker process, with its bitmap in shared memory."""
+
+    page_ix: int
+    shm_name: str
+    mode: str
+    width: int
+    height: int
+    stride: int
+    start: float
+    rendered: float
+    done: float
+    text_fragments: list[TextFragment]
+    vectors: PageVectors | None = None
+
+    def load(self) -> PIL.Image.Image:
+        """Copy the bitmap out of shared memory, and free the shared memory."""
+        shm = SharedMemory(name=self.shm_name)
+        try:
+            image = PIL.Image.frombytes(
+                self.mode,
+                (self.width, self.height),
+                shm.buf[: self.stride * self.height],
+                "raw",
+                self.mode,
+                self.stride,
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    def discard(self) -> None:
+        shm = SharedMemory(name=self.shm_name)
+        shm.close()
+        shm.unlink()
+
+
+def render_range(
+    pdf_path: str, page_indices: Sequence[int], scale: float, vectors: bool = False
+) -> list[RenderedPage]:
+    """
+    Worker for `render_pdf(..., workers=N)`: render `page_indices`
+    into one shared memory block each, so only their names cross the process
+    boundary rather than pickled bitmaps.
+    """
+    rendered_pages = []
+    doc = pypdfium2.PdfDocument(pdf_path)
+    try:
+        for page_ix in page_indices:
+            page = doc[page_ix]
+            start = time.perf_counter()
+            blocks = []
+
+            def allocate(nbytes: int) -> memoryview:
+                blocks.append(SharedMemory(create=True, size=max(nbytes, 1)))
+                return blocks[-1].buf
+
+            try:
+                # render straight into the shared memory, with no extra copy
+                bitmap = page.render(
+                    scale=scale, rev_byteorder=True, bitmap_maker=bitmap_maker(allocate)
+                )
+                shm = blocks[0]
+            except BaseException:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+                raise
+            bitmap.close()
+            rendered = time.perf_counter()
+            text_fragments = extract_text_fragments(page)
+            candidates = page_vectors(page) if vectors else None
+            page.close()
+            rendered_pages.append(
+                RenderedPage(
+                    page_ix=page_ix,
+                    shm_name=shm.name,
+                    mode=bitmap.mode,
+                    width=bitmap.width,
+                    height=bitmap.height,
+                    stride=bitmap.stride,
+                    start=start,
+                    rendered=rendered,
+                    done=time.perf_counter(),
+                    text_fragments=text_fragments,
+                    vectors=candidates,
+                )
+            )
+            # the bitmap exports a pointer into the block, which has to be
+            # released before the block can be closed
+            del bitmap
+            shm.close()
+    except BaseException:
+        for rendered_page in rendered_pages:
+            rendered_page.discard()
+        raise
+    finally:
+        doc.close()
+    return rendered_pages
+
+
+def report_page(
+    observer: Observer, page_ix: int, start: float, rendered: float, done: float
+) -> None:
+    if observer.enabled:
+        observer.on_page(
+            PageEvent(
+                stage="render", page=page_ix, start=start, duration=rendered - start
+            )
+        )
+        observer.on_page(
+            PageEvent(
+                stage="text", page=page_ix, start=rendered, duration=done - rendered
+            )
+        )
+
+
+def render_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    A pool of `workers` render processes, for `render_pdf(..., executor=...)` to
+    reuse across calls instead of starting its own each time.
+    """
+    # fork is much cheaper than re-importing torch in every worker, and the
+    # workers only ever touch pdfium
+    context = multiprocessing.get_context(
+        "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def render_pages_parallel(
+    pdf_path: str,
+    page_indices: Sequence[int],
+    scale: float,
+    workers: int,
+    observer: Observer = NULL_OBSERVER,
+    vectors: bool = False,
+    executor: ProcessPoolExecutor | None = None,
+) -> list[Page]:
+    # pdfium isn't thread-safe, so each process opens the document itself and
+    # renders a contiguous range; a few ranges per worker evens out slow pages
+    num_ranges = min(len(page_indices), workers * 4)
+    bounds = [len(page_indices) * i // num_ranges for i in range(num_ranges + 1)]
+
+    pages = []
+    with (
+        render_executor(min(workers, num_ranges))
+        if executor is None
+        else nullcontext(executor)
+    ) as executor:
+        futures = [
+            executor.submit(
+                render_range, pdf_path, page_indices[first:last], scale, vectors
+            )
+            for first, last in zip(bounds, bounds[1:])
+        ]
+        remaining, pending = list(futures), []
+        try:
+            # collect in submission order, so pages stay in document order
+            while remaining:
+                pending = remaining.pop(0).result()
+                while pending:
+                    rendered_page = pending.pop(0)
+                    image = rendered_page.load()
+                    report_page(
+                        observer,
+                        rendered_page.page_ix,
+                        rendered_page.start,
+                        rendered_page.rendered,
+                        rendered_page.done,
+                    )
+                    pages.append(
+                        Page(
+                            image=image,
+                            width=image.width,
+                            height=image.height,
+                            text_fragments=rendered_page.text_fragments,
+                            vectors=rendered_page.vectors,
+                        )
+                    )
+        except BaseException:
+            # free the bitmaps of every range that finished but was never loaded
+            for future in remaining:
+                future.cancel()
+            for future in remaining:
+                if not future.cancelled() and future.exception() is None:
+                    pending.extend(future.result())
+            for rendered_page in pending:
+                rendered_page.discard()
+            raise
+
+    return pages
+
+
+def render_pdf(
+    pdf_path: str,
+    observer: Observer = NULL_OBSERVER,
+    scale: float = 2,
+    first_page: int = 0,
+    max_pages: int | None = None,
+    workers: int = 1,
+    pool: BufferPool | None = None,
+    page_indices: Sequence[int] | None = None,
+    vectors: bool = False,
+    images: bool = True,
+    executor: ProcessPoolExecutor | None = None,
+) -> list[Page]:
+    """
+    Render `max_pages` pages (all by default) starting at `first_page`, or
+    exactly `page_indices` if given. With `workers` > 1, pages are rendered in
+    that many processes, from `executor` if given (see `render_executor`).
+
+    With `vectors`, each page also gets the field candidates from its drawings
+    (see `commonforms.vector`), read while the page is open anyway. Without
+    `images` nothing is rendered, and pages only have their text and vectors.
+    """
+    pool = pool or BufferPool()
     pages = []
     doc = pypdfium2.PdfDocument(pdf_path)
     try:
-        for page in doc:
-            image = page.render(scale=2).to_pil()
+        if page_indices is None:
+            last_page = len(doc) if max_pages is None else first_page + max_pages
+            page_indices = range(first_page, min(last_page, len(doc)))
+        if images and workers > 1 and len(page_indices) > 1:
+            return render_pages_parallel(
+                pdf_path,
+                page_indices,
+                scale,
+                workers,
+                observer=observer,
+                vectors=vectors,
+                executor=executor,
+            )
+
+        for page_ix in page_indices:
+            page = doc[page_ix]
+            start = time.perf_counter()
+            if images:
+                image = render_page(page, scale=scale, pool=pool)
+                width, height = image.width, image.height
+            else:
+                image = None
+                width, height = page.get_size()
+            rendered = time.perf_counter()
+            text_fragments = extract_text_fragments(page)
+            candidates = page_vectors(page) if vectors else None
+            page.close()
+            report_page(observer, page_ix, start, rendered, time.perf_counter())
             pages.append(
                 Page(
                     image=image,
-                    width=image.width,
-                    height=image.height,
-                    text_fragments=extract_text_fragments(page),
+                    width=width,
+                    height=height,
+                    text_fragments=text_fragments,
+                    vectors=candidates,
                 )
             )
         return pages
@@ -365,6 +1529,807 @@ def promote_signature_widgets(
     return results
 
 
+def plan_memory(
+    detector: Detector,
+    budget: MemoryBudget,
+    sizes: list[tuple[float, float]],
+    image_size: int,
+    batch_size: int,
+) -> MemoryPlan:
+    """Fit a document with pages of `sizes` (in points) and `detector` into `budget`."""
+    width, height = max(sizes, key=lambda s: s[0] * s[1], default=(612, 792))
+    scale = budget.render_scale
+    resolution = detector.model_resolution(image_size)
+    shape = detector.input_shape(
+        round(width * scale), round(height * scale), image_size
+    ) or (resolution, resolution)
+    return budget.plan(
+        sizes,
+        input_pixels=shape[0] * shape[1],
+        batch_size=batch_size,
+        model_side=max(shape),
+    )
+
+
+@contextmanager
+def tracing(observer: Observer | None, profile: str | Path | None, profile_model: bool):
+    """
+    Yield `observer` (or the null observer), plus a `TraceObserver` written to
+    `profile` on exit if one is given.
+    """
+    observer = observer or NULL_OBSERVER
+    if profile is None:
+        yield observer
+        return
+
+    trace = TraceObserver(profile_model=profile_model)
+    try:
+        yield MultiObserver(observer, trace)
+    finally:
+        # write the trace even if the document failed, that's when it's most useful
+        trace.write(profile)
+
+
+def apply_profile(
+    detector: Detector,
+    key: str,
+    max_cores: int | None = None,
+    profile: HardwareProfile | None = None,
+) -> Setting | None:
+    """
+    Set `detector`'s threads and preferred batch size to the fastest setting
+    `commonforms autotune` measured for `key` (see `detector_key`) that uses at
+    most `max_cores` cores. Without one, `max_cores` alone caps the threads.
+    Returns the setting applied, if any.
+    """
+    profile = profile or HardwareProfile.load()
+    setting = profile.best(key, max_cores) if profile is not None else None
+    if setting is not None:
+        logger.info(f"Hardware profile for {key}: {setting}")
+        detector.set_threads(setting.intra_op_threads, setting.inter_op_threads)
+        detector.batch_size = setting.batch_size
+    elif max_cores is not None:
+        detector.set_threads(max_cores)
+    return setting
+
+
+def build_detector(
+    model_or_path: str,
+    device: int | str,
+    fast: bool,
+    int8: bool,
+    cascade_to: str | None,
+    cascade_policy: CascadePolicy | None,
+    observer: Observer,
+    vector_prior: bool = False,
+    vector_policy: VectorPolicy | None = None,
+    max_cores: int | None = None,
+) -> Detector:
+    """
+    Load the detector for these settings, with the threads and batch size of
+    this machine's hardware profile applied.
+    """
+    with observer.stage("load_model"):
+        profile = HardwareProfile.load()
+        detector = load_detector(model_or_path, device=device, fast=fast, int8=int8)
+        apply_profile(
+            detector, detector_key(model_or_path, fast, int8), max_cores, profile
+        )
+        if cascade_to is not None:
+            # an INT8 FFDNet may escalate to FFDetr, which has no INT8 variant
+            large_int8 = int8 and "FFDNET" in cascade_to.upper()
+            large = load_detector(cascade_to, device=device, fast=fast, int8=large_int8)
+            apply_profile(
+                large, detector_key(cascade_to, fast, large_int8), max_cores, profile
+            )
+            detector = CascadeDetector(detector, large, policy=cascade_policy)
+        if vector_prior and not detector.needs_vectors:
+            detector = VectorPriorDetector(detector, policy=vector_policy)
+        detector.observer = observer
+    return detector
+
+
+class Deadline:
+    """
+    A document's time budget, counted from when the `Deadline` is created.
+    `detect_pages` checks it after every batch, and when the policy projects an
+    overrun, `degrade` steps the remaining pages down to cheaper settings (see
+    `DeadlinePolicy`). `degraded` maps each page that ran below the requested
+    settings to the level it ran at.
+
+    `load_fast` loads the ONNX variant of the model for the "fast" level; without
+    it, or when the model already runs on ONNX Runtime, that level is skipped.
+    The variant is kept on the detector it replaced, so a worker that reuses its
+    detector across documents only loads it once.
+    """
+
+    def __init__(
+        self,
+        time_budget: float,
+        policy: DeadlinePolicy | None = None,
+        load_fast: Callable[[], Detector] | None = None,
+    ) -> None:
+        self.time_budget = time_budget
+        self.policy = policy or DeadlinePolicy()
+        self.load_fast = load_fast
+        self.start = time.perf_counter()
+        self.levels = list(self.policy.levels)
+        self.level: str | None = None
+        self.degraded: dict[int, str] = {}
+
+    def over_budget(self, seconds_per_page: float, remaining_pages: int) -> bool:
+        """Whether the remaining pages need cheaper settings to fit the budget."""
+        if not remaining_pages or not self.levels:
+            return False
+        over, reason = self.policy.over_budget(
+            time.perf_counter() - self.start,
+            seconds_per_page,
+            remaining_pages,
+            self.time_budget,
+        )
+        if over:
+            logger.warning(f"Over the time budget: {reason}")
+        return over
+
+    def degrade(
+        self,
+        detector: Detector,
+        image_size: int,
+        tiled: bool,
+        adaptive: bool,
+        augment: bool | None,
+    ) -> tuple[Detector, int, bool, bool, bool | None]:
+        """
+        The settings of the next level that makes a difference, given the current
+        ones; they're returned unchanged once every level has been used.
+        """
+        while self.levels:
+            level = self.levels.pop(0)
+            if level == "no-tta":
+                if not (tiled or adaptive or detector.supports_augment()):
+                    continue
+                tiled = adaptive = augment = False
+            elif level == "fast":
+                if self.load_fast is None or detector.runs_onnx():
+                    continue
+                if detector.fast_fallback is None:
+                    try:
+                        detector.fast_fallback = self.load_fast()
+                    except Exception as e:
+                        logger.warning(f"Couldn't load the fast model: {e}")
+                        continue
+                fast = detector.fast_fallback
+                fast.observer = detector.observer
+                detector = fast
+            elif level == "low-res":
+                low = min(image_size, self.policy.degraded_image_size)
+                if detector.model_resolution(low) >= detector.model_resolution(
+                    image_size
+                ):
+                    continue
+                image_size = low
+            elif level == "vector":
+                if not detector.needs_images:
+                    continue
+                observer = detector.observer
+                detector = VectorDetector()
+                detector.observer = observer
+            else:
+                raise ValueError(f"Unknown degradation level: {level!r}")
+
+            self.level = level
+            logger.warning(f"Running the remaining pages at degradation level {level}")
+            break
+        return detector, image_size, tiled, adaptive, augment
+
+
+def start_deadline(
+    time_budget: float | None,
+    deadline_policy: DeadlinePolicy | None,
+    model_or_path: str,
+    device: int | str,
+    fast: bool,
+    int8: bool,
+    cascade_to: str | None,
+    cascade_policy: CascadePolicy | None,
+    vector_prior: bool,
+    vector_policy: VectorPolicy | None,
+    max_cores: int | None,
+) -> Deadline | None:
+    """
+    A `Deadline` for `time_budget` seconds starting now, which can fall back to
+    the ONNX variant of the model if it loads without an export.
+    """
+    if time_budget is None:
+        return None
+
+    load_fast = None
+    if not (fast or int8) and all(
+        fast_model_ready(model) for model in (model_or_path, cascade_to) if model
+    ):
+
+        def load_fast() -> Detector:
+            return build_detector(
+                model_or_path,
+                device,
+                True,
+                int8,
+                cascade_to,
+                cascade_policy,
+                NULL_OBSERVER,
+                vector_prior,
+                vector_policy,
+                max_cores,
+            )
+
+    return Deadline(time_budget, deadline_policy, load_fast)
+
+
+def detect_pages(
+    input_path: str | Path,
+    detector: Detector,
+    *,
+    confidence: float,
+    image_size: int,
+    batch_size: int | None,
+    tiled: bool,
+    adaptive: bool,
+    escalation_policy: EscalationPolicy | None,
+    memory_budget: MemoryBudget | None,
+    render_workers: int,
+    observer: Observer,
+    monitor: MemoryMonitor,
+    page_indices: Sequence[int] | None = None,
+    checkpoint: Checkpoint | None = None,
+    deadline: Deadline | None = None,
+) -> tuple[dict[int, list[Widget]], list[Page], MemoryPlan]:
+    """
+    Render and detect every page of `input_path`, or only `page_indices`. The
+    returned pages keep their text fragments, but their images have been released.
+    With a `checkpoint`, pages go a model batch at a time and each batch's
+    detections are saved as soon as it completes. Without a `batch_size`, the
+    detector's from the hardware profile is used.
+
+    With a `deadline`, pages also go a model batch at a time, and the remaining
+    pages fall back to cheaper settings when the deadline projects an overrun.
+    """
+    batch_size = batch_size or detector.batch_size or DEFAULT_BATCH_SIZE
+    try:
+        sizes = page_sizes(input_path)
+    except pypdfium2._helpers.misc.PdfiumError:
+        raise EncryptedPdfError
+    todo = list(range(len(sizes)) if page_indices is None else page_indices)
+
+    plan = MemoryPlan(scale=2, batch_size=batch_size)
+    if memory_budget is not None:
+        plan = plan_memory(
+            detector, memory_budget, [sizes[ix] for ix in todo], image_size, batch_size
+        )
+        logger.info(f"Memory plan: {plan}")
+
+    # render and detect `plan.pages_in_flight` pages at a time, dropping the
+    # bitmaps as soon as they're detected; without a budget that's one chunk
+    pages, results = [], {}
+    augment = None
+    workers = render_workers or os.cpu_count() or 1
+    # one pool for every chunk, rather than a new one per chunk
+    parallel = detector.needs_images and workers > 1 and len(todo) > 1
+    with (
+        render_executor(min(workers, len(todo))) if parallel else nullcontext()
+    ) as executor:
+        while len(pages) < len(todo):
+            chunk_start = time.perf_counter()
+            if checkpoint is not None or deadline is not None:
+                step = plan.batch_size
+            else:
+                step = plan.pages_in_flight
+            chunk_indices = todo[len(pages) :][:step]
+            with observer.stage("render") as stage, monitor.measure(stage):
+                try:
+                    chunk = render_pdf(
+                        input_path,
+                        observer=observer,
+                        scale=plan.scale,
+                        workers=workers,
+                        executor=executor,
+                        page_indices=chunk_indices,
+                        vectors=detector.needs_vectors,
+                        images=detector.needs_images,
+                    )
+                except pypdfium2._helpers.misc.PdfiumError:
+                    raise EncryptedPdfError
+                stage.pages = len(chunk)
+
+            with (
+                observer.stage("detect", pages=len(chunk)) as stage,
+                monitor.measure(stage),
+            ):
+                detected = detector.extract_widgets(
+                    chunk,
+                    confidence=confidence,
+                    image_size=image_size,
+                    batch_size=plan.batch_size,
+                    tiled=tiled,
+                    adaptive=adaptive,
+                    escalation_policy=escalation_policy,
+                    page_indices=chunk_indices,
+                    augment=augment,
+                )
+            results.update(detected)
+            if checkpoint is not None:
+                checkpoint.save(detected)
+
+            for page in chunk:
+                page.image = None
+            pages.extend(chunk)
+
+            if memory_budget is not None and monitor.window_peak > memory_budget.limit:
+                plan = plan.shrink()
+                logger.warning(
+                    f"Peak RSS {monitor.window_peak / 2**20:.0f} MiB is over the "
+                    f"memory budget, continuing with {plan}"
+                )
+
+            if deadline is not None:
+                if deadline.level is not None:
+                    deadline.degraded.update(
+                        dict.fromkeys(chunk_indices, deadline.level)
+                    )
+                seconds_per_page = (time.perf_counter() - chunk_start) / len(chunk)
+                if deadline.over_budget(seconds_per_page, len(todo) - len(pages)):
+                    detector, image_size, tiled, adaptive, augment = deadline.degrade(
+                        detector, image_size, tiled, adaptive, augment
+                    )
+
+    if deadline is not None and deadline.degraded:
+        logger.warning(
+            f"{len(deadline.degraded)} of {len(todo)} pages ran with cheaper "
+            "settings to fit the time budget"
+        )
+
+    return results, pages, plan
+
+
+FINGERPRINT_SCALE = 1
+
+
+def page_fingerprints(pdf_path: str | Path) -> list[str]:
+    """
+    A fingerprint of each page's content: a hash of a low-resolution grayscale
+    render with annotations and form fields left out, so a prepared form has
+    the same fingerprints as the document it was prepared from.
+    """
+    fingerprints = []
+    try:
+        doc = pypdfium2.PdfDocument(pdf_path)
+    except pypdfium2._helpers.misc.PdfiumError:
+        raise EncryptedPdfError
+    try:
+        for page in doc:
+            bitmap = page.render(
+                scale=FINGERPRINT_SCALE,
+                grayscale=True,
+                draw_annots=False,
+                may_draw_forms=False,
+            )
+            digest = hashlib.sha1(f"{bitmap.width}x{bitmap.height}:".encode())
+            digest.update(bitmap.buffer)
+            fingerprints.append(digest.hexdigest()[:16])
+            bitmap.close()
+            page.close()
+        return fingerprints
+    finally:
+        doc.close()
+
+
+def load_previous(previous: FormDetections | str | Path) -> FormDetections:
+    """
+    Previous detections for `previous=`: a `FormDetections`, a file saved from
+    one, or a PDF prepared by commonforms (whose fields are read back).
+    """
+    if isinstance(previous, FormDetections):
+        return previous
+    if str(previous).lower().endswith(".pdf"):
+        widgets = read_widgets(previous)
+        return FormDetections(
+            source=Path(previous).name,
+            sha256=file_sha256(previous),
+            num_pages=len(widgets),
+            model="",
+            fingerprints=page_fingerprints(previous),
+            widgets=widgets,
+        )
+    return FormDetections.load(previous)
+
+
+def carry_over(
+    previous: FormDetections, fingerprints: list[str]
+) -> dict[int, list[Widget]]:
+    """
+    The widgets of every page whose fingerprint matches a page of `previous`,
+    keyed by (and renumbered to) its index in the new document, so inserted,
+    removed and reordered pages are handled too.
+    """
+    if not previous.fingerprints:
+        logger.warning("Previous detections have no page fingerprints, not reusing")
+        return {}
+
+    previous_pages = {}
+    for page_ix, fingerprint in enumerate(previous.fingerprints):
+        previous_pages.setdefault(fingerprint, page_ix)
+
+    reused = {}
+    for page_ix, fingerprint in enumerate(fingerprints):
+        if fingerprint in previous_pages:
+            reused[page_ix] = [
+                widget.model_copy(update={"page": page_ix})
+                for widget in previous.widgets.get(previous_pages[fingerprint], [])
+            ]
+    return reused
+
+
+def reuse_previous(
+    input_path: str | Path,
+    previous: FormDetections | str | Path | None,
+    observer: Observer,
+) -> tuple[list[str], dict[int, list[Widget]]]:
+    """Fingerprint `input_path` and carry over what `previous` has for it."""
+    with observer.stage("fingerprint") as stage:
+        fingerprints = page_fingerprints(input_path)
+        stage.pages = len(fingerprints)
+    if previous is None:
+        return fingerprints, {}
+
+    reused = carry_over(load_previous(previous), fingerprints)
+    logger.info(
+        f"Reusing detections for {len(reused)} of {len(fingerprints)} pages, "
+        f"detecting {len(fingerprints) - len(reused)}"
+    )
+    return fingerprints, reused
+
+
+def resume(
+    input_path: str | Path,
+    checkpoint: Checkpoint,
+    results: dict[int, list[Widget]],
+    todo: list[int] | None,
+) -> list[int]:
+    """Add the pages `checkpoint` already has to `results`, and drop them from `todo`."""
+    done = checkpoint.load()
+    if done:
+        logger.info(
+            f"Resuming from {checkpoint.path}: {len(done)} pages already detected"
+        )
+    results.update(done)
+    if todo is None:
+        todo = range(len(page_sizes(input_path)))
+    return [ix for ix in todo if ix not in done]
+
+
+def detection_config(
+    image_size: int,
+    confidence: float,
+    fast: bool,
+    int8: bool,
+    tiled: bool,
+    adaptive: bool,
+    escalation_policy: EscalationPolicy | None,
+    cascade_to: str | None,
+    cascade_policy: CascadePolicy | None,
+    vector_prior: bool = False,
+    vector_policy: VectorPolicy | None = None,
+    time_budget: float | None = None,
+    deadline_policy: DeadlinePolicy | None = None,
+) -> dict:
+    """The settings that affect what gets detected, for provenance and checkpoints."""
+    config = {
+        "commonforms": package_version(),
+        "image_size": image_size,
+        "confidence": confidence,
+        "fast": fast,
+        "int8": int8,
+        "tiled": tiled,
+    }
+    if adaptive:
+        config["escalation_policy"] = asdict(escalation_policy or EscalationPolicy())
+    if cascade_to is not None:
+        config["cascade_to"] = cascade_to
+        config["cascade_policy"] = asdict(cascade_policy or CascadePolicy())
+    if vector_prior:
+        config["vector_policy"] = asdict(vector_policy or VectorPolicy())
+    if time_budget is not None:
+        config["time_budget"] = time_budget
+        config["deadline_policy"] = asdict(deadline_policy or DeadlinePolicy())
+    return config
+
+
+def text_pages(pdf_path: str | Path) -> list[Page]:
+    """Pages with only their text fragments (no images), without rendering."""
+    pages = []
+    try:
+        doc = pypdfium2.PdfDocument(pdf_path)
+    except pypdfium2._helpers.misc.PdfiumError:
+        raise EncryptedPdfError
+    try:
+        for page in doc:
+            width, height = page.get_size()
+            pages.append(
+                Page(
+                    image=None,
+                    width=width,
+                    height=height,
+                    text_fragments=extract_text_fragments(page),
+                )
+            )
+            page.close()
+        return pages
+    finally:
+        doc.close()
+
+
+def write_widgets(
+    input_path: str | Path,
+    output_path: str | Path,
+    results: dict[int, list[Widget]],
+    pages: list[Page],
+    *,
+    keep_existing_fields: bool,
+    use_signature_fields: bool,
+    multiline: bool,
+    signature_label_terms: tuple[str, ...],
+    observer: Observer,
+    monitor: MemoryMonitor,
+) -> None:
+    if use_signature_fields:
+        with observer.stage("promote_signatures", pages=len(pages)):
+            results = promote_signature_widgets(
+                pages, results, signature_label_terms=signature_label_terms
+            )
+
+    with observer.stage("write", pages=len(pages)) as stage, monitor.measure(stage):
+        writer = PyPdfFormCreator(input_path)
+        if not keep_existing_fields:
+            writer.clear_existing_fields()
+
+        for page_ix, widgets in results.items():
+            writer.add_widgets(
+                page_ix,
+                widgets,
+                multiline=multiline,
+                use_signature_fields=use_signature_fields,
+            )
+
+        with observer.stage("save", pages=len(pages)):
+            writer.save(output_path)
+        writer.close()
+
+
+def report_peak(monitor: MemoryMonitor, memory_budget: MemoryBudget | None) -> None:
+    peak = monitor.stop()
+    if peak is not None:
+        logger.info(
+            f"Peak RSS {peak / 2**20:.0f} MiB "
+            f"(budget {memory_budget.limit / 2**20:.0f} MiB)"
+        )
+
+
+def detect_form(
+    input_path: str | Path,
+    *,
+    model_or_path: str = "FFDetr",
+    device: int | str = "cpu",
+    image_size: int = 1024,
+    confidence: float = 0.4,
+    fast: bool = False,
+    batch_size: int | None = None,
+    tiled: bool = False,
+    adaptive: bool = False,
+    escalation_policy: EscalationPolicy | None = None,
+    cascade_to: str | None = None,
+    cascade_policy: CascadePolicy | None = None,
+    vector_prior: bool = False,
+    vector_policy: VectorPolicy | None = None,
+    time_budget: float | None = None,
+    deadline_policy: DeadlinePolicy | None = None,
+    int8: bool = False,
+    observer: Observer | None = None,
+    profile: str | Path | None = None,
+    profile_model: bool = False,
+    memory_budget: MemoryBudget | None = None,
+    render_workers: int = 1,
+    max_cores: int | None = None,
+    previous: FormDetections | str | Path | None = None,
+    checkpoint: str | Path | None = None,
+    keep_checkpoint: bool = False,
+    fingerprint: bool = False,
+    detector: Detector | None = None,
+) -> FormDetections:
+    """
+    Run detection on `input_path` without writing anything, returning widgets
+    that `apply_detections` can later write into the PDF (use `.dump(path)` to
+    save them).
+
+    With `previous` (detections of an earlier revision of the document, or a PDF
+    commonforms prepared from it), pages whose content hasn't changed keep their
+    previous widgets and only new or edited pages are detected. That needs the
+    page fingerprints, which take a low-resolution render of every page, so they
+    are only computed with `previous` or `fingerprint=True`; pass the latter for
+    detections that will be the `previous` of a later revision.
+
+    With a `checkpoint` directory, detections are saved there as they complete,
+    and a run that was interrupted resumes from them. The checkpoint is deleted
+    once detection finishes, unless `keep_checkpoint` leaves that to the caller
+    (once the detections are safely written somewhere).
+
+    With `vector_prior`, pages whose drawings account for their fields (see
+    `VectorPriorDetector`) skip the model; `model_or_path="vector"` skips it on
+    every page.
+
+    With a `time_budget` (in seconds), pages that would run past it fall back to
+    cheaper settings (see `DeadlinePolicy`); they're listed, with the settings
+    they ran at, in the result's `degraded`.
+
+    The model's threads and `batch_size` default to the fastest setting
+    `commonforms autotune` found for it on this machine, using at most
+    `max_cores` cores (see `apply_profile`); without a profile the batch size is 4.
+
+    Pass a `detector` from `build_detector` (or `load_detector`, which leaves the
+    hardware profile out) to reuse one across documents instead of loading
+    `model_or_path` every time.
+    """
+    config = detection_config(
+        image_size,
+        confidence,
+        fast,
+        int8,
+        tiled,
+        adaptive,
+        escalation_policy,
+        cascade_to,
+        cascade_policy,
+        vector_prior,
+        vector_policy,
+        time_budget,
+        deadline_policy,
+    )
+    deadline = start_deadline(
+        time_budget,
+        deadline_policy,
+        model_or_path,
+        device,
+        fast,
+        int8,
+        cascade_to,
+        cascade_policy,
+        vector_prior,
+        vector_policy,
+        max_cores,
+    )
+    sha256 = file_sha256(input_path)
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint, sha256, {"model": model_or_path, **config})
+
+    with tracing(observer, profile, profile_model) as observer:
+        monitor = MemoryMonitor(enabled=memory_budget is not None).start()
+        if previous is not None or fingerprint:
+            fingerprints, results = reuse_previous(input_path, previous, observer)
+            num_pages = len(fingerprints)
+        else:
+            fingerprints, results = [], {}
+            try:
+                num_pages = len(page_sizes(input_path))
+            except pypdfium2._helpers.misc.PdfiumError:
+                raise EncryptedPdfError
+        todo = [ix for ix in range(num_pages) if ix not in results]
+        if checkpoint is not None:
+            todo = resume(input_path, checkpoint, results, todo)
+
+        plan = MemoryPlan(scale=2, batch_size=batch_size or DEFAULT_BATCH_SIZE)
+        if todo:
+            if detector is None:
+                detector = build_detector(
+                    model_or_path,
+                    device,
+                    fast,
+                    int8,
+                    cascade_to,
+                    cascade_policy,
+                    observer,
+                    vector_prior,
+                    vector_policy,
+                    max_cores,
+                )
+            else:
+                detector.observer = observer
+            try:
+                detected, _, plan = detect_pages(
+                    input_path,
+                    detector,
+                    confidence=confidence,
+                    image_size=image_size,
+                    batch_size=batch_size,
+                    tiled=tiled,
+                    adaptive=adaptive,
+                    escalation_policy=escalation_policy,
+                    memory_budget=memory_budget,
+                    render_workers=render_workers,
+                    observer=observer,
+                    monitor=monitor,
+                    page_indices=todo,
+                    checkpoint=checkpoint,
+                    deadline=deadline,
+                )
+            finally:
+                # a reused detector shouldn't keep this document's page sizes
+                detector.release_buffers()
+                if detector.fast_fallback is not None:
+                    detector.fast_fallback.release_buffers()
+            results.update(detected)
+        report_peak(monitor, memory_budget)
+
+    if checkpoint is not None:
+        if keep_checkpoint:
+            checkpoint.close()
+        else:
+            checkpoint.remove()
+
+    return FormDetections(
+        source=Path(input_path).name,
+        sha256=sha256,
+        num_pages=num_pages,
+        model=str(model_or_path),
+        config={**config, "render_scale": plan.scale},
+        fingerprints=fingerprints,
+        widgets=dict(sorted(results.items())),
+        degraded=deadline.degraded if deadline is not None else {},
+    )
+
+
+def apply_detections(
+    detections: FormDetections | str | Path,
+    input_path: str | Path,
+    output_path: str | Path,
+    *,
+    keep_existing_fields: bool = False,
+    use_signature_fields: bool = False,
+    multiline: bool = False,
+    signature_label_terms: tuple[str, ...] = ("signature",),
+    check_source: bool = True,
+    observer: Observer | None = None,
+    profile: str | Path | None = None,
+) -> None:
+    """
+    Write detections from `detect_form` (or a file it was dumped to) into
+    `input_path`, without loading a model. Raises `DetectionsMismatchError` if
+    `input_path` isn't the document they were detected on, unless `check_source`
+    is False.
+    """
+    if not isinstance(detections, FormDetections):
+        detections = FormDetections.load(detections)
+    if check_source:
+        detections.check_source(input_path)
+
+    with tracing(observer, profile, False) as observer:
+        # signature promotion only needs the text, so skip rendering entirely
+        if use_signature_fields:
+            pages = text_pages(input_path)
+        else:
+            pages = [None] * detections.num_pages
+
+        write_widgets(
+            input_path,
+            output_path,
+            {ix: list(widgets) for ix, widgets in detections.widgets.items()},
+            pages,
+            keep_existing_fields=keep_existing_fields,
+            use_signature_fields=use_signature_fields,
+            multiline=multiline,
+            signature_label_terms=signature_label_terms,
+            observer=observer,
+            monitor=MemoryMonitor(enabled=False),
+        )
+
+
 def prepare_form(
     input_path: str | Path,
     output_path: str | Path,
@@ -377,52 +2342,97 @@ def prepare_form(
     confidence: float = 0.4,
     fast: bool = False,
     multiline: bool = False,
-    batch_size: int = 4,
+    batch_size: int | None = None,
     signature_label_terms: tuple[str, ...] = ("signature",),
-):
-    if "FFDNET" in model_or_path.upper():
-        detector = FFDNetDetector(model_or_path, device=device, fast=fast)
-    else:
-        detector = FFDetrDetector(model_or_path, device=device)
-
-    try:
-        pages = render_pdf(input_path)
-    except pypdfium2._helpers.misc.PdfiumError:
-        raise EncryptedPdfError
+    tiled: bool = False,
+    adaptive: bool = False,
+    escalation_policy: EscalationPolicy | None = None,
+    cascade_to: str | None = None,
+    cascade_policy: CascadePolicy | None = None,
+    vector_prior: bool = False,
+    vector_policy: VectorPolicy | None = None,
+    time_budget: float | None = None,
+    deadline_policy: DeadlinePolicy | None = None,
+    int8: bool = False,
+    observer: Observer | None = None,
+    profile: str | Path | None = None,
+    profile_model: bool = False,
+    memory_budget: MemoryBudget | None = None,
+    render_workers: int = 1,
+    max_cores: int | None = None,
+    previous: FormDetections | str | Path | None = None,
+    checkpoint: str | Path | None = None,
+    detector: Detector | None = None,
+) -> dict[int, str]:
+    """
+    Detect the fields of `input_path` and write them into `output_path` as a
+    fillable form; see `detect_form` for the detection arguments. A checkpoint
+    is kept until the PDF is written, so a crash while writing resumes too.
 
-    if isinstance(detector, FFDetrDetector):
-        results = detector.extract_widgets(
-            pages, confidence=confidence, image_size=image_size, batch_size=batch_size
+    Returns the pages that ran with cheaper settings to fit `time_budget`, and
+    the degradation level each ran at (see `DeadlinePolicy`).
+    """
+    with tracing(observer, profile, profile_model) as observer:
+        detections = detect_form(
+            input_path,
+            model_or_path=model_or_path,
+            device=device,
+            image_size=image_size,
+            confidence=confidence,
+            fast=fast,
+            batch_size=batch_size,
+            tiled=tiled,
+            adaptive=adaptive,
+            escalation_policy=escalation_policy,
+            cascade_to=cascade_to,
+            cascade_policy=cascade_policy,
+            vector_prior=vector_prior,
+            vector_policy=vector_policy,
+            time_budget=time_budget,
+            deadline_policy=deadline_policy,
+            int8=int8,
+            observer=observer,
+            profile_model=profile_model,
+            memory_budget=memory_budget,
+            render_workers=render_workers,
+            max_cores=max_cores,
+            previous=previous,
+            checkpoint=checkpoint,
+            keep_checkpoint=True,
+            detector=detector,
         )
-    else:
-        results = detector.extract_widgets(
-            pages, confidence=confidence, image_size=image_size
+        if memory_budget is not None:
+            # the PDF writer needs its own copy of the document, so make room
+            del detector
+            gc.collect()
+
+        monitor = MemoryMonitor(enabled=memory_budget is not None).start()
+        write_widgets(
+            input_path,
+            output_path,
+            {ix: list(widgets) for ix, widgets in detections.widgets.items()},
+            # signature promotion only needs the text
+            text_pages(input_path)
+            if use_signature_fields
+            else [None] * detections.num_pages,
+            keep_existing_fields=keep_existing_fields,
+            use_signature_fields=use_signature_fields,
+            multiline=multiline,
+            signature_label_terms=signature_label_terms,
+            observer=observer,
+            monitor=monitor,
         )
+        report_peak(monitor, memory_budget)
 
-    if use_signature_fields:
-        results = promote_signature_widgets(
-            pages, results, signature_label_terms=signature_label_terms
-        )
+    if checkpoint is not None:
+        # only now that the PDF is written is there nothing left to resume
+        Checkpoint(checkpoint, detections.sha256, detections.config).remove()
 
-    writer = PyPdfFormCreator(input_path)
-    if not keep_existing_fields:
-        writer.clear_existing_fields()
+    return detections.degraded
 
-    for page_ix, widgets in results.items():
-        for i, widget in enumerate(widgets):
-            name = f"{widget.widget_type.lower()}_{widget.page}_{i}"
 
-            if widget.widget_type == "TextBox":
-                writer.add_text_box(
-                    name, page_ix, widget.bounding_box, multiline=multiline
-                )
-            elif widget.widget_type == "ChoiceButton":
-                writer.add_checkbox(name, page_ix, widget.bounding_box)
-            elif widget.widget_type == "Signature":
-                if use_signature_fields:
-                    writer.add_signature(name, page_ix, widget.bounding_box)
-                else:
-                    writer.add_text_box(name, page_ix, widget.bounding_box)
-
-    writer.save(output_path)
-    writer.close()
+def package_version() -> str | None:
+    try:
+        return importlib.metadata.version("commonforms")
+    except importlib.metadata.PackageNotFoundError:
+        return None
@@ -0,0 +1,377 @@
+"""
+Instrumentation hooks for `prepare_form`.
+
+Pass an `Observer` to `prepare_form(observer=...)` to receive typed events as the
+pipeline runs: one `StageEvent` per pipeline stage, `PageEvent`s for per-page work
+and detection counts, and `BatchEvent`s for every model call. The default
+`NullObserver` does nothing, and the pipeline skips building per-page events
+entirely when `observer.enabled` is False.
+"""
+
+from __future__ import annotations
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import json
+import os
+import socket
+import tempfile
+import time
+
+
+@dataclass
+class StageEvent:
+    """A pipeline stage (load_model, render, detect, promote_signatures, write)."""
+
+    stage: str
+    start: float
+    duration: float = 0.0
+    pages: int = 0
+    # only measured when running under a `MemoryBudget`
+    peak_rss: int | None = None
+
+
+@dataclass
+class PageEvent:
+    """Per-page work (render, text) or per-page detection results (detect)."""
+
+    stage: str
+    page: int
+    start: float | None = None
+    duration: float | None = None
+    detections: int | None = None
+    classes: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class BatchEvent:
+    """A single model call over a batch of pages or tiles."""
+
+    start: float
+    duration: float
+    size: int
+    image_size: int
+    pages: list[int] = field(default_factory=list)
+    tiles: int = 0
+
+
+class Observer:
+    """Base observer: override the `on_*` methods you care about."""
+
+    enabled = True
+
+    def on_stage(self, event: StageEvent) -> None:
+        pass
+
+    def on_page(self, event: PageEvent) -> None:
+        pass
+
+    def on_batch(self, event: BatchEvent) -> None:
+        pass
+
+    def model_call(self, detector):
+        """Context manager wrapped around every `detector.predict` call."""
+        return nullcontext()
+
+    @contextmanager
+    def stage(self, name: str, pages: int = 0):
+        """Time the body of the `with` block and report it as a `StageEvent`."""
+        event = StageEvent(stage=name, start=time.perf_counter(), pages=pages)
+        try:
+            yield event
+        finally:
+            event.duration = time.perf_counter() - event.start
+            self.on_stage(event)
+
+
+class NullObserver(Observer):
+    enabled = False
+
+    def stage(self, name: str, pages: int = 0):
+        return nullcontext(StageEvent(stage=name, start=0.0, pages=pages))
+
+
+NULL_OBSERVER = NullObserver()
+
+
+class MultiObserver(Observer):
+    """Fan events out to several observers."""
+
+    def __init__(self, *observers: Observer) -> None:
+        self.observers = [o for o in observers if o.enabled]
+        self.enabled = bool(self.observers)
+
+    def on_stage(self, event: StageEvent) -> None:
+        for observer in self.observers:
+            observer.on_stage(event)
+
+    def on_page(self, event: PageEvent) -> None:
+        for observer in self.observers:
+            observer.on_page(event)
+
+    def on_batch(self, event: BatchEvent) -> None:
+        for observer in self.observers:
+            observer.on_batch(event)
+
+    @contextmanager
+    def model_call(self, detector):
+        with ExitStack() as stack:
+            for observer in self.observers:
+                stack.enter_context(observer.model_call(detector))
+            yield
+
+
+class PrometheusExporter(Observer):
+    """
+    Accumulates events into Prometheus counters, rendered in the text exposition
+    format by `exposition()` (e.g. for the node_exporter textfile collector, or
+    to serve from an existing /metrics endpoint).
+    """
+
+    def __init__(self, namespace: str = "commonforms") -> None:
+        self.namespace = namespace
+        self.sums: dict[tuple[str, tuple], float] = defaultdict(float)
+        self.counts: dict[tuple[str, tuple], int] = defaultdict(int)
+        self.gauges: dict[str, float] = {}
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.sums[key] += value
+        self.counts[key] += 1
+
+    def on_stage(self, event: StageEvent) -> None:
+        self.observe("stage_seconds", event.duration, stage=event.stage)
+        if event.stage == "render":
+            self.observe("pages", event.pages)
+        if event.peak_rss is not None:
+            self.gauges["peak_rss_bytes"] = max(
+                self.gauges.get("peak_rss_bytes", 0), event.peak_rss
+            )
+
+    def on_page(self, event: PageEvent) -> None:
+        if event.duration is not None:
+            self.observe("page_seconds", event.duration, stage=event.stage)
+        for widget_type, count in event.classes.items():
+            self.observe("detections", count, widget_type=widget_type)
+
+    def on_batch(self, event: BatchEvent) -> None:
+        self.observe("batch_seconds", event.duration)
+        self.observe("batch_size", event.size)
+
+    def exposition(self) -> str:
+        lines = []
+        for name in sorted({name for name, _ in self.sums}):
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for (key_name, labels), total in sorted(self.sums.items()):
+                if key_name != name:
+                    continue
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                label_str = f"{{{label_str}}}" if label_str else ""
+                count = self.counts[(key_name, labels)]
+                lines.append(f"{metric}_sum{label_str} {total}")
+                lines.append(f"{metric}_count{label_str} {count}")
+        for name, value in sorted(self.gauges.items()):
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path) -> None:
+        with open(path, "w") as fp:
+            fp.write(self.exposition())
+
+
+class StatsdExporter(Observer):
+    """Sends events to a StatsD daemon over UDP as they happen."""
+
+    def __init__(
+        self, host: str = "localhost", port: int = 8125, prefix: str = "commonforms"
+    ) -> None:
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, metric: str) -> None:
+        try:
+            self.socket.sendto(f"{self.prefix}.{metric}".encode(), self.address)
+        except OSError:
+            # metrics must never take down a conversion
+            pass
+
+    def on_stage(self, event: StageEvent) -> None:
+        self.send(f"stage.{event.stage}:{event.duration * 1000:.3f}|ms")
+        if event.stage == "render":
+            self.send(f"pages:{event.pages}|c")
+        if event.peak_rss is not None:
+            self.send(f"peak_rss.{event.stage}:{event.peak_rss}|g")
+
+    def on_page(self, event: PageEvent) -> None:
+        if event.duration is not None:
+            self.send(f"page.{event.stage}:{event.duration * 1000:.3f}|ms")
+        for widget_type, count in event.classes.items():
+            self.send(f"detections.{widget_type}:{count}|c")
+
+    def on_batch(self, event: BatchEvent) -> None:
+        self.send(f"batch.duration:{event.duration * 1000:.3f}|ms")
+        self.send(f"batch.size:{event.size}|h")
+
+
+class TraceObserver(Observer):
+    """
+    Records every event as a span in the Chrome trace event format, viewable in
+    chrome://tracing or https://ui.perfetto.dev. Stages, pages and model batches
+    each get their own track.
+
+    With `profile_model=True`, the model calls are also profiled: ONNX Runtime
+    sessions owned by a detector (FFDetr with `fast=True`) have their profiler
+    turned on, and everything else runs under the torch profiler. Their events
+    are added to the trace on their own tracks, aligned to the batch spans.
+    Both profilers add noticeable overhead, so only use this for diagnosis.
+    """
+
+    tracks = {"stage": 1, "page": 2, "batch": 3, "onnxruntime": 4, "torch": 5}
+
+    def __init__(self, profile_model: bool = False) -> None:
+        self.profile_model = profile_model
+        self.origin = time.perf_counter()
+        self.events: list[dict] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in self.tracks.items()
+        ]
+        # detector -> perf_counter time its ONNX Runtime profiler started
+        self.sessions: dict = {}
+
+    def microseconds(self, seconds: float) -> float:
+        return (seconds - self.origin) * 1e6
+
+    def span(
+        self, name: str, track: str, start: float, duration: float, **args
+    ) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "cat": track,
+                "ph": "X",
+                "pid": 1,
+                "tid": self.tracks[track],
+                "ts": self.microseconds(start),
+                "dur": duration * 1e6,
+                "args": args,
+            }
+        )
+
+    def on_stage(self, event: StageEvent) -> None:
+        args = {"pages": event.pages}
+        if event.peak_rss is not None:
+            args["peak_rss"] = event.peak_rss
+        self.span(event.stage, "stage", event.start, event.duration, **args)
+
+    def on_page(self, event: PageEvent) -> None:
+        name = f"{event.stage} page {event.page}"
+        if event.start is not None and event.duration is not None:
+            self.span(name, "page", event.start, event.duration)
+        else:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "page",
+                    "ph": "i",
+                    "s": "t",
+                    "pid": 1,
+                    "tid": self.tracks["page"],
+                    "ts": self.microseconds(time.perf_counter()),
+                    "args": {"detections": event.detections, **event.classes},
+                }
+            )
+
+    def on_batch(self, event: BatchEvent) -> None:
+        self.span(
+            f"batch x{event.size}",
+            "batch",
+            event.start,
+            event.duration,
+            size=event.size,
+            image_size=event.image_size,
+            pages=event.pages,
+            tiles=event.tiles,
+        )
+
+    @contextmanager
+    def model_call(self, detector):
+        if not self.profile_model:
+            yield
+            return
+
+        if detector not in self.sessions:
+            # ONNX Runtime timestamps are relative to when the session was created
+            start = time.perf_counter()
+            if detector.enable_profiling():
+                self.sessions[detector] = start
+        if detector in self.sessions:
+            yield
+            return
+
+        import torch.profiler
+
+        start = time.perf_counter()
+        with torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU]
+        ) as profiler:
+            yield
+        self.add_profile(export_torch_trace(profiler), "torch", start, align=True)
+
+    def add_profile(
+        self, events: list[dict], track: str, start: float, align: bool = False
+    ) -> None:
+        """
+        Add events from another profiler. Their timestamps are microseconds since
+        `start`, or, with `align`, on an unknown clock and shifted so the first
+        event begins at `start`.
+        """
+        timed = [e for e in events if "ts" in e and e.get("ph") == "X"]
+        if not timed:
+            return
+        offset = self.microseconds(start)
+        if align:
+            offset -= min(float(e["ts"]) for e in timed)
+        for e in timed:
+            self.events.append(
+                {
+                    **e,
+                    "ts": float(e["ts"]) + offset,
+                    "pid": 1,
+                    "tid": self.tracks[track],
+                }
+            )
+
+    def write(self, path: str | Path) -> None:
+        for detector, start in self.sessions.items():
+            profile_path = detector.end_profiling()
+            if profile_path is None:
+                continue
+            with open(profile_path) as fp:
+                self.add_profile(json.load(fp), "onnxruntime", start)
+            os.remove(profile_path)
+        self.sessions = {}
+
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fp)
+
+
+def export_torch_trace(profiler) -> list[dict]:
+    # the torch profiler can only export its chrome trace to a file
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "trace.json"
+        profiler.export_chrome_trace(str(path))
+        with open(path) as fp:
+            trace = json.load(fp)
+    return trace["traceEvents"] if isinstance(trace, dict) else trace
@@ -0,0 +1,185 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import math
+import os
+import re
+import resource
+import sys
+import threading
+
+
+def current_rss() -> int:
+    """Resident set size of this process, in bytes."""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # not Linux: fall back to the peak, which is the best getrusage offers
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like `512M`, `2G` or `1.5GiB` (powers of 1024) into bytes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", size.lower())
+    if match is None:
+        raise ValueError(f"Invalid size: {size!r}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmgt".index(unit or " "))
+
+
+class MemoryMonitor:
+    """
+    Samples the process RSS on a background thread, tracking the peak over the
+    whole run and over the current `measure()` window. A disabled monitor does
+    nothing and reports no peaks.
+    """
+
+    def __init__(self, enabled: bool = True, interval: float = 0.005) -> None:
+        self.enabled = enabled
+        self.interval = interval
+        self.peak = 0
+        self.window_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self) -> None:
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        self.window_peak = max(self.window_peak, rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> MemoryMonitor:
+        if self.enabled:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> int | None:
+        """Stop sampling and return the peak RSS, in bytes."""
+        if not self.enabled:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return self.peak
+
+    @contextmanager
+    def measure(self, event):
+        """Record the peak RSS during the `with` block on `event.peak_rss`."""
+        if not self.enabled:
+            yield
+            return
+        self.sample()
+        self.window_peak = current_rss()
+        try:
+            yield
+        finally:
+            self.sample()
+            event.peak_rss = self.window_peak
+
+
+@dataclass
+class MemoryPlan:
+    """How to run a document: render scale, model batch size and pages in flight."""
+
+    scale: float
+    batch_size: int
+    # None means all pages at once
+    pages_in_flight: int | None = None
+
+    def shrink(self) -> MemoryPlan:
+        """A plan using roughly half the memory, for when the estimate was off."""
+        if self.pages_in_flight is not None and self.pages_in_flight > self.batch_size:
+            return MemoryPlan(
+                self.scale,
+                self.batch_size,
+                max(self.batch_size, self.pages_in_flight // 2),
+            )
+        batch_size = max(1, self.batch_size // 2)
+        return MemoryPlan(self.scale, batch_size, batch_size)
+
+
+@dataclass
+class MemoryBudget:
+    """
+    A cap on the process RSS while preparing a document. Rendered pages are
+    processed `pages_in_flight` at a time and their bitmaps are released once
+    detected, and the model is released before the PDF is written.
+
+    `plan` estimates the memory for a given number of pages in flight, batch size
+    and render scale, and backs off in that order until the estimate fits.
+    """
+
+    limit: int
+    render_scale: float = 2.0
+    # never render below this, or below the model's own resolution
+    min_render_scale: float = 1.0
+    # model activations per pixel of model input, measured on FFDetr/FFDNet on
+    # CPU; ONNX Runtime is the hungrier of the two
+    bytes_per_input_pixel: float = 300.0
+    # fraction of the limit kept free for the allocator, pdfium and pypdf
+    headroom: float = 0.1
+
+    def page_bytes(self, width: float, height: float, scale: float) -> int:
+        # PIL stores RGB as 4 bytes per pixel
+        return math.ceil(width * scale) * math.ceil(height * scale) * 4
+
+    def estimate(
+        self, page_size: tuple[float, float], input_pixels: int, plan: MemoryPlan
+    ) -> int:
+        page = self.page_bytes(*page_size, plan.scale)
+        # the float32 arrays a detector's buffer pool keeps for reuse: a page,
+        # a resized page and a batch of model inputs, at 12 bytes per RGB pixel
+        pooled = 3 * page + (plan.batch_size + 1) * input_pixels * 12
+        return int(
+            plan.pages_in_flight * page
+            + plan.batch_size * (page + input_pixels * self.bytes_per_input_pixel)
+            + pooled
+        )
+
+    def plan(
+        self,
+        page_sizes: list[tuple[float, float]],
+        input_pixels: int,
+        batch_size: int,
+        baseline: int | None = None,
+        model_side: int = 0,
+    ) -> MemoryPlan:
+        """
+        Pick a plan for pages of `page_sizes` (in PDF points) with a model that
+        runs at `input_pixels` per image (`model_side` along its longest side),
+        given `baseline` bytes already in use (the current RSS by default).
+        """
+        baseline = current_rss() if baseline is None else baseline
+        available = self.limit * (1 - self.headroom) - baseline
+        num_pages = max(len(page_sizes), 1)
+        largest = max(page_sizes, key=lambda s: s[0] * s[1], default=(612, 792))
+
+        min_scale = min(
+            self.render_scale,
+            max(self.min_render_scale, model_side / max(largest)),
+        )
+        batch_size = min(batch_size, num_pages)
+
+        plan = MemoryPlan(self.render_scale, batch_size, num_pages)
+        while self.estimate(largest, input_pixels, plan) > available:
+            if plan.pages_in_flight > plan.batch_size:
+                plan.pages_in_flight = max(plan.batch_size, plan.pages_in_flight // 2)
+            elif plan.batch_size > 1:
+                plan.batch_size //= 2
+                plan.pages_in_flight = plan.batch_size
+            elif plan.scale > min_scale:
+                plan.scale = max(min_scale, plan.scale * 0.75)
+            else:
+                # the smallest plan still doesn't fit; run it and let the caller
+                # report the peak
+                break
+
+        return plan
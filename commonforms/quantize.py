@@ -0,0 +1,238 @@
+"""
+Produce static INT8 versions of the CPU (ONNX) FFDNet detectors, calibrated on
+pages from the COCO dataset built by `dataset/generate_coco.py`, and report the
+speed/accuracy trade-off against the FP32 model.
+
+    python -m commonforms.quantize FFDNet-L coco/ --split dataset/val.csv
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from pathlib import Path
+from huggingface_hub import hf_hub_download
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from PIL import Image
+
+from commonforms.evaluation import (
+    COCO_IOU_THRESHOLDS,
+    evaluate,
+    load_coco_pages,
+    predict,
+    read_split_ids,
+)
+from commonforms.inference import FFDNetDetector, models, quantized_model_path
+from commonforms.utils import Detections
+
+import json
+import logging
+import numpy as np
+import onnxruntime
+import tempfile
+
+
+def letterbox(image: Image.Image, size: int) -> np.ndarray:
+    """
+    Match the Ultralytics pre-processing: resize the longest side to `size`,
+    center-pad with gray to a square and return a (1, 3, size, size) float tensor.
+    """
+    image = image.convert("RGB")
+    ratio = min(size / image.width, size / image.height)
+    resized = image.resize(
+        (round(image.width * ratio), round(image.height * ratio)),
+        Image.Resampling.BILINEAR,
+    )
+
+    canvas = Image.new("RGB", (size, size), (114, 114, 114))
+    canvas.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+
+    array = np.asarray(canvas, dtype=np.float32) / 255.0
+    return array.transpose(2, 0, 1)[None]
+
+
+class CocoCalibrationReader(CalibrationDataReader):
+    def __init__(self, image_paths: list[Path], input_name: str, image_size: int):
+        self.image_paths = iter(image_paths)
+        self.input_name = input_name
+        self.image_size = image_size
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        image_path = next(self.image_paths, None)
+        if image_path is None:
+            return None
+        with Image.open(image_path) as image:
+            return {self.input_name: letterbox(image, self.image_size)}
+
+
+def quantize(
+    model: str,
+    calibration_images: list[Path],
+    output_path: Path | None = None,
+    calibrate_method: CalibrationMethod = CalibrationMethod.MinMax,
+) -> Path:
+    repo_id, filename = models[(model.upper(), True)]
+    fp32_path = hf_hub_download(repo_id=repo_id, filename=filename)
+    output_path = Path(output_path or quantized_model_path(model))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    session = onnxruntime.InferenceSession(
+        fp32_path, providers=["CPUExecutionProvider"]
+    )
+    model_input = session.get_inputs()[0]
+    image_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 1216
+    del session
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # shape inference + graph optimization makes the quantized graph much tighter
+        preprocessed = Path(tmp) / "preprocessed.onnx"
+        quant_pre_process(fp32_path, preprocessed)
+
+        logging.info(
+            f"Calibrating {model} on {len(calibration_images)} pages at {image_size}px"
+        )
+        quantize_static(
+            preprocessed,
+            output_path,
+            CocoCalibrationReader(calibration_images, model_input.name, image_size),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=calibrate_method,
+        )
+
+    logging.info(f"Wrote {output_path}")
+    return output_path
+
+
+def benchmark(
+    detector: FFDNetDetector,
+    pages: list[tuple[Path, Detections]],
+    confidence: float,
+    batch_size: int = 4,
+) -> dict:
+    predictions, elapsed = predict(detector, pages, confidence, batch_size)
+    metrics = evaluate(
+        predictions,
+        [ground_truth for _, ground_truth in pages],
+        detector.id_to_cls,
+        iou_thresholds=COCO_IOU_THRESHOLDS,
+    )
+    return {
+        "pages_per_second": len(pages) / elapsed if elapsed else float("nan"),
+        "metrics": metrics,
+    }
+
+
+def compare(
+    model: str,
+    int8_path: Path,
+    pages: list[tuple[Path, Detections]],
+    confidence: float = 0.3,
+) -> dict:
+    fp32 = benchmark(FFDNetDetector(model, fast=True), pages, confidence)
+    int8 = benchmark(FFDNetDetector(str(int8_path), fast=True), pages, confidence)
+
+    return {
+        "model": model,
+        "pages": len(pages),
+        "fp32": fp32,
+        "int8": int8,
+        "speedup": int8["pages_per_second"] / fp32["pages_per_second"],
+        "map_delta": int8["metrics"]["all"]["ap"] - fp32["metrics"]["all"]["ap"],
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        prog="commonforms.quantize",
+        description="Create a static INT8 version of a CPU FFDNet model",
+    )
+    parser.add_argument("model", type=str, help="Model to quantize (FFDNet-S/FFDNet-L)")
+    parser.add_argument(
+        "coco_dir",
+        type=Path,
+        help="COCO directory from dataset/generate_coco.py, or a COCO annotations file",
+    )
+    parser.add_argument(
+        "--split",
+        type=Path,
+        default=None,
+        help="CSV of document IDs to draw pages from (e.g. dataset/val.csv)",
+    )
+    parser.add_argument(
+        "--calibration-pages",
+        type=int,
+        default=256,
+        dest="calibration_pages",
+        help="Number of pages to calibrate on (default: 256)",
+    )
+    parser.add_argument(
+        "--eval-pages",
+        type=int,
+        default=500,
+        dest="eval_pages",
+        help="Number of pages for the FP32 vs INT8 comparison, 0 to skip (default: 500)",
+    )
+    parser.add_argument(
+        "--calibrate-method",
+        choices=["minmax", "entropy", "percentile"],
+        default="minmax",
+        dest="calibrate_method",
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="Where to write the INT8 model"
+    )
+    parser.add_argument(
+        "--report", type=Path, default=None, help="Write the comparison as JSON"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    split_ids = read_split_ids(args.split) if args.split else None
+    pages = load_coco_pages(
+        args.coco_dir,
+        split_ids=split_ids,
+        limit=args.calibration_pages + args.eval_pages,
+    )
+    # keep the calibration and evaluation pages disjoint
+    calibration = [image_path for image_path, _ in pages[: args.calibration_pages]]
+    evaluation = pages[args.calibration_pages :]
+
+    int8_path = quantize(
+        args.model,
+        calibration,
+        output_path=args.output,
+        calibrate_method={
+            "minmax": CalibrationMethod.MinMax,
+            "entropy": CalibrationMethod.Entropy,
+            "percentile": CalibrationMethod.Percentile,
+        }[args.calibrate_method],
+    )
+
+    if not evaluation:
+        return
+
+    report = compare(args.model, int8_path, evaluation)
+    print(
+        f"{'':6} {'pages/s':>8} {'mAP':>6}\n"
+        f"{'fp32':6} {report['fp32']['pages_per_second']:8.2f} "
+        f"{report['fp32']['metrics']['all']['ap']:6.3f}\n"
+        f"{'int8':6} {report['int8']['pages_per_second']:8.2f} "
+        f"{report['int8']['metrics']['all']['ap']:6.3f}\n"
+        f"speedup {report['speedup']:.2f}x, mAP delta {report['map_delta']:+.3f}"
+    )
+    if args.report:
+        with args.report.open("w") as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+from PIL import Image
+
+from commonforms.utils import Detections
+
+import math
+import numpy as np
+
+
+def tile_windows(
+    width: int, height: int, tile_size: int, overlap: float = 0.2
+) -> list[tuple[int, int, int, int]]:
+    """
+    Split a `width` x `height` image into `tile_size` square windows (x0, y0, x1, y1)
+    that overlap by at least `overlap` of a tile and exactly cover the image.
+    """
+
+    def starts(length: int) -> list[int]:
+        if length <= tile_size:
+            return [0]
+        stride = tile_size * (1 - overlap)
+        n = math.ceil((length - tile_size) / stride) + 1
+        return [round(s) for s in np.linspace(0, length - tile_size, n)]
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def needs_tiling(image: Image.Image, tile_size: int) -> bool:
+    return max(image.width, image.height) > tile_size
+
+
+def nms(
+    xyxy: np.ndarray,
+    scores: np.ndarray,
+    class_id: np.ndarray,
+    sources: np.ndarray,
+    iou_threshold: float = 0.5,
+) -> np.ndarray:
+    """
+    Greedy NMS across tiles: a box is only suppressed by a higher scoring box of
+    the same class from a different source (tile, or the whole page). Each model
+    pass already ran its own NMS, so boxes overlapping within one are nested
+    fields, like a checkbox inside a table cell. Overlap is measured as
+    intersection over the *smaller* box, so a widget clipped by a tile edge is
+    suppressed by the full detection from the neighbouring tile. Returns the kept
+    indices.
+    """
+    order = np.argsort(-scores)
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        ix0 = np.maximum(xyxy[i, 0], xyxy[rest, 0])
+        iy0 = np.maximum(xyxy[i, 1], xyxy[rest, 1])
+        ix1 = np.minimum(xyxy[i, 2], xyxy[rest, 2])
+        iy1 = np.minimum(xyxy[i, 3], xyxy[rest, 3])
+        inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+        smaller = np.minimum(areas[i], areas[rest])
+        overlap = inter / np.maximum(smaller, 1e-12)
+
+        duplicate = (
+            (overlap > iou_threshold)
+            & (class_id[rest] == class_id[i])
+            & (sources[rest] != sources[i])
+        )
+        order = rest[~duplicate]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def merge_tiles(
+    width: int,
+    height: int,
+    windows: list[tuple[int, int, int, int]],
+    tile_detections: list[Detections],
+    page_detections: Detections | None = None,
+    iou_threshold: float = 0.5,
+    edge_margin: int = 2,
+) -> Detections:
+    """
+    Map per-tile detections back into page-normalized coordinates and merge them
+    with cross-tile NMS (see `nms`). Boxes touching an interior tile edge are
+    dropped, since the overlap guarantees the complete widget is seen by a
+    neighbouring tile.
+    """
+    merged = [] if page_detections is None else [page_detections]
+
+    for (x0, y0, x1, y1), detections in zip(windows, tile_detections):
+        if len(detections) == 0:
+            continue
+
+        tile_w, tile_h = x1 - x0, y1 - y0
+        xyxy = detections.xyxyn * np.array([tile_w, tile_h, tile_w, tile_h])
+
+        clipped = np.zeros(len(detections), dtype=bool)
+        if x0 > 0:
+            clipped |= xyxy[:, 0] <= edge_margin
+        if y0 > 0:
+            clipped |= xyxy[:, 1] <= edge_margin
+        if x1 < width:
+            clipped |= xyxy[:, 2] >= tile_w - edge_margin
+        if y1 < height:
+            clipped |= xyxy[:, 3] >= tile_h - edge_margin
+
+        xyxy = (xyxy + np.array([x0, y0, x0, y0])) / np.array(
+            [width, height, width, height]
+        )
+        merged.append(
+            Detections(
+                xyxyn=xyxy[~clipped],
+                class_id=detections.class_id[~clipped],
+                confidence=detections.confidence[~clipped],
+            )
+        )
+
+    detections = Detections.concatenate(merged)
+    if len(detections) == 0:
+        return detections
+
+    sources = np.repeat(np.arange(len(merged)), [len(d) for d in merged])
+    keep = nms(
+        detections.xyxyn,
+        detections.confidence,
+        detections.class_id,
+        sources,
+        iou_threshold,
+    )
+    return detections[keep]
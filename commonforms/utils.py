@@ -1,8 +1,27 @@
 from __future__ import annotations
-from typing import Literal
+from typing import TYPE_CHECKING, Any, Literal
 from pydantic import BaseModel
 from dataclasses import dataclass
 from PIL import Image
+from pathlib import Path
+
+from commonforms.exceptions import DetectionsMismatchError, DetectionsVersionError
+
+import gzip
+import hashlib
+import json
+import numpy as np
+import os
+
+if TYPE_CHECKING:
+    from commonforms.vector import PageVectors
+
+
+def cache_dir() -> Path:
+    """Where locally-produced model variants (e.g. ONNX/INT8 exports) are stored."""
+    return Path(
+        os.environ.get("COMMONFORMS_CACHE", Path.home() / ".cache" / "commonforms")
+    )
 
 
 class BoundingBox(BaseModel):
@@ -24,6 +43,104 @@ class Widget(BaseModel):
     ]
     bounding_box: BoundingBox
     page: int
+    confidence: float | None = None
+
+
+# 2: added per-page fingerprints
+DETECTIONS_FORMAT_VERSION = 2
+
+
+def widget_row(widget: Widget) -> list:
+    """A widget as `[widget_type, x0, y0, x1, y1, confidence]`, for compact JSON."""
+    box = widget.bounding_box
+    return [
+        widget.widget_type,
+        *(round(v, 5) for v in (box.x0, box.y0, box.x1, box.y1)),
+        None if widget.confidence is None else round(widget.confidence, 4),
+    ]
+
+
+def widget_from_row(row: list, page_ix: int) -> Widget:
+    widget_type, x0, y0, x1, y1, confidence = row
+    return Widget(
+        widget_type=widget_type,
+        bounding_box=BoundingBox(x0=x0, y0=y0, x1=x1, y1=y1),
+        page=page_ix,
+        confidence=confidence,
+    )
+
+
+def file_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FormDetections(BaseModel):
+    """
+    The widgets detected on a PDF, before they're written into it, along with
+    the model and settings that produced them. Written by `detect_form` and
+    consumed by `apply_detections`, so detection and PDF writing can run on
+    different machines.
+
+    On disk this is compact JSON (gzipped if the path ends in `.gz`), with each
+    widget stored as `[widget_type, x0, y0, x1, y1, confidence]`.
+
+    `fingerprints` identify each page's content, so a revised version of the
+    document only needs its changed pages re-detected (see `prepare_form(previous=...)`).
+    `degraded` lists the pages that ran with cheaper settings to fit a time
+    budget, with the level each ran at (see `DeadlinePolicy`).
+    """
+
+    version: int = DETECTIONS_FORMAT_VERSION
+    source: str
+    sha256: str
+    num_pages: int
+    model: str
+    config: dict[str, Any] = {}
+    fingerprints: list[str] = []
+    widgets: dict[int, list[Widget]]
+    degraded: dict[int, str] = {}
+
+    def check_source(self, pdf_path: str | Path) -> None:
+        """Raise if `pdf_path` isn't the document these detections were made on."""
+        if file_sha256(pdf_path) != self.sha256:
+            raise DetectionsMismatchError(
+                f"{pdf_path} is not the document these detections were made on "
+                f"({self.source})"
+            )
+
+    def dump(self, path: str | Path) -> None:
+        data = self.model_dump(exclude={"widgets"})
+        data["widgets"] = {
+            str(page_ix): [widget_row(widget) for widget in widgets]
+            for page_ix, widgets in self.widgets.items()
+        }
+        text = json.dumps(data, separators=(",", ":"))
+
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "wt") as fp:
+            fp.write(text)
+
+    @classmethod
+    def load(cls, path: str | Path) -> FormDetections:
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "rt") as fp:
+            data = json.load(fp)
+
+        if data.get("version") not in range(1, DETECTIONS_FORMAT_VERSION + 1):
+            raise DetectionsVersionError(
+                f"{path} has detections format version {data.get('version')}, "
+                f"this version of commonforms reads up to {DETECTIONS_FORMAT_VERSION}"
+            )
+
+        data["widgets"] = {
+            int(page_ix): [widget_from_row(row, int(page_ix)) for row in rows]
+            for page_ix, rows in data["widgets"].items()
+        }
+        return cls(**data)
 
 
 class TextFragment(BaseModel):
@@ -38,3 +155,42 @@ class Page:
     width: float
     height: float
     text_fragments: list[TextFragment]
+    # field candidates from the page's drawings, if they were asked for
+    vectors: PageVectors | None = None
+
+
+@dataclass
+class Detections:
+    """Raw detector output for one image, with boxes normalized to that image."""
+
+    xyxyn: np.ndarray
+    class_id: np.ndarray
+    confidence: np.ndarray
+
+    @classmethod
+    def empty(cls) -> Detections:
+        return cls(
+            xyxyn=np.zeros((0, 4), dtype=np.float32),
+            class_id=np.zeros((0,), dtype=np.int64),
+            confidence=np.zeros((0,), dtype=np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.class_id)
+
+    def __getitem__(self, index) -> Detections:
+        return Detections(
+            xyxyn=self.xyxyn[index],
+            class_id=self.class_id[index],
+            confidence=self.confidence[index],
+        )
+
+    @classmethod
+    def concatenate(cls, detections: list[Detections]) -> Detections:
+        if not detections:
+            return cls.empty()
+        return cls(
+            xyxyn=np.concatenate([d.xyxyn for d in detections]),
+            class_id=np.concatenate([d.class_id for d in detections]),
+            confidence=np.concatenate([d.confidence for d in detections]),
+        )
@@ -0,0 +1,521 @@
+"""
+Form field candidates from the vector graphics and text layer of born-digital
+pages, without a model.
+
+Fields on born-digital forms are usually drawn: a rectangle or table cell to
+write in, an underline after a label, a row of boxes for one character each, a
+small square or circle to tick. `page_vectors` reads the page's path objects
+through pdfium, rasterizes them at a low resolution and finds the enclosed empty
+regions, then proposes:
+
+- TextBox for empty cells (or the empty part of a cell next to or under its
+  label), rows of character boxes, underlines with no text on them, and runs of
+  underscores in the text,
+- ChoiceButton for small squares and circles, and checkbox characters.
+
+Boxes are normalized to the page's crop box with a top-left origin, the same
+convention the form writer uses.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+
+from commonforms.utils import Detections
+
+import ctypes
+import cv2
+import math
+import numpy as np
+import pypdfium2
+import pypdfium2.raw as pdfium_c
+import re
+
+TEXT_BOX = 0
+CHOICE_BUTTON = 1
+
+# confidence of each kind of candidate: how rarely it is something other than
+# a field
+CHECKBOX_GLYPH_CONFIDENCE = 0.9
+SQUARE_CONFIDENCE = 0.85
+CIRCLE_CONFIDENCE = 0.85
+COMB_CONFIDENCE = 0.8
+UNDERSCORE_CONFIDENCE = 0.8
+UNDERLINE_CONFIDENCE = 0.7
+CELL_CONFIDENCE = 0.6
+
+# pixels per point the paths are rasterized at, and the largest raster side
+GEOMETRY_SCALE = 2
+MAX_RASTER_SIDE = 4000
+
+# sizes in points
+CHECKBOX_MIN = 5.0
+CHECKBOX_MAX = 20.0
+MIN_FIELD_WIDTH = 20.0
+MIN_FIELD_HEIGHT = 6.0
+MAX_FIELD_HEIGHT = 144.0
+UNDERLINE_FIELD_HEIGHT = 14.0
+# character boxes of a comb field are at most this wide and tall
+MAX_COMB_BOX = 30.0
+# how far a label in a cell may be from its top-left corner
+LABEL_INSET = 12.0
+# lines drawn as filled rectangles are at most this thick
+MAX_LINE_THICKNESS = 2.0
+
+CHECKBOX_GLYPHS = "☐☑☒□▢❏❐❑❒"
+UNDERSCORES = re.compile(r"_{3,}")
+
+
+@dataclass
+class PageVectors:
+    """What a page's vector graphics and text layer say about its fields."""
+
+    # in page-normalized coordinates, with class ids as in `Detector.id_to_cls`
+    candidates: Detections
+    # fraction of the page covered by raster images (a scan is close to 1)
+    image_coverage: float
+    # characters in the text layer
+    text_chars: int
+
+
+def object_matrix(obj) -> np.ndarray:
+    matrix = pdfium_c.FS_MATRIX()
+    if not pdfium_c.FPDFPageObj_GetMatrix(obj, matrix):
+        return np.eye(3)
+    return np.array(
+        [[matrix.a, matrix.b, 0], [matrix.c, matrix.d, 0], [matrix.e, matrix.f, 1]]
+    )
+
+
+def transform(points: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Apply a PDF matrix (row-vector convention) to `(n, 2)` points."""
+    return points @ matrix[:2, :2] + matrix[2, :2]
+
+
+def page_objects(page: pypdfium2.PdfPage, form=None, matrix=None, depth=0):
+    """
+    Every page object with the matrix from its container's space to page space,
+    descending into form XObjects.
+    """
+    matrix = np.eye(3) if matrix is None else matrix
+    if form is None:
+        count = pdfium_c.FPDFPage_CountObjects(page)
+    else:
+        count = pdfium_c.FPDFFormObj_CountObjects(form)
+    for i in range(count):
+        if form is None:
+            obj = pdfium_c.FPDFPage_GetObject(page, i)
+        else:
+            obj = pdfium_c.FPDFFormObj_GetObject(form, i)
+        kind = pdfium_c.FPDFPageObj_GetType(obj)
+        if kind == pdfium_c.FPDF_PAGEOBJ_FORM and depth < 8:
+            yield from page_objects(page, obj, object_matrix(obj) @ matrix, depth + 1)
+        else:
+            yield obj, kind, matrix
+
+
+def object_bounds(obj, matrix: np.ndarray) -> tuple[float, float, float, float]:
+    left, bottom = ctypes.c_float(), ctypes.c_float()
+    right, top = ctypes.c_float(), ctypes.c_float()
+    pdfium_c.FPDFPageObj_GetBounds(obj, left, bottom, right, top)
+    corners = transform(
+        np.array(
+            [
+                [left.value, bottom.value],
+                [right.value, top.value],
+                [left.value, top.value],
+                [right.value, bottom.value],
+            ]
+        ),
+        matrix,
+    )
+    return (*corners.min(axis=0), *corners.max(axis=0))
+
+
+def path_subpaths(obj, matrix: np.ndarray) -> list[tuple[np.ndarray, bool, bool]]:
+    """The `(points, closed, curved)` subpaths of a path object, in page space."""
+    matrix = object_matrix(obj) @ matrix
+    x, y = ctypes.c_float(), ctypes.c_float()
+    subpaths, points, closed, curved = [], [], False, False
+    for i in range(pdfium_c.FPDFPath_CountSegments(obj)):
+        segment = pdfium_c.FPDFPath_GetPathSegment(obj, i)
+        kind = pdfium_c.FPDFPathSegment_GetType(segment)
+        if kind == pdfium_c.FPDF_SEGMENT_MOVETO and points:
+            subpaths.append((points, closed, curved))
+            points, closed, curved = [], False, False
+        pdfium_c.FPDFPathSegment_GetPoint(segment, x, y)
+        points.append((x.value, y.value))
+        curved |= kind == pdfium_c.FPDF_SEGMENT_BEZIERTO
+        closed |= bool(pdfium_c.FPDFPathSegment_GetClose(segment))
+    if points:
+        subpaths.append((points, closed, curved))
+    return [
+        (transform(np.array(points, dtype=np.float64), matrix), closed, curved)
+        for points, closed, curved in subpaths
+    ]
+
+
+def is_dark_fill(obj) -> bool:
+    r, g, b, a = (ctypes.c_uint() for _ in range(4))
+    if not pdfium_c.FPDFPageObj_GetFillColor(obj, r, g, b, a):
+        return True
+    luminance = 0.299 * r.value + 0.587 * g.value + 0.114 * b.value
+    return a.value > 127 and luminance < 128
+
+
+class Geometry:
+    """
+    A page's paths rasterized into an ink mask at `scale` pixels per point and
+    split into the empty regions between them, with its horizontal lines and
+    small closed curves kept as vectors.
+    """
+
+    def __init__(self, page: pypdfium2.PdfPage) -> None:
+        self.left, self.bottom, self.right, self.top = page.get_cropbox()
+        width, height = self.right - self.left, self.top - self.bottom
+        self.scale = min(GEOMETRY_SCALE, MAX_RASTER_SIDE / max(width, height, 1))
+        self.mask = np.zeros(
+            (math.ceil(height * self.scale) + 1, math.ceil(width * self.scale) + 1),
+            dtype=np.uint8,
+        )
+        # (x0, x1, y) of horizontal lines
+        self.lines: list[tuple[float, float, float]] = []
+        # (left, bottom, right, top) of small closed curves
+        self.circles: list[tuple[float, float, float, float]] = []
+        self.image_area = 0.0
+
+        for obj, kind, matrix in page_objects(page):
+            if kind == pdfium_c.FPDF_PAGEOBJ_PATH:
+                self.add_path(obj, matrix)
+            elif kind == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+                left, bottom, right, top = object_bounds(obj, matrix)
+                self.image_area += max(
+                    0.0, min(right, self.right) - max(left, self.left)
+                ) * max(0.0, min(top, self.top) - max(bottom, self.bottom))
+        self.image_coverage = min(1.0, self.image_area / max(width * height, 1e-6))
+
+        # the enclosed empty regions between the paths
+        self.regions, self.labels, self.stats, _ = cv2.connectedComponentsWithStats(
+            (self.mask == 0).astype(np.uint8), connectivity=4
+        )
+
+    def to_raster(self, points: np.ndarray) -> np.ndarray:
+        return (
+            np.stack(
+                [
+                    (points[:, 0] - self.left) * self.scale,
+                    (self.top - points[:, 1]) * self.scale,
+                ],
+                axis=1,
+            )
+            .round()
+            .astype(np.int32)
+        )
+
+    def add_path(self, obj, matrix: np.ndarray) -> None:
+        fill_mode, stroke = ctypes.c_int(), ctypes.c_int()
+        if not pdfium_c.FPDFPath_GetDrawMode(obj, fill_mode, stroke):
+            return
+        filled, stroked = fill_mode.value != 0, bool(stroke.value)
+        if not (filled or stroked):
+            # clipping paths and the like
+            return
+        dark_fill = filled and is_dark_fill(obj)
+
+        for points, closed, curved in path_subpaths(obj, matrix):
+            if len(points) < 2:
+                continue
+            (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+            w, h = x1 - x0, y1 - y0
+
+            if curved and (closed or np.allclose(points[0], points[-1], atol=0.5)):
+                if (
+                    CHECKBOX_MIN <= w <= CHECKBOX_MAX
+                    and CHECKBOX_MIN <= h <= CHECKBOX_MAX
+                    and 0.75 <= w / h <= 1.33
+                ):
+                    self.circles.append((x0, y0, x1, y1))
+
+            # lines, whether stroked segments or filled thin rectangles
+            if filled and h <= MAX_LINE_THICKNESS and w >= 2 * MAX_LINE_THICKNESS:
+                self.lines.append((x0, x1, (y0 + y1) / 2))
+            elif stroked and not curved:
+                ends = np.concatenate([points, points[:1]] if closed else [points])
+                for (ax, ay), (bx, by) in zip(ends, ends[1:]):
+                    if abs(ay - by) < 0.5 and abs(ax - bx) > 0:
+                        self.lines.append((min(ax, bx), max(ax, bx), (ay + by) / 2))
+
+            raster = self.to_raster(points)
+            if dark_fill:
+                cv2.fillPoly(self.mask, [raster], 255)
+            else:
+                # light fills are field shading: only their outline separates
+                cv2.polylines(self.mask, [raster], closed or filled, 255, thickness=2)
+
+    def to_page(self, x: float, y: float) -> tuple[float, float]:
+        return self.left + x / self.scale, self.top - y / self.scale
+
+
+def text_rects(textpage: pypdfium2.PdfTextPage) -> np.ndarray:
+    """`(n, 4)` boxes (left, bottom, right, top) of the text on the page."""
+    count = textpage.count_rects()
+    return np.array(
+        [textpage.get_rect(i) for i in range(count)], dtype=np.float64
+    ).reshape(-1, 4)
+
+
+def overlaps(boxes: np.ndarray, box) -> np.ndarray:
+    """Area of each of `boxes` inside `box`, all (left, bottom, right, top)."""
+    w = np.clip(
+        np.minimum(boxes[:, 2], box[2]) - np.maximum(boxes[:, 0], box[0]), 0, None
+    )
+    h = np.clip(
+        np.minimum(boxes[:, 3], box[3]) - np.maximum(boxes[:, 1], box[1]), 0, None
+    )
+    return w * h
+
+
+def free_part(cell, text: np.ndarray):
+    """
+    The part of `cell` left free by a label in its top-left corner: to the
+    right of the text, or below it. None if the text fills the cell, or isn't a
+    label (e.g. a centered table header).
+    """
+    left, bottom, right, top = cell
+    options = []
+    text_right = text[:, 2].max() + 2
+    if text[:, 0].min() - left <= LABEL_INSET and right - text_right >= MIN_FIELD_WIDTH:
+        options.append((text_right, bottom, right, top))
+    text_bottom = text[:, 1].min() - 1
+    if (
+        top - text[:, 3].max() <= LABEL_INSET
+        and text_bottom - bottom >= MIN_FIELD_HEIGHT
+        and right - left >= MIN_FIELD_WIDTH
+    ):
+        options.append((left, bottom, right, text_bottom))
+    if not options:
+        return None
+    return max(options, key=lambda box: (box[2] - box[0]) * (box[3] - box[1]))
+
+
+def cell_candidates(geometry: Geometry, text: np.ndarray) -> list[tuple]:
+    """Candidates from the enclosed rectangular regions of the page."""
+    raster_h, raster_w = geometry.labels.shape
+
+    boxes, candidates = [], []
+    for label in range(1, geometry.regions):
+        x, y, w, h, area = geometry.stats[label]
+        # the page background, and anything that isn't a rectangle
+        if x == 0 or y == 0 or x + w >= raster_w or y + h >= raster_h:
+            continue
+        if area < 0.9 * w * h:
+            continue
+
+        left, top = geometry.to_page(x - 1, y - 1)
+        right, bottom = geometry.to_page(x + w + 1, y + h + 1)
+        cell = (left, bottom, right, top)
+        width, height = right - left, top - bottom
+        inside = overlaps(text, cell)
+        has_text = inside > 0.25 * np.maximum(
+            (text[:, 2] - text[:, 0]) * (text[:, 3] - text[:, 1]), 1e-6
+        )
+
+        if width <= MAX_COMB_BOX and CHECKBOX_MIN <= height <= MAX_COMB_BOX:
+            if not has_text.any():
+                boxes.append(cell)
+            continue
+
+        if not MIN_FIELD_HEIGHT <= height <= MAX_FIELD_HEIGHT:
+            continue
+        if has_text.any():
+            cell = free_part(cell, text[has_text])
+            if cell is None:
+                continue
+        if cell[2] - cell[0] >= MIN_FIELD_WIDTH:
+            candidates.append((cell, TEXT_BOX, CELL_CONFIDENCE))
+
+    # small boxes side by side are a comb field, one character per box; a box
+    # on its own is a checkbox if it's square
+    rows = []
+    for box in sorted(boxes):
+        for row in rows:
+            last = row[-1]
+            if (
+                abs(box[3] - last[3]) <= 2
+                and abs(box[1] - last[1]) <= 2
+                and box[0] - last[2] <= 3
+            ):
+                row.append(box)
+                break
+        else:
+            rows.append([box])
+
+    for row in rows:
+        left, bottom, right, top = (
+            row[0][0],
+            min(b[1] for b in row),
+            row[-1][2],
+            max(b[3] for b in row),
+        )
+        width, height = right - left, top - bottom
+        if len(row) > 1:
+            candidates.append(((left, bottom, right, top), TEXT_BOX, COMB_CONFIDENCE))
+        elif (
+            CHECKBOX_MIN <= width <= CHECKBOX_MAX
+            and height <= CHECKBOX_MAX
+            and 0.75 <= width / height <= 1.33
+        ):
+            candidates.append((row[0], CHOICE_BUTTON, SQUARE_CONFIDENCE))
+        elif width >= CHECKBOX_MIN:
+            candidates.append((row[0], TEXT_BOX, COMB_CONFIDENCE))
+
+    return candidates
+
+
+def underline_candidates(geometry: Geometry, text: np.ndarray) -> list[tuple]:
+    """Candidates from horizontal lines that are neither borders nor underlined text."""
+    labels = geometry.labels
+    raster_h, raster_w = labels.shape
+    offset = 4
+    candidates = []
+    for x0, x1, y in geometry.lines:
+        if x1 - x0 < MIN_FIELD_WIDTH:
+            continue
+
+        # a line with different regions above and below it separates them, so
+        # it's the edge of a box or a table row rather than a line to write on
+        ((px, py),) = geometry.to_raster(np.array([[(x0 + x1) / 2, y]]))
+        above = labels[max(py - offset, 0), min(max(px, 0), raster_w - 1)]
+        below = labels[min(py + offset, raster_h - 1), min(max(px, 0), raster_w - 1)]
+        if above != below:
+            continue
+
+        # text on the line (not just touching it) means it's underlined text
+        band = (x0, y + 1, x1, y + UNDERLINE_FIELD_HEIGHT * 0.7)
+        covered = overlaps(text, band)
+        widths = np.clip(
+            np.minimum(text[:, 2], x1) - np.maximum(text[:, 0], x0), 0, None
+        )
+        if widths[covered > 0].sum() > 0.5 * (x1 - x0):
+            continue
+
+        # stop short of any text above it
+        top = y + UNDERLINE_FIELD_HEIGHT
+        over = (widths > 0) & (text[:, 1] > y + 4) & (text[:, 1] < top)
+        if over.any():
+            top = text[over, 1].min() - 1
+        if top - y >= MIN_FIELD_HEIGHT:
+            candidates.append(((x0, y, x1, top), TEXT_BOX, UNDERLINE_CONFIDENCE))
+
+    for left, bottom, right, top in geometry.circles:
+        candidates.append(
+            ((left, bottom, right, top), CHOICE_BUTTON, CIRCLE_CONFIDENCE)
+        )
+    return candidates
+
+
+def text_candidates(textpage: pypdfium2.PdfTextPage) -> list[tuple]:
+    """Candidates from underscore runs and checkbox characters in the text."""
+    text = textpage.get_text_range()
+    candidates = []
+    for match in UNDERSCORES.finditer(text):
+        first = textpage.get_charbox(match.start(), loose=True)
+        last = textpage.get_charbox(match.end() - 1, loose=True)
+        box = (first[0], min(first[1], last[1]), last[2], max(first[3], last[3]))
+        if box[2] - box[0] >= MIN_FIELD_WIDTH:
+            candidates.append((box, TEXT_BOX, UNDERSCORE_CONFIDENCE))
+    for index, char in enumerate(text):
+        if char in CHECKBOX_GLYPHS:
+            candidates.append(
+                (textpage.get_charbox(index), CHOICE_BUTTON, CHECKBOX_GLYPH_CONFIDENCE)
+            )
+    return candidates
+
+
+def pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU between `(n, 4)` and `(m, 4)` boxes given by their min and max corners."""
+    w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(
+        a[:, None, 0], b[None, :, 0]
+    )
+    h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(
+        a[:, None, 1], b[None, :, 1]
+    )
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-12)
+
+
+def deduplicate(candidates: list[tuple], iou_threshold: float = 0.5) -> list[tuple]:
+    """Keep the most confident of any overlapping candidates."""
+    candidates = sorted(candidates, key=lambda c: -c[2])
+    if not candidates:
+        return []
+    iou = pairwise_iou(*[np.array([c[0] for c in candidates], dtype=np.float64)] * 2)
+    kept = []
+    for i in range(len(candidates)):
+        if not (iou[i, kept] > iou_threshold).any():
+            kept.append(i)
+    return [candidates[i] for i in kept]
+
+
+def snap_to_candidates(
+    detections: Detections, candidates: Detections, iou_threshold: float = 0.5
+) -> Detections:
+    """
+    Replace each detected box with the same-class candidate it overlaps most,
+    if that overlap is at least `iou_threshold`: the drawn geometry is exact,
+    where the model's box is only as precise as the page render it saw.
+    """
+    if len(detections) == 0 or len(candidates) == 0:
+        return detections
+    iou = pairwise_iou(detections.xyxyn, candidates.xyxyn)
+    iou[detections.class_id[:, None] != candidates.class_id[None, :]] = 0.0
+    best = iou.argmax(axis=1)
+    snapped = iou[np.arange(len(detections)), best] >= iou_threshold
+    xyxyn = detections.xyxyn.copy()
+    xyxyn[snapped] = candidates.xyxyn[best[snapped]]
+    return Detections(
+        xyxyn=xyxyn, class_id=detections.class_id, confidence=detections.confidence
+    )
+
+
+def page_vectors(page: pypdfium2.PdfPage) -> PageVectors:
+    """Propose field candidates for an open page from its paths and text."""
+    geometry = Geometry(page)
+    textpage = page.get_textpage()
+    try:
+        text = text_rects(textpage)
+        candidates = cell_candidates(geometry, text)
+        candidates += underline_candidates(geometry, text)
+        candidates += text_candidates(textpage)
+        text_chars = textpage.count_chars()
+    finally:
+        textpage.close()
+
+    candidates = [
+        c for c in deduplicate(candidates) if c[0][2] > c[0][0] and c[0][3] > c[0][1]
+    ]
+    if not candidates:
+        return PageVectors(Detections.empty(), geometry.image_coverage, text_chars)
+
+    boxes = np.array([c[0] for c in candidates], dtype=np.float64)
+    width = geometry.right - geometry.left
+    height = geometry.top - geometry.bottom
+    xyxyn = np.stack(
+        [
+            (boxes[:, 0] - geometry.left) / width,
+            (geometry.top - boxes[:, 3]) / height,
+            (boxes[:, 2] - geometry.left) / width,
+            (geometry.top - boxes[:, 1]) / height,
+        ],
+        axis=1,
+    )
+    return PageVectors(
+        candidates=Detections(
+            xyxyn=np.clip(xyxyn, 0.0, 1.0),
+            class_id=np.array([c[1] for c in candidates], dtype=np.int64),
+            confidence=np.array([c[2] for c in candidates], dtype=np.float32),
+        ),
+        image_coverage=geometry.image_coverage,
+        text_chars=text_chars,
+    )
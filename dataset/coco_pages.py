@@ -0,0 +1,83 @@
+"""
+Reading the per-page records written by `generate_coco.py`.
+
+Each page is a JSON object with its `image` (file name and size) and its
+`annotations`, appended as one line to a shard in `annotations/`. A PDF's pages
+only count once `manifest.jsonl` has a line for it, giving the shard, byte
+offset and length of its records; anything else in the shards was left behind
+by an interrupted run and is ignored.
+
+Datasets from older versions of `generate_coco.py`, with one JSON file per page
+in `json/`, are read too.
+"""
+
+import json
+from pathlib import Path
+
+MANIFEST = "manifest.jsonl"
+ANNOTATIONS = "annotations"
+
+
+def read_manifest(coco_dir):
+    """Completed PDFs, in the order they were written (a torn last line is dropped)."""
+    path = Path(coco_dir) / MANIFEST
+    if not path.exists():
+        return []
+
+    entries = []
+    with path.open("rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break
+            entries.append(json.loads(line))
+    return entries
+
+
+def read_entry(coco_dir, entry, fp=None):
+    """The page records of one manifest entry."""
+    if fp is None:
+        with (Path(coco_dir) / ANNOTATIONS / entry["shard"]).open("rb") as fp:
+            return read_entry(coco_dir, entry, fp)
+    fp.seek(entry["offset"])
+    data = fp.read(entry["length"])
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def page_sources(coco_dir):
+    """
+    The units the pages can be read in, in order: manifest entries sorted by PDF
+    name (so the order doesn't depend on how a run was interrupted and resumed),
+    or the old per-page JSON files.
+    """
+    coco_dir = Path(coco_dir)
+    entries = read_manifest(coco_dir)
+    if not entries and (coco_dir / "json").exists():
+        return sorted((coco_dir / "json").glob("*.json"))
+    return sorted(entries, key=lambda e: e["name"])
+
+
+def read_source(coco_dir, source, fp=None):
+    """The page records of one item from `page_sources`."""
+    if isinstance(source, Path):
+        with source.open() as json_fp:
+            return [json.load(json_fp)]
+    return read_entry(coco_dir, source, fp)
+
+
+def iter_pages(coco_dir):
+    """Every page record, in `page_sources` order."""
+    coco_dir = Path(coco_dir)
+    shards = {}
+    try:
+        for source in page_sources(coco_dir):
+            fp = None
+            if isinstance(source, dict):
+                if source["shard"] not in shards:
+                    shards[source["shard"]] = (
+                        coco_dir / ANNOTATIONS / source["shard"]
+                    ).open("rb")
+                fp = shards[source["shard"]]
+            yield from read_source(coco_dir, source, fp)
+    finally:
+        for fp in shards.values():
+            fp.close()
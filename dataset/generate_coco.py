@@ -1,183 +1,355 @@
+"""
+Render PDFs with form fields into a COCO-style dataset: one JPEG per page in
+`images/`, and one annotation record per page appended to the JSONL shards in
+`annotations/` (see `coco_pages.py`).
+
+`manifest.jsonl` gets a line for each PDF once all of its pages are written, so
+an interrupted run resumes exactly: PDFs in the manifest are skipped, and
+everything else, including PDFs that were half done, is processed again. PDFs
+with the same content as one already processed are skipped too.
+
+With `--pack`, page images are written into large tar files in `packs/` instead
+of one JPEG each in `images/` (see `packed.py`).
+
+    python generate_coco.py [pdfs] [coco] [--workers N] [--chunk-size N] [--pack]
+"""
+
+import argparse
+import hashlib
+import io
 import json
-import sys
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import formalpdf
-import logging
-import pypdfium2.raw as pdfium_c
-import ctypes
+import numpy as np
 
+from coco_pages import ANNOTATIONS, MANIFEST, read_manifest
+from packed import PACKS, PackWriter
 
 logging.getLogger("pypdfium2").setLevel(logging.ERROR)
 
-def process_pdf(pdf_path, output_dir):
-    """Process all pages of a PDF and generate JSON annotation files"""
-    json_dir = output_dir / "json"
-    images_dir = output_dir / "images"
+TARGET_PX = 1680
+
+# widget field types to category ids; anything above 2 isn't annotated
+CATEGORIES = {
+    "Text": 0,
+    "ComboBox": 0,
+    "CheckBox": 1,
+    "RadioButton": 1,
+    "Signature": 2,
+    "PushButton": 3,
+    "ListBox": 3,
+    "Unknown": 3,
+}
+
+# pages per annotation shard before starting the next one
+SHARD_PAGES = 10_000
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_to_pixels(rects, cropbox, rotation, width, height):
+    """
+    Map `(n, 4)` PDF rects (left, bottom, right, top) to `(n, 4)` pixel boxes
+    (x0, y0, x1, y1) on a `width` x `height` render of the page, like pdfium's
+    `FPDF_PageToDevice` but for all of a page's rects at once and without
+    rounding to whole pixels.
+    """
+    left, bottom, right, top = cropbox
+    # unrotated page, normalized, with a top-left origin
+    u = (rects[:, [0, 2]] - left) / (right - left)
+    v = (top - rects[:, [3, 1]]) / (top - bottom)
+    # the page is displayed rotated clockwise by `rotation` degrees
+    if rotation == 90:
+        u, v = 1 - v, u
+    elif rotation == 180:
+        u, v = 1 - u, 1 - v
+    elif rotation == 270:
+        u, v = v, 1 - u
+    x, y = u * width, v * height
+    return np.stack(
+        [x.min(axis=1), y.min(axis=1), x.max(axis=1), y.max(axis=1)], axis=1
+    )
+
+
+def process_page(document, page_idx, pdf_name, images_dir, pack):
+    pdfium_page = document.document[page_idx]
+    width_pt, height_pt = pdfium_page.get_size()
+    # Scale based on the smaller dimension
+    scale = TARGET_PX / min(width_pt, height_pt)
+
+    image = pdfium_page.render(scale=scale, may_draw_forms=False).to_pil()
+    image_filename = f"{pdf_name}-{page_idx}.jpg"
+    if pack:
+        # returned to the parent process, which writes the pack
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG")
+        image_bytes = buffer.getvalue()
+    else:
+        image.save(images_dir / image_filename, format="JPEG")
+        image_bytes = None
+
+    widgets = document[page_idx].widgets()
+    category_ids = np.array(
+        [CATEGORIES.get(widget.field_type_string, 3) for widget in widgets]
+    )
+    rects = np.array(
+        [
+            [widget.rect.left, widget.rect.bottom, widget.rect.right, widget.rect.top]
+            for widget in widgets
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    boxes = page_to_pixels(
+        rects,
+        pdfium_page.get_cropbox(),
+        pdfium_page.get_rotation(),
+        image.width,
+        image.height,
+    )
+
+    annotations = []
+    for category_id, (x0, y0, x1, y1) in zip(category_ids.tolist(), boxes.tolist()):
+        if category_id > 2:
+            continue
+        annotations.append(
+            {
+                "category_id": category_id,
+                "bbox": [x0, y0, x1 - x0, y1 - y0],
+                "area": (x1 - x0) * (y1 - y0),
+                "iscrowd": 0,
+                "segmentation": [],
+            }
+        )
+
+    record = {
+        "image": {
+            "file_name": image_filename,
+            "width": image.width,
+            "height": image.height,
+        },
+        "annotations": annotations,
+    }
+    return record, image_bytes, len(widgets)
+
+
+def process_pdf(pdf_path, sha256, images_dir, pack):
+    """Render every page of a PDF, returning its page records (or the error)."""
     pdf_name = pdf_path.stem
-
-    # Check if first page JSON exists - if so, skip entire PDF
-    first_page_json = json_dir / f"{pdf_name}-0.json"
-
-    if first_page_json.exists():
-        return f"Skipped {pdf_name} (already processed)"
-
+    result = {"source": str(pdf_path), "sha256": sha256, "name": pdf_name}
     try:
         document = formalpdf.open(str(pdf_path))
-        num_pages = len(document)
-        total_widgets = 0
-
-        for page_idx in range(num_pages):
-            page = document[page_idx]
-            pdfium_page = document.document[page_idx]
-
-            width_pt, height_pt = pdfium_page.get_size()
-            target_px = 1680
-            # Scale based on the smaller dimension
-            scale = target_px / min(width_pt, height_pt)
-
-            image = pdfium_page.render(scale=scale, may_draw_forms=False).to_pil()
-            widgets = page.widgets()
-
-            image_filename = f"{pdf_name}-{page_idx}.jpg"
-
-            # Create image info
-            image_info = {
-                    "file_name": image_filename,
-                    "width": image.width,
-                    "height": image.height,
-                    }
-
-            # Save image
-            image.save(images_dir / image_filename, format="JPEG")
-
-            # Process annotations
-            annotations = []
-            for widget in widgets:
-                # Use pypdfium2's page-to-device coordinate transformation
-                # to properly convert PDF coordinates to image pixel coordinates
-                page_x1, page_y1 = widget.rect.left, widget.rect.bottom
-                page_x2, page_y2 = widget.rect.right, widget.rect.top
-
-                # Convert page coordinates to device coordinates
-                # using pypdfium2's FPDF_PageToDevice function
-                dev_x1 = ctypes.c_int()
-                dev_y1 = ctypes.c_int()
-                dev_x2 = ctypes.c_int()
-                dev_y2 = ctypes.c_int()
-
-                # FPDF_PageToDevice(page, start_x, start_y, size_x, size_y, rotate, page_x, page_y, device_x, device_y)
-                pdfium_c.FPDF_PageToDevice(
-                        pdfium_page.raw, 0, 0, image.width, image.height, 0,
-                        page_x1, page_y1, ctypes.byref(dev_x1), ctypes.byref(dev_y1)
-                        )
-                pdfium_c.FPDF_PageToDevice(
-                        pdfium_page.raw, 0, 0, image.width, image.height, 0,
-                        page_x2, page_y2, ctypes.byref(dev_x2), ctypes.byref(dev_y2)
-                        )
-
-                # Convert to Python ints
-                left = float(dev_x1.value)
-                bottom = float(dev_y1.value)
-                right = float(dev_x2.value)
-                top = float(dev_y2.value)
-
-                # Device coordinates have top-left origin, so y values are already correct
-                y0 = min(top, bottom)
-                y1 = max(top, bottom)
-
-                # try for the category, otherwise "Text"
-                categories = { "Text": 0,
-                               "ComboBox": 0,
-                               "CheckBox": 1,
-                               "RadioButton": 1,
-                               "Signature": 2,
-                               "PushButton": 3,
-                               "ListBox": 3,
-                               "Unknown": 3 }
-
-                category_id = categories.get(widget.field_type_string, 3)
-
-                if category_id > 2:
-                    continue
-
-                bbox_width = right - left
-                bbox_height = y1 - y0
-
-                annotations.append({
-                    "category_id": category_id,
-                    "bbox": [left, y0, bbox_width, bbox_height],
-                    "area": bbox_width * bbox_height,
-                    "iscrowd": 0,
-                    "segmentation": [],
-                    })
-
-            # Create per-page JSON
-            page_data = {
-                    "image": image_info,
-                    "annotations": annotations,
-                    }
-
-            # Save JSON
-            json_path = json_dir / f"{pdf_name}-{page_idx}.json"
-
-            with json_path.open("w") as fp:
-                json.dump(page_data, fp, indent=2)
-
-            total_widgets += len(widgets)
-
-        return f"Processed {pdf_name}: {num_pages} pages, {total_widgets} widgets"
+    except Exception as e:
+        return {**result, "error": str(e)}
 
+    try:
+        pages, images, widgets = [], [], 0
+        for page_idx in range(len(document)):
+            record, image_bytes, page_widgets = process_page(
+                document, page_idx, pdf_name, images_dir, pack
+            )
+            pages.append(record)
+            images.append(image_bytes)
+            widgets += page_widgets
+        return {**result, "pages": pages, "images": images, "widgets": widgets}
     except Exception as e:
-        return f"Error processing {pdf_name}: {str(e)}"
-    
+        return {**result, "error": str(e)}
     finally:
         document.document.close()
 
 
+def process_chunk(chunk, images_dir, pack):
+    return [
+        process_pdf(pdf_path, sha256, images_dir, pack) for pdf_path, sha256 in chunk
+    ]
+
+
+class ShardWriter:
+    """
+    Appends page records to `annotations/part-NNNNN.jsonl`, starting a new shard
+    every `SHARD_PAGES` pages. Every run starts a new shard, so it never appends
+    to one an interrupted run might have left with a torn last line.
+    """
+
+    def __init__(self, directory, shard_pages=SHARD_PAGES):
+        self.directory = Path(directory)
+        self.shard_pages = shard_pages
+        existing = sorted(self.directory.glob("part-*.jsonl"))
+        self.index = int(existing[-1].stem.split("-")[1]) + 1 if existing else 0
+        self.fp = None
+        self.pages = 0
+
+    def write(self, records):
+        """Append `records`, returning the shard, offset and length they went to."""
+        if self.fp is None or self.pages >= self.shard_pages:
+            self.close()
+            self.name = f"part-{self.index:05d}.jsonl"
+            self.fp = (self.directory / self.name).open("ab")
+            self.index += 1
+            self.pages = 0
+
+        data = b"".join(
+            json.dumps(record, separators=(",", ":")).encode() + b"\n"
+            for record in records
+        )
+        offset = self.fp.tell()
+        self.fp.write(data)
+        self.fp.flush()
+        self.pages += len(records)
+        return {"shard": self.name, "offset": offset, "length": len(data)}
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+def chunk_size_for(num_tasks, workers):
+    # enough chunks per worker that an unlucky chunk of long PDFs at the end
+    # doesn't leave the other workers idle, but few enough that per-task
+    # overhead doesn't matter
+    return max(1, min(16, num_tasks // (workers * 8)))
+
+
 def main():
-    pdfs_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("pdfs")
-    output_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("coco")
-    json_dir = output_dir / "json"
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("pdfs_dir", nargs="?", type=Path, default=Path("pdfs"))
+    parser.add_argument("output_dir", nargs="?", type=Path, default=Path("coco"))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="PDFs per task (default: picked from the number of PDFs and workers)",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Write page images into tar packs in packs/ instead of separate JPEGs",
+    )
+    parser.add_argument(
+        "--pages-per-pack",
+        type=int,
+        default=2000,
+        help="Pages per pack with --pack (default: 2000)",
+    )
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
     images_dir = output_dir / "images"
+    annotations_dir = output_dir / ANNOTATIONS
+    packs_dir = output_dir / PACKS
+    for directory in (output_dir, images_dir, annotations_dir):
+        directory.mkdir(exist_ok=True)
+    if args.pack:
+        packs_dir.mkdir(exist_ok=True)
+
+    pdf_files = sorted(args.pdfs_dir.rglob("*.pdf"))
+    print(f"Found {len(pdf_files)} PDF files")
+
+    manifest = read_manifest(output_dir)
+    done_sources = {entry["source"] for entry in manifest}
+    seen_hashes = {entry["sha256"] for entry in manifest}
+    new_files = [path for path in pdf_files if str(path) not in done_sources]
+    print(f"Already processed (skipped): {len(pdf_files) - len(new_files)} PDFs")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # hash before rendering, so duplicate PDFs are only rendered once
+        hashes = executor.map(
+            file_sha256,
+            new_files,
+            chunksize=chunk_size_for(len(new_files), args.workers) * 8,
+        )
+        tasks, duplicates = [], 0
+        for pdf_path, sha256 in zip(new_files, hashes):
+            if sha256 in seen_hashes:
+                duplicates += 1
+                continue
+            seen_hashes.add(sha256)
+            tasks.append((pdf_path, sha256))
+        print(f"Duplicates (skipped): {duplicates} PDFs")
+        print(f"New PDFs to process: {len(tasks)}")
+
+        chunk_size = args.chunk_size or chunk_size_for(len(tasks), args.workers)
+        chunks = iter(
+            [tasks[i : i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        )
+        writer = ShardWriter(annotations_dir)
+        packer = PackWriter(packs_dir, args.pages_per_pack) if args.pack else None
+        completed = 0
+
+        with (output_dir / MANIFEST).open("a") as manifest_fp:
+            # keep a couple of chunks queued per worker, rather than submitting
+            # millions of tasks up front
+            in_flight = set()
+            for chunk in chunks:
+                in_flight.add(
+                    executor.submit(process_chunk, chunk, images_dir, args.pack)
+                )
+                if len(in_flight) >= args.workers * 2:
+                    break
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        completed += 1
+                        progress = f"[{completed}/{len(tasks)}]"
+                        if "error" in result:
+                            print(
+                                f"{progress} Error processing {result['name']}: "
+                                f"{result['error']}"
+                            )
+                            continue
+
+                        if packer is not None:
+                            location = {
+                                "pack": packer.write(
+                                    zip(result["images"], result["pages"])
+                                )
+                            }
+                        else:
+                            location = {}
+                        location.update(writer.write(result["pages"]))
+                        entry = {
+                            "source": result["source"],
+                            "sha256": result["sha256"],
+                            "name": result["name"],
+                            "pages": len(result["pages"]),
+                            "widgets": result["widgets"],
+                            **location,
+                        }
+                        # only once the records are in the shard
+                        manifest_fp.write(json.dumps(entry) + "\n")
+                        manifest_fp.flush()
+                        print(
+                            f"{progress} Processed {result['name']}: "
+                            f"{entry['pages']} pages, {entry['widgets']} widgets"
+                        )
+
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        in_flight.add(
+                            executor.submit(process_chunk, chunk, images_dir, args.pack)
+                        )
 
-    # Create directories
-    output_dir.mkdir(exist_ok=True)
-    json_dir.mkdir(exist_ok=True)
-    images_dir.mkdir(exist_ok=True)
-
-    # Find all PDF files
-    pdf_files = list(pdfs_dir.rglob("*.pdf"))
-    total_pdfs = len(pdf_files)
-    print(f"Found {total_pdfs} PDF files")
-
-    # Check which PDFs are already processed
-    skipped_count = 0
-    tasks = []
-
-    for pdf_path in pdf_files:
-        pdf_name = pdf_path.stem
-        first_page_json = json_dir / f"{pdf_name}-0.json"
-
-        if first_page_json.exists():
-            skipped_count += 1
-        else:
-            tasks.append(pdf_path)
-
-    print(f"Already processed (skipped): {skipped_count} PDFs")
-    print(f"New PDFs to process: {len(tasks)}")
-
-    if tasks:
-        # Process PDFs in parallel
-        with ProcessPoolExecutor() as executor:
-            futures = {executor.submit(process_pdf, pdf_path, output_dir): pdf_path for pdf_path in tasks}
-
-            completed = 0
-            for future in as_completed(futures):
-                completed += 1
-                result = future.result()
-                print(f"[{completed}/{len(tasks)}] {result}")
+        writer.close()
+        if packer is not None:
+            packer.close()
 
 
 if __name__ == "__main__":
@@ -1,102 +1,235 @@
+"""
+Merge the per-page records from `generate_coco.py` into COCO annotation files.
+
+Pages are read and filtered in parallel, in chunks, and written out as they
+arrive: images go straight to the output and annotations to a temporary file
+that's appended once the images are done, so memory doesn't grow with the size
+of the dataset. Image and annotation IDs are assigned in page order (PDF name,
+then page), so they're the same however many workers are used.
+
+    python merge_coco.py [coco] [--workers N] [--pages-per-shard N]
+        [--deny ID ...] [--deny-list FILE]
+"""
+
+import argparse
+import csv
 import json
 import os
-import sys
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-
-def merge_coco_annotations():
-    """Merge individual JSON files into a single COCO format annotations file"""
-    coco_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("coco")
-    json_dir = coco_dir / "json"
-    output_file = coco_dir / "annotations.json"
-
-    # COCO format structure
-    coco_data = {
-            "info": {
-                "year": 2025,
-                "version": "1.0",
-                "description": "Form field detection dataset",
-                "contributor": "",
-                "url": "",
-                "date_created": "2025-10-16"
-            },
-            "licenses": [
-                {
-                    "id": 1,
-                    "name": "Unknown",
-                    "url": ""
-                }
-            ],
-            "images": [],
-            "annotations": [],
-            "categories": [
-                {"id": 0, "name": "Text", "supercategory": "none"},
-                {"id": 1, "name": "CheckBox", "supercategory": "none"}
-                ]
-            }
-
-    # Get all JSON files sorted by name
-    json_files = sorted(json_dir.glob("*.json"))
-
-    image_id = 0
-    annotation_id = 0
-
-    for json_file in json_files:
-        with json_file.open("r") as fp:
-            page_data = json.load(fp)
-
-        # Add image with sequential ID
-        image_info = page_data["image"].copy()
-        image_info["id"] = image_id
-        coco_data["images"].append(image_info)
-
-        # Track seen bounding boxes for this page to skip duplicates
-        seen_bboxes = set()
-
-        # Add annotations with sequential IDs and image_id reference
-        for annotation in page_data["annotations"]:
-            if json_file.name.startswith("2908641"):
-                continue
-
-            # Round bounding box to integers
-            bbox = annotation["bbox"]
-            bbox_int = [round(bbox[0]), round(bbox[1]), round(bbox[2]), round(bbox[3])]
-
-            # Skip if any x or y coordinate is negative
-            if bbox_int[0] < 0 or bbox_int[1] < 0:
-                continue
-
-            # Skip if bbox extends beyond image boundaries
-            if (bbox_int[0] + bbox_int[2] > image_info["width"] or
-                bbox_int[1] + bbox_int[3] > image_info["height"]):
-                continue
-
-            # Calculate area from rounded bounding box
-            area_int = bbox_int[2] * bbox_int[3]
-
-            bbox_tuple = tuple(bbox_int)
-
-            # Skip if this bounding box was already added for this page
-            if bbox_tuple in seen_bboxes:
-                continue
-
-            seen_bboxes.add(bbox_tuple)
-            annotation_copy = annotation.copy()
-            annotation_copy["id"] = annotation_id
-            annotation_copy["image_id"] = image_id
-            annotation_copy["bbox"] = bbox_int
-            annotation_copy["area"] = area_int
-            coco_data["annotations"].append(annotation_copy)
-            annotation_id += 1
-
-        image_id += 1
-
-    # Save merged COCO format file
-    with output_file.open("w") as fp:
-        json.dump(coco_data, fp, indent=2)
-
-    print(f"Merged {len(coco_data['images'])} images with {len(coco_data['annotations'])} annotations")
-    print(f"Saved to {output_file}")
+from coco_pages import page_sources, read_source
+
+INFO = {
+    "year": 2025,
+    "version": "1.0",
+    "description": "Form field detection dataset",
+    "contributor": "",
+    "url": "",
+    "date_created": "2025-10-16",
+}
+LICENSES = [{"id": 1, "name": "Unknown", "url": ""}]
+CATEGORIES = [
+    {"id": 0, "name": "Text", "supercategory": "none"},
+    {"id": 1, "name": "CheckBox", "supercategory": "none"},
+]
+
+# PDFs whose annotations are known to be bad; their pages are kept as images
+# without annotations
+DEFAULT_DENY = ("2908641",)
+
+
+def page_id(file_name):
+    # images are named {id}-{page}.jpg
+    return file_name.split("-")[0]
+
+
+def clean_annotations(image_info, annotations, deny):
+    """
+    Round boxes to whole pixels, and drop boxes that are out of bounds or
+    repeated on the page, and every box of a deny-listed PDF.
+    """
+    if page_id(image_info["file_name"]) in deny:
+        return []
+
+    cleaned = []
+    # Track seen bounding boxes for this page to skip duplicates
+    seen_bboxes = set()
+    for annotation in annotations:
+        bbox = [round(v) for v in annotation["bbox"]]
+
+        # Skip if any x or y coordinate is negative
+        if bbox[0] < 0 or bbox[1] < 0:
+            continue
+
+        # Skip if bbox extends beyond image boundaries
+        if (
+            bbox[0] + bbox[2] > image_info["width"]
+            or bbox[1] + bbox[3] > image_info["height"]
+        ):
+            continue
+
+        if tuple(bbox) in seen_bboxes:
+            continue
+        seen_bboxes.add(tuple(bbox))
+
+        cleaned.append({**annotation, "bbox": bbox, "area": bbox[2] * bbox[3]})
+    return cleaned
+
+
+def read_chunk(coco_dir, sources, deny):
+    """Read and filter the pages of `sources`: a list of (image, annotations)."""
+    pages = []
+    for source in sources:
+        for page in read_source(coco_dir, source):
+            image_info = page["image"]
+            pages.append(
+                (image_info, clean_annotations(image_info, page["annotations"], deny))
+            )
+    return pages
+
+
+def ordered_chunks(executor, coco_dir, sources, deny, chunk_size, in_flight):
+    """The results of `read_chunk` in order, with at most `in_flight` pending."""
+    chunks = (sources[i : i + chunk_size] for i in range(0, len(sources), chunk_size))
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(read_chunk, coco_dir, chunk, deny))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class CocoWriter:
+    """Streams one COCO file: images as they come, annotations appended at the end."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fp = self.path.open("w")
+        self.annotations = tempfile.TemporaryFile(
+            "w+", dir=self.path.parent, prefix=".annotations-"
+        )
+        self.images = 0
+        self.annotation_count = 0
+
+        header = json.dumps(
+            {"info": INFO, "licenses": LICENSES, "categories": CATEGORIES}
+        )
+        self.fp.write(header[:-1] + ',"images":[')
+
+    def write(self, image_info, annotations):
+        self.fp.write(("," if self.images else "") + json.dumps(image_info))
+        self.images += 1
+        for annotation in annotations:
+            self.annotations.write(
+                ("," if self.annotation_count else "") + json.dumps(annotation)
+            )
+            self.annotation_count += 1
+
+    def close(self):
+        self.fp.write('],"annotations":[')
+        self.annotations.seek(0)
+        shutil.copyfileobj(self.annotations, self.fp)
+        self.annotations.close()
+        self.fp.write("]}")
+        self.fp.close()
+
+
+def read_deny_list(path):
+    with open(path) as fp:
+        return {row[0].strip() for row in csv.reader(fp) if row}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("coco_dir", nargs="?", type=Path, default=Path("coco"))
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Output file (default: coco/annotations.json)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes reading pages (default: one per core)",
+    )
+    parser.add_argument(
+        "--pages-per-shard",
+        type=int,
+        default=None,
+        help="Write annotations-NNNNN.json files of this many images each, instead of one file",
+    )
+    parser.add_argument(
+        "--deny",
+        action="append",
+        default=None,
+        help=f"Drop the annotations of this PDF ID (repeatable; default: {', '.join(DEFAULT_DENY)})",
+    )
+    parser.add_argument(
+        "--deny-list",
+        type=Path,
+        default=None,
+        help="File with more PDF IDs to deny, one per line (the first CSV column)",
+    )
+    args = parser.parse_args()
+
+    coco_dir = args.coco_dir
+    output_file = args.output or coco_dir / "annotations.json"
+    deny = set(DEFAULT_DENY if args.deny is None else args.deny)
+    if args.deny_list is not None:
+        deny |= read_deny_list(args.deny_list)
+
+    sources = page_sources(coco_dir)
+    # small enough chunks to spread over the workers, large enough that the
+    # per-task overhead doesn't dominate
+    chunk_size = max(1, min(64, len(sources) // (args.workers * 8)))
+
+    writer, shard = None, 0
+    image_id = annotation_id = 0
+    outputs = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for pages in ordered_chunks(
+            executor, coco_dir, sources, deny, chunk_size, args.workers * 2
+        ):
+            for image_info, annotations in pages:
+                if writer is None or (
+                    args.pages_per_shard and writer.images >= args.pages_per_shard
+                ):
+                    if writer is not None:
+                        writer.close()
+                    path = output_file
+                    if args.pages_per_shard:
+                        path = output_file.with_name(
+                            f"{output_file.stem}-{shard:05d}{output_file.suffix}"
+                        )
+                        shard += 1
+                    writer = CocoWriter(path)
+                    outputs.append(path)
+
+                for annotation in annotations:
+                    annotation["id"] = annotation_id
+                    annotation["image_id"] = image_id
+                    annotation_id += 1
+                writer.write({**image_info, "id": image_id}, annotations)
+                image_id += 1
+
+    if writer is None:
+        writer = CocoWriter(output_file)
+        outputs.append(output_file)
+    writer.close()
+
+    print(f"Merged {image_id} images with {annotation_id} annotations")
+    print(f"Saved to {', '.join(str(path) for path in outputs)}")
+
+    if args.pages_per_shard:
+        return
 
     # Create symlink in images folder
     images_dir = coco_dir / "images"
@@ -112,4 +245,4 @@ def merge_coco_annotations():
 
 
 if __name__ == "__main__":
-    merge_coco_annotations()
+    main()
@@ -0,0 +1,196 @@
+"""
+Packed shards: page images and their annotations in a few large tar files
+instead of millions of small ones, for training input pipelines.
+
+`generate_coco.py --pack` writes `packs/pack-NNNNN.tar`, each holding
+`{key}.jpg` and `{key}.json` members per page (`key` is `{pdf}-{page}`, the
+convention webdataset and similar loaders expect), and a `pack-NNNNN.idx`
+JSON-lines index with the byte offset and size of each member for random access.
+A page only counts once its PDF is in `manifest.jsonl`, as with the annotation
+shards, and the `.json` members are the same page records, so `merge_coco.py`
+and `split_dataset.py` work the same on a packed dataset.
+
+`PackedDataset` reads them back: `dataset[i]` reads one page with two seeks,
+and iterating reads the packs sequentially with a background thread fetching
+the next ones ahead. For tools that want the plain COCO layout,
+`python packed.py coco` extracts the images into `coco/images/`.
+"""
+
+import io
+import json
+import sys
+import queue
+import tarfile
+import threading
+from pathlib import Path
+
+from coco_pages import read_manifest
+
+PACKS = "packs"
+
+
+class PackWriter:
+    """
+    Appends pages to `pack-NNNNN.tar` files of up to `pages_per_pack` pages.
+    Like the annotation shards, every run starts a new pack.
+    """
+
+    def __init__(self, directory, pages_per_pack=2000):
+        self.directory = Path(directory)
+        self.pages_per_pack = pages_per_pack
+        existing = sorted(self.directory.glob("pack-*.tar"))
+        self.index = int(existing[-1].stem.split("-")[1]) + 1 if existing else 0
+        self.tar = self.idx = None
+        self.pages = 0
+
+    def add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        offset = self.tar.fileobj.tell() + len(
+            info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        )
+        self.tar.addfile(info, io.BytesIO(data))
+        return [offset, len(data)]
+
+    def write(self, pages):
+        """
+        Append `(image_bytes, record)` pages, all of one PDF, returning the pack
+        they went to.
+        """
+        if self.tar is None or self.pages >= self.pages_per_pack:
+            self.close()
+            self.name = f"pack-{self.index:05d}.tar"
+            self.tar = tarfile.open(self.directory / self.name, "w")
+            self.idx = (self.directory / f"pack-{self.index:05d}.idx").open("w")
+            self.index += 1
+            self.pages = 0
+
+        pages, lines = list(pages), []
+        for image_bytes, record in pages:
+            key = Path(record["image"]["file_name"]).stem
+            lines.append(
+                {
+                    "key": key,
+                    "image": self.add_member(f"{key}.jpg", image_bytes),
+                    "annotations": self.add_member(
+                        f"{key}.json", json.dumps(record).encode()
+                    ),
+                }
+            )
+        self.tar.fileobj.flush()
+        self.idx.write("".join(json.dumps(line) + "\n" for line in lines))
+        self.idx.flush()
+        self.pages += len(pages)
+        return self.name
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.idx.close()
+            self.tar = self.idx = None
+
+
+class PackedDataset:
+    """
+    The pages of a packed dataset, as `(key, jpeg_bytes, record)` tuples, in
+    pack order.
+    """
+
+    def __init__(self, coco_dir, prefetch=2):
+        self.directory = Path(coco_dir) / PACKS
+        self.prefetch = prefetch
+        complete = {
+            (entry["pack"], entry["name"])
+            for entry in read_manifest(coco_dir)
+            if "pack" in entry
+        }
+
+        # (pack, key, image offset/size, annotations offset/size)
+        self.samples = []
+        for idx_path in sorted(self.directory.glob("pack-*.idx")):
+            pack = idx_path.with_suffix(".tar").name
+            with idx_path.open("rb") as fp:
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        break
+                    entry = json.loads(line)
+                    if (pack, entry["key"].rsplit("-", 1)[0]) in complete:
+                        self.samples.append(
+                            (pack, entry["key"], entry["image"], entry["annotations"])
+                        )
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        pack, key, (image_offset, image_size), (ann_offset, ann_size) = self.samples[
+            index
+        ]
+        with (self.directory / pack).open("rb") as fp:
+            fp.seek(image_offset)
+            image_bytes = fp.read(image_size)
+            fp.seek(ann_offset)
+            record = json.loads(fp.read(ann_size))
+        return key, image_bytes, record
+
+    def read_pack(self, pack, samples):
+        # one sequential read of the whole pack, then slice the members out
+        data = (self.directory / pack).read_bytes()
+        return [
+            (
+                key,
+                data[image_offset : image_offset + image_size],
+                json.loads(data[ann_offset : ann_offset + ann_size]),
+            )
+            for _, key, (image_offset, image_size), (ann_offset, ann_size) in samples
+        ]
+
+    def __iter__(self):
+        by_pack = {}
+        for sample in self.samples:
+            by_pack.setdefault(sample[0], []).append(sample)
+
+        loaded = queue.Queue(maxsize=max(self.prefetch, 1))
+        stop = threading.Event()
+
+        def load():
+            try:
+                for pack, samples in by_pack.items():
+                    if stop.is_set():
+                        return
+                    loaded.put(self.read_pack(pack, samples))
+            except Exception as e:
+                loaded.put(e)
+            loaded.put(None)
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        try:
+            while (pages := loaded.get()) is not None:
+                if isinstance(pages, Exception):
+                    raise pages
+                yield from pages
+        finally:
+            stop.set()
+            # unblock the loader if it's waiting on a full queue
+            while thread.is_alive():
+                try:
+                    loaded.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
+def main():
+    coco_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("coco")
+    images_dir = coco_dir / "images"
+    images_dir.mkdir(exist_ok=True)
+
+    count = 0
+    for key, image_bytes, _ in PackedDataset(coco_dir):
+        (images_dir / f"{key}.jpg").write_bytes(image_bytes)
+        count += 1
+    print(f"Extracted {count} images to {images_dir}")
+
+
+if __name__ == "__main__":
+    main()
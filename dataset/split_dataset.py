@@ -1,155 +1,243 @@
+"""
+Split a dataset from `generate_coco.py` into test, val and train without moving
+any files.
+
+PDF IDs listed in `test.csv` and `val.csv` go to those splits and everything
+else to train. For each split, `{split}/annotations.json` is a COCO file with
+just its pages (filtered like `merge_coco.py`), and `{split}/manifest.jsonl`
+lists each PDF ID with its image files. With `--link`, `{split}/images/` is
+filled with hard or symbolic links to `coco/images/`, plus a link to the
+annotations as `_annotations.coco.json`, for trainers that want a directory per
+split.
+
+The outputs are rewritten on every run and links are brought up to date (only
+missing ones are created, stale ones removed), so it is safe to re-run, e.g.
+after changing the CSVs.
+
+    python split_dataset.py coco [--test test.csv] [--val val.csv] [--link symlink]
+"""
+
+import argparse
 import csv
-import shutil
-import sys
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
+from coco_pages import page_sources
+from merge_coco import (
+    DEFAULT_DENY,
+    CocoWriter,
+    ordered_chunks,
+    page_id,
+    read_deny_list,
+)
 
-def read_csv_ids(csv_path):
-    ids = []
-    with open(csv_path, 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row:
-                id_value = row[0].strip()
-                ids.append(id_value)
-    return ids
-
-
-def read_all_filenames(coco_dir):
-    """Read all filenames once into arrays"""
-    images_dir = coco_dir / 'images'
-    json_dir = coco_dir / 'json'
-
-    # Get all filenames as lists
-    image_files = [f for f in images_dir.iterdir() if f.is_file()]
-    json_files = [f for f in json_dir.iterdir() if f.is_file()]
-
-    return image_files, json_files
-
-
-def build_file_lookup(image_files, json_files):
-    from collections import defaultdict
-
-    image_lookup = defaultdict(list)
-    json_lookup = defaultdict(list)
-
-    for img_file in image_files:
-        # Extract ID from filename (ID-pagenumber.ext pattern)
-        id_value = img_file.name.split('-')[0]
-        image_lookup[id_value].append(img_file)
-
-    for json_file in json_files:
-        # Extract ID from filename (ID-pagenumber.ext pattern)
-        id_value = json_file.name.split('-')[0]
-        json_lookup[id_value].append(json_file)
-
-    return image_lookup, json_lookup
+SPLITS = ("test", "val", "train")
 
 
-def move_files(source_files, dest_dir):
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    moved_count = 0
-
-    for file_path in source_files:
-        dest_path = dest_dir / file_path.name
-        try:
-            shutil.move(str(file_path), str(dest_path))
-            moved_count += 1
-            print(f"Moved: {file_path.name}")
-        except Exception as e:
-            print(f"Error moving {file_path}: {e}")
-
-    return moved_count
+def read_csv_ids(csv_path):
+    with open(csv_path) as f:
+        return [row[0].strip() for row in csv.reader(f) if row]
+
+
+def link_files(file_names, source_dir, dest_dir, kind):
+    """Link `source_dir/name` to `dest_dir/name` for each name, skipping existing links."""
+    created = 0
+    for name in file_names:
+        source, dest = source_dir / name, dest_dir / name
+        if kind == "symlink":
+            target = os.path.relpath(source, dest_dir)
+            if dest.is_symlink() and os.readlink(dest) == target:
+                continue
+            dest.unlink(missing_ok=True)
+            os.symlink(target, dest)
+        else:
+            if (
+                dest.exists()
+                and not dest.is_symlink()
+                and os.path.samefile(source, dest)
+            ):
+                continue
+            dest.unlink(missing_ok=True)
+            os.link(source, dest)
+        created += 1
+    return created
+
+
+class SplitWriter:
+    """The COCO annotations and the manifest of one split."""
+
+    def __init__(self, split_dir):
+        self.dir = Path(split_dir)
+        self.coco = CocoWriter(self.dir / "annotations.json")
+        self.manifest = (self.dir / "manifest.jsonl").open("w")
+        self.annotations = 0
+        self.current_id, self.current_files = None, []
+        self.ids = 0
+
+    def add(self, image_info, annotations):
+        # pages arrive grouped by PDF, so the manifest is written as it goes
+        pdf_id = page_id(image_info["file_name"])
+        if pdf_id != self.current_id:
+            self.flush()
+            self.current_id = pdf_id
+
+        for annotation in annotations:
+            annotation["id"] = self.annotations
+            annotation["image_id"] = self.coco.images
+            self.annotations += 1
+        self.coco.write({**image_info, "id": self.coco.images}, annotations)
+        self.current_files.append(image_info["file_name"])
+
+    def flush(self):
+        if self.current_id is not None:
+            self.manifest.write(
+                json.dumps({"id": self.current_id, "files": self.current_files}) + "\n"
+            )
+            self.ids += 1
+        self.current_id, self.current_files = None, []
+
+    def close(self):
+        self.flush()
+        self.manifest.close()
+        self.coco.close()
 
 
 def main():
-    coco_dir = Path(sys.argv[1])
-
-    # Validate inputs
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("coco_dir", type=Path)
+    parser.add_argument("--test", type=Path, default=Path("test.csv"))
+    parser.add_argument("--val", type=Path, default=Path("val.csv"))
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Where to create the split directories (default: next to coco_dir)",
+    )
+    parser.add_argument(
+        "--link",
+        choices=["hardlink", "symlink"],
+        default=None,
+        help="Also create images/ directories of links for each split",
+    )
+    parser.add_argument(
+        "--deny",
+        action="append",
+        default=None,
+        help="Drop the annotations of this PDF ID, as in merge_coco.py",
+    )
+    parser.add_argument(
+        "--deny-list",
+        type=Path,
+        default=None,
+        help="File with more PDF IDs to deny, one per line",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes reading pages (default: one per core)",
+    )
+    args = parser.parse_args()
+
+    coco_dir = args.coco_dir
     if not coco_dir.exists():
         print(f"Error: Directory '{coco_dir}' does not exist")
         return 1
-
-    images_dir = coco_dir / 'images'
-    json_dir = coco_dir / 'json'
-
-    if not images_dir.exists() or not json_dir.exists():
-        print(f"Error: Directory must contain 'images' and 'json' subdirectories")
-        return 1
-
-    # Read CSV files
-    test_csv = Path('test.csv')
-    val_csv = Path('val.csv')
-
-    if not test_csv.exists() or not val_csv.exists():
-        print("Error: test.csv and val.csv must exist in current directory")
-        return 1
-
-    print(f"Reading test IDs from {test_csv}...")
-    test_ids = read_csv_ids(test_csv)
-    print(f"Found {len(test_ids)} test IDs")
-
-    print(f"\nReading validation IDs from {val_csv}...")
-    val_ids = read_csv_ids(val_csv)
-    print(f"Found {len(val_ids)} validation IDs")
-
-    # Create test and val directories as siblings to coco_dir
-    test_dir = coco_dir.parent / 'test'
-    val_dir = coco_dir.parent / 'val'
-
-    test_images_dir = test_dir / 'images'
-    test_json_dir = test_dir / 'json'
-    val_images_dir = val_dir / 'images'
-    val_json_dir = val_dir / 'json'
-
-    # Read all filenames once into memory and build lookup
-    print("\nReading all filenames from coco directory...")
-    image_files, json_files = read_all_filenames(coco_dir)
-    print(f"Found {len(image_files)} images and {len(json_files)} JSON files")
-
-    print("Building file lookup index...")
-    image_lookup, json_lookup = build_file_lookup(image_files, json_files)
-    print(f"Indexed {len(image_lookup)} unique image IDs and {len(json_lookup)} unique JSON IDs")
-
-    # Process test files
-    print("\n" + "="*60)
-    print("Processing TEST files...")
-    print("="*60)
-    test_image_count = 0
-    test_json_count = 0
-
-    for id_value in test_ids:
-        matching_images = image_lookup.get(id_value, [])
-        matching_json = json_lookup.get(id_value, [])
-        if matching_images or matching_json:
-            test_image_count += move_files(matching_images, test_images_dir)
-            test_json_count += move_files(matching_json, test_json_dir)
-
-    # Process validation files
-    print("\n" + "="*60)
-    print("Processing VALIDATION files...")
-    print("="*60)
-    val_image_count = 0
-    val_json_count = 0
-
-    for id_value in val_ids:
-        matching_images = image_lookup.get(id_value, [])
-        matching_json = json_lookup.get(id_value, [])
-        if matching_images or matching_json:
-            val_image_count += move_files(matching_images, val_images_dir)
-            val_json_count += move_files(matching_json, val_json_dir)
-
-    # Summary
-    print("\n" + "="*60)
-    print("SUMMARY")
-    print("="*60)
-    print(f"Test images moved: {test_image_count}")
-    print(f"Test JSON files moved: {test_json_count}")
-    print(f"Validation images moved: {val_image_count}")
-    print(f"Validation JSON files moved: {val_json_count}")
+    for csv_path in (args.test, args.val):
+        if not csv_path.exists():
+            print(f"Error: {csv_path} does not exist")
+            return 1
+
+    split_of = {}
+    for split, csv_path in (("val", args.val), ("test", args.test)):
+        ids = read_csv_ids(csv_path)
+        print(f"Found {len(ids)} {split} IDs in {csv_path}")
+        # test wins if an ID is listed in both
+        split_of.update((id_value, split) for id_value in ids)
+
+    deny = set(DEFAULT_DENY if args.deny is None else args.deny)
+    if args.deny_list is not None:
+        deny |= read_deny_list(args.deny_list)
+
+    output_dir = args.output_dir or coco_dir.parent
+    writers = {}
+    for split in SPLITS:
+        (output_dir / split).mkdir(parents=True, exist_ok=True)
+        writers[split] = SplitWriter(output_dir / split)
+
+    sources = page_sources(coco_dir)
+    chunk_size = max(1, min(64, len(sources) // (args.workers * 8)))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for pages in ordered_chunks(
+            executor,
+            coco_dir,
+            sources,
+            deny,
+            chunk_size,
+            args.workers * 2,
+        ):
+            for image_info, annotations in pages:
+                split = split_of.get(page_id(image_info["file_name"]), "train")
+                writers[split].add(image_info, annotations)
+
+    for writer in writers.values():
+        writer.close()
+
+    found = {split: writers[split].ids for split in SPLITS}
+    listed = {split: sum(s == split for s in split_of.values()) for split in SPLITS}
+    for split in SPLITS:
+        missing = ""
+        if split != "train":
+            missing = f", {listed[split] - found[split]} listed IDs not found"
+        print(
+            f"{split}: {found[split]} PDFs, {writers[split].coco.images} images, "
+            f"{writers[split].annotations} annotations{missing}"
+        )
+
+    if args.link is None:
+        return 0
+
+    # link in bulk: a thread per batch of files, since on a network file system
+    # each call is a round trip
+    images_dir = (coco_dir / "images").resolve()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for split in SPLITS:
+            split_dir = output_dir / split
+            split_images = split_dir / "images"
+            split_images.mkdir(exist_ok=True)
+            with (split_dir / "manifest.jsonl").open() as fp:
+                names = [name for line in fp for name in json.loads(line)["files"]]
+
+            # links left over from an earlier split
+            stale = set(os.listdir(split_images)) - set(names)
+            stale.discard("_annotations.coco.json")
+            for name in stale:
+                (split_images / name).unlink()
+
+            batches = [names[i : i + 256] for i in range(0, len(names), 256)]
+            created = sum(
+                executor.map(
+                    link_files,
+                    batches,
+                    [images_dir] * len(batches),
+                    [split_images] * len(batches),
+                    [args.link] * len(batches),
+                )
+            )
+
+            symlink_path = split_images / "_annotations.coco.json"
+            if symlink_path.exists() or symlink_path.is_symlink():
+                symlink_path.unlink()
+            os.symlink(
+                os.path.relpath(split_dir / "annotations.json", split_images),
+                symlink_path,
+            )
+            print(f"{split}: linked {created} new images into {split_images}")
 
     return 0
 
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     main()
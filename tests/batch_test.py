@@ -0,0 +1,189 @@
+import json
+import multiprocessing
+import shutil
+import time
+
+import formalpdf
+import pytest
+
+import commonforms.inference
+from commonforms.batch import DirectoryQueue, SqliteQueue, run_worker
+
+from detections_test import INPUT, TwoBoxDetector
+
+
+@pytest.fixture(params=["sqlite", "directory"])
+def make_queue(request, tmp_path):
+    def make_queue(**kwargs):
+        if request.param == "sqlite":
+            return SqliteQueue(tmp_path / "queue.db", **kwargs)
+        return DirectoryQueue(tmp_path / "queue", **kwargs)
+
+    return make_queue
+
+
+@pytest.fixture
+def stub_detector(monkeypatch):
+    loads = multiprocessing.get_context("fork").Value("i", 0)
+
+    def load_detector(*args, **kwargs):
+        with loads.get_lock():
+            loads.value += 1
+        return TwoBoxDetector()
+
+    monkeypatch.setattr(commonforms.inference, "load_detector", load_detector)
+    return loads
+
+
+def test_workers_share_a_queue(make_queue, stub_detector, tmp_path):
+    inputs = []
+    for ix in range(6):
+        inputs.append(tmp_path / f"form{ix}.pdf")
+        shutil.copy(INPUT, inputs[-1])
+    queue = make_queue()
+    jobs = [(path, tmp_path / "out" / path.name) for path in inputs]
+    assert queue.add(jobs) == 6
+    assert queue.add(jobs[:2]) == 0
+
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=run_worker, args=(queue, f"worker{ix}"))
+        for ix in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 6, "failed": 0}
+    # one model per worker at most, not one per document
+    assert stub_detector.value <= 3
+    for path in inputs:
+        doc = formalpdf.open(tmp_path / "out" / path.name)
+        assert len(doc[0].widgets()) == 2
+        doc.document.close()
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == sorted(
+        p.name for p in inputs
+    )
+
+
+def test_failures_are_retried_then_recorded(make_queue, stub_detector, tmp_path):
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    queue = make_queue(max_attempts=2)
+    queue.add([(broken, tmp_path / "out.pdf")])
+
+    assert run_worker(queue, "worker") == 2
+
+    assert queue.counts()["failed"] == 1
+    (failure,) = queue.failures()
+    assert failure.attempts == 2
+    assert len(failure.errors) == 2
+    assert not (tmp_path / "out.pdf").exists()
+    assert list(tmp_path.glob(".out.pdf*")) == []
+
+
+def test_workers_reject_previous_detections(make_queue, tmp_path):
+    with pytest.raises(ValueError):
+        run_worker(make_queue(), "worker", previous=tmp_path / "v1.json")
+
+
+def test_expired_leases_are_reclaimed(make_queue, tmp_path):
+    queue = make_queue(lease_seconds=-1, max_attempts=2)
+    queue.add([(INPUT, tmp_path / "out.pdf")])
+
+    first = queue.claim("dead")
+    second = queue.claim("alive")
+    assert second.input == first.input
+    assert second.attempts == 2
+    # out of attempts: the next expiry fails it instead
+    assert queue.claim("another") is None
+    (failure,) = queue.failures()
+    assert failure.errors == ["lease expired on alive"]
+
+
+def test_jobs_taken_by_dead_workers_are_recovered(tmp_path):
+    queue = DirectoryQueue(tmp_path / "queue", lease_seconds=-1)
+    queue.add([(INPUT, tmp_path / "out.pdf")])
+
+    # a worker that died between taking the job and leasing it
+    (pending,) = (tmp_path / "queue" / "pending").iterdir()
+    assert queue.take(pending, "dead.example.com-1") is not None
+    assert queue.counts()["leased"] == 1
+
+    job = queue.claim("alive")
+    assert job.input == INPUT
+    assert job.attempts == 1
+    assert queue.counts() == {"pending": 0, "leased": 1, "done": 0, "failed": 0}
+
+
+def test_claims_that_outlive_their_lease_are_given_up(tmp_path):
+    queue = DirectoryQueue(tmp_path / "queue", lease_seconds=-1)
+    queue.add([(INPUT, tmp_path / "out.pdf")])
+
+    write = queue.write
+
+    def slow_write(path, job):
+        write(path, job)
+        if path.parent.name == "leased":
+            # another worker recovers the job before the claim finishes
+            queue.recover(time.time())
+
+    queue.write = slow_write
+    assert queue.claim("slow") is None
+    queue.write = write
+
+    assert queue.counts() == {"pending": 1, "leased": 0, "done": 0, "failed": 0}
+    assert queue.claim("other").attempts == 1
+
+
+def test_expired_workers_leave_the_new_lease_alone(tmp_path):
+    queue = DirectoryQueue(tmp_path / "queue", lease_seconds=-1)
+    queue.add([(INPUT, tmp_path / "out.pdf")])
+
+    expired = queue.claim("expired")
+    current = queue.claim("current")
+    queue.fail(expired, "too late")
+    queue.complete(expired)
+
+    assert queue.holds_lease(current)
+    assert queue.counts()["pending"] == 0
+
+
+def test_existing_outputs_are_skipped(make_queue, stub_detector, tmp_path):
+    output = tmp_path / "out.pdf"
+    output.write_bytes(b"done already")
+    queue = make_queue()
+    queue.add([(INPUT, output)])
+
+    assert run_worker(queue, "worker") == 1
+    assert queue.counts()["done"] == 1
+    assert output.read_bytes() == b"done already"
+    assert stub_detector.value == 0
+
+
+def test_checkpoints_record_the_worker_settings(
+    make_queue, stub_detector, monkeypatch, tmp_path
+):
+    def write_widgets(*args, **kwargs):
+        raise RuntimeError("killed while writing")
+
+    # fail after detection, so the checkpoint is left behind
+    monkeypatch.setattr(commonforms.inference, "write_widgets", write_widgets)
+    queue = make_queue(max_attempts=1)
+    queue.add([(INPUT, tmp_path / "out.pdf")])
+
+    run_worker(
+        queue,
+        "worker",
+        model_or_path="FFDNet-S",
+        fast=True,
+        cascade_to="FFDNet-L",
+        checkpoint=tmp_path / "checkpoints",
+    )
+
+    (path,) = (tmp_path / "checkpoints").iterdir()
+    config = json.loads(path.read_text().splitlines()[0])["config"]
+    assert config["model"] == "FFDNet-S"
+    assert config["fast"] is True
+    assert config["cascade_to"] == "FFDNet-L"
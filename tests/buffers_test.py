@@ -0,0 +1,42 @@
+import numpy as np
+import pypdfium2
+
+from commonforms.buffers import BufferPool
+from commonforms.inference import render_page
+
+
+def test_pool_reuses_released_arrays():
+    pool = BufferPool()
+    with pool.borrow((4, 4), np.float32) as first:
+        pass
+    with pool.borrow((4, 4), np.float32) as second:
+        assert second is first
+    with pool.borrow((4, 4), np.uint8) as other:
+        assert other is not first
+
+    assert pool.allocations == 2
+    assert pool.reuses == 1
+
+
+def test_pool_drops_arrays_over_max_bytes():
+    pool = BufferPool(max_bytes=100)
+    pool.release(np.empty(64, np.uint8))
+    pool.release(np.empty(64, np.uint8))
+
+    assert pool.free_bytes == 64
+
+
+def test_pooled_render_matches_unpooled():
+    doc = pypdfium2.PdfDocument("./tests/resources/input.pdf")
+    pool = BufferPool()
+    num_pages = len(doc)
+    try:
+        for page in doc:
+            expected = render_page(page)
+            pooled = render_page(page, pool=pool)
+            assert pooled.mode == expected.mode
+            assert pooled.tobytes() == expected.tobytes()
+    finally:
+        doc.close()
+
+    assert pool.reuses == num_pages - 1
@@ -0,0 +1,58 @@
+from commonforms.checkpoint import Checkpoint
+from commonforms.utils import BoundingBox, Widget
+
+
+def widget(page_ix: int) -> Widget:
+    return Widget(
+        widget_type="TextBox",
+        bounding_box=BoundingBox(x0=0.1, y0=0.2, x1=0.3, y1=0.25),
+        page=page_ix,
+        confidence=0.9,
+    )
+
+
+def test_partial_batch_is_dropped(tmp_path):
+    checkpoint = Checkpoint(tmp_path, "abc", {"image_size": 1024})
+    assert checkpoint.load() == {}
+    checkpoint.save({0: [widget(0)], 1: []})
+    checkpoint.close()
+    with open(checkpoint.path, "a") as fp:
+        fp.write('{"pages":{"2":[["TextBox",0.1')
+
+    resumed = Checkpoint(tmp_path, "abc", {"image_size": 1024})
+    results = resumed.load()
+    assert sorted(results) == [0, 1]
+    assert results[0][0].bounding_box.y1 == 0.25
+
+    resumed.save({2: [widget(2)]})
+    resumed.close()
+    assert sorted(Checkpoint(tmp_path, "abc", {"image_size": 1024}).load()) == [0, 1, 2]
+
+
+def test_damaged_batch_ends_the_valid_data(tmp_path):
+    checkpoint = Checkpoint(tmp_path, "abc", {"image_size": 1024})
+    checkpoint.load()
+    for page_ix in range(3):
+        checkpoint.save({page_ix: [widget(page_ix)]})
+    checkpoint.close()
+    lines = checkpoint.path.read_bytes().split(b"\n")
+    # the second batch is garbled, say by a disk error
+    lines[2] = b'{"pages":{"1":[["TextBox",0.1,\x00\x00'
+    checkpoint.path.write_bytes(b"\n".join(lines))
+
+    resumed = Checkpoint(tmp_path, "abc", {"image_size": 1024})
+    assert sorted(resumed.load()) == [0]
+    resumed.save({1: [widget(1)]})
+    resumed.close()
+
+    assert sorted(Checkpoint(tmp_path, "abc", {"image_size": 1024}).load()) == [0, 1]
+
+
+def test_different_settings_start_over(tmp_path):
+    checkpoint = Checkpoint(tmp_path, "abc", {"image_size": 1024})
+    checkpoint.load()
+    checkpoint.save({0: [widget(0)]})
+    checkpoint.close()
+
+    assert Checkpoint(tmp_path, "abc", {"image_size": 640}).load() == {}
+    assert Checkpoint(tmp_path, "abc", {"image_size": 640}).load() == {}
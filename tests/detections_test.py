@@ -0,0 +1,173 @@
+import formalpdf
+import numpy as np
+import pypdf
+import pytest
+
+import commonforms.inference
+from commonforms import FormDetections, apply_detections, detect_form
+from commonforms.exceptions import DetectionsMismatchError, DetectionsVersionError
+from commonforms.inference import Detector
+from commonforms.utils import Detections
+
+INPUT = "./tests/resources/input.pdf"
+
+
+class TwoBoxDetector(Detector):
+    def predict(self, images, confidence, image_size, augment=None):
+        return [
+            Detections(
+                xyxyn=np.array([[0.1, 0.1, 0.4, 0.12], [0.5, 0.5, 0.52, 0.52]]),
+                class_id=np.array([0, 1]),
+                confidence=np.array([0.91234567, 0.8]),
+            )
+            for _ in images
+        ]
+
+
+@pytest.fixture
+def detections(monkeypatch):
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: TwoBoxDetector()
+    )
+    return detect_form(INPUT, model_or_path="stub", image_size=640, fingerprint=True)
+
+
+def test_detect_form_records_provenance(detections):
+    assert detections.num_pages == 2
+    assert detections.model == "stub"
+    assert detections.config["image_size"] == 640
+    assert [len(w) for w in detections.widgets.values()] == [2, 2]
+    assert detections.widgets[1][0].page == 1
+
+
+@pytest.mark.parametrize("name", ["detections.json", "detections.json.gz"])
+def test_dump_load_roundtrip(detections, tmp_path, name):
+    detections.dump(tmp_path / name)
+    loaded = FormDetections.load(tmp_path / name)
+
+    assert loaded.sha256 == detections.sha256
+    assert loaded.config == detections.config
+    widget = loaded.widgets[0][0]
+    assert widget.widget_type == detections.widgets[0][0].widget_type
+    assert widget.bounding_box.x0 == pytest.approx(0.1)
+    assert widget.confidence == pytest.approx(0.9123)
+
+
+def test_load_rejects_other_versions(detections, tmp_path):
+    detections.version = 99
+    detections.dump(tmp_path / "detections.json")
+
+    with pytest.raises(DetectionsVersionError):
+        FormDetections.load(tmp_path / "detections.json")
+
+
+def test_apply_detections_without_a_model(detections, tmp_path):
+    detections.dump(tmp_path / "detections.json")
+    output_path = tmp_path / "output.pdf"
+
+    apply_detections(tmp_path / "detections.json", INPUT, output_path, multiline=True)
+
+    doc = formalpdf.open(output_path)
+    assert len(doc[0].widgets()) == 2
+    doc.document.close()
+
+
+def test_apply_detections_checks_the_source(detections, tmp_path):
+    other = tmp_path / "other.pdf"
+    other.write_bytes(open(INPUT, "rb").read() + b"\n")
+
+    with pytest.raises(DetectionsMismatchError):
+        apply_detections(detections, other, tmp_path / "output.pdf")
+    apply_detections(detections, other, tmp_path / "output.pdf", check_source=False)
+
+
+def test_pages_are_only_fingerprinted_on_request(monkeypatch):
+    def page_fingerprints(*args, **kwargs):
+        raise AssertionError("nothing asked for fingerprints")
+
+    monkeypatch.setattr(commonforms.inference, "page_fingerprints", page_fingerprints)
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: TwoBoxDetector()
+    )
+    detections = detect_form(INPUT, model_or_path="stub")
+
+    assert detections.num_pages == 2
+    assert detections.fingerprints == []
+
+
+def test_previous_detections_skip_unchanged_pages(detections, tmp_path, monkeypatch):
+    # the second revision moves page 1 to the front and appends a blank page
+    reader = pypdf.PdfReader(INPUT)
+    writer = pypdf.PdfWriter()
+    writer.add_page(reader.pages[1])
+    writer.add_blank_page(width=612, height=792)
+    revised = tmp_path / "revised.pdf"
+    writer.write(revised)
+
+    detector = TwoBoxDetector()
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: detector
+    )
+    predict = detector.predict
+    seen = []
+    detector.predict = lambda images, *args, **kwargs: (
+        seen.extend(images) or predict(images, *args, **kwargs)
+    )
+
+    revision = detect_form(
+        revised, model_or_path="stub", image_size=640, previous=detections
+    )
+
+    assert len(seen) == 1
+    assert revision.fingerprints[0] == detections.fingerprints[1]
+    assert [w.page for w in revision.widgets[0]] == [0, 0]
+    assert revision.widgets[0][0].confidence == detections.widgets[1][0].confidence
+    assert len(revision.widgets[1]) == 2
+
+
+def test_previous_output_pdf_is_read_back(detections, tmp_path, monkeypatch):
+    output_path = tmp_path / "output.pdf"
+    apply_detections(detections, INPUT, output_path)
+
+    def unused(*args, **kwargs):
+        raise AssertionError("every page should have been reused")
+
+    monkeypatch.setattr(commonforms.inference, "load_detector", unused)
+    revision = detect_form(INPUT, previous=output_path)
+
+    assert revision.fingerprints == detections.fingerprints
+    for page_ix, widgets in detections.widgets.items():
+        read = revision.widgets[page_ix]
+        assert [w.widget_type for w in read] == [w.widget_type for w in widgets]
+        assert read[0].bounding_box.x0 == pytest.approx(widgets[0].bounding_box.x0)
+        assert read[0].bounding_box.y1 == pytest.approx(widgets[0].bounding_box.y1)
+
+
+def test_checkpoint_resumes_an_interrupted_run(tmp_path, monkeypatch):
+    detector = TwoBoxDetector()
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: detector
+    )
+    predict = detector.predict
+    seen = []
+
+    def preempted(images, *args, **kwargs):
+        if seen:
+            raise KeyboardInterrupt
+        seen.extend(images)
+        return predict(images, *args, **kwargs)
+
+    detector.predict = preempted
+    with pytest.raises(KeyboardInterrupt):
+        detect_form(INPUT, image_size=640, batch_size=1, checkpoint=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    seen.clear()
+    detector.predict = lambda images, *args, **kwargs: (
+        seen.extend(images) or predict(images, *args, **kwargs)
+    )
+    resumed = detect_form(INPUT, image_size=640, batch_size=1, checkpoint=tmp_path)
+
+    assert len(seen) == 1
+    assert [len(w) for w in resumed.widgets.values()] == [2, 2]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,217 @@
+import numpy as np
+from PIL import Image
+
+import commonforms.inference
+from commonforms import FormDetections, detect_form
+from commonforms.escalation import CascadePolicy, DeadlinePolicy, EscalationPolicy
+from commonforms.inference import CascadeDetector, Deadline, Detector, VectorDetector
+from commonforms.utils import Detections, Page
+
+from detections_test import INPUT
+
+
+def detections(confidences, size=0.1):
+    n = len(confidences)
+    return Detections(
+        xyxyn=np.tile([0.1, 0.1, 0.1 + size, 0.1 + size], (n, 1)),
+        class_id=np.zeros(n, dtype=np.int64),
+        confidence=np.array(confidences),
+    )
+
+
+def test_policy_escalates_on_low_confidence():
+    policy = EscalationPolicy(low_confidence=0.5, max_low_confidence_fraction=0.25)
+
+    escalate, _ = policy.should_escalate(
+        detections([0.9, 0.9, 0.35, 0.4]), 1000, 1000, 640
+    )
+    assert escalate
+
+    escalate, _ = policy.should_escalate(detections([0.9, 0.9, 0.9]), 1000, 1000, 640)
+    assert not escalate
+
+
+def test_policy_escalates_on_tiny_boxes():
+    policy = EscalationPolicy(tiny_box_pixels=10)
+    # 1% of a 1000px page seen at 640px is ~6px
+    tiny = detections([0.9, 0.9, 0.9], size=0.01)
+
+    assert policy.should_escalate(tiny, 1000, 1000, 640)[0]
+    assert not policy.should_escalate(tiny, 1000, 1000, 2048)[0]
+
+
+class ResolutionDetector(Detector):
+    """Confident only when it's given at least 1024px and test-time augmentation."""
+
+    def __init__(self):
+        self.calls = []
+
+    def supports_augment(self):
+        return True
+
+    def predict(self, images, confidence, image_size, augment=None):
+        self.calls.append((len(images), image_size, augment))
+        score = 0.9 if image_size >= 1024 and augment is not False else 0.35
+        return [detections([score] * 4) for _ in images]
+
+
+def test_detect_adaptive_only_reruns_hard_pages():
+    pages = [
+        Page(
+            image=Image.new("RGB", (100, 100)), width=100, height=100, text_fragments=[]
+        ),
+        Page(
+            image=Image.new("RGB", (100, 100)), width=100, height=100, text_fragments=[]
+        ),
+    ]
+    detector = ResolutionDetector()
+
+    # only the first page looks hard at the coarse resolution
+    original = detector.predict
+
+    def predict(images, confidence, image_size, augment=None):
+        results = original(images, confidence, image_size, augment)
+        if image_size < 1024:
+            results[1:] = [detections([0.9] * 4) for _ in results[1:]]
+        return results
+
+    detector.predict = predict
+    results = detector.detect_adaptive(
+        pages,
+        confidence=0.3,
+        image_size=1024,
+        batch_size=2,
+        policy=EscalationPolicy(coarse_image_size=512),
+    )
+
+    assert detector.calls == [(2, 512, False), (1, 1024, None)]
+    assert all(len(d) == 4 and d.confidence.min() == 0.9 for d in results)
+
+
+class FixedDetector(Detector):
+    def __init__(self, scores):
+        self.scores = scores
+        self.seen = 0
+
+    def predict(self, images, confidence, image_size, augment=None):
+        self.seen += len(images)
+        return [detections(self.scores) for _ in images]
+
+
+def test_cascade_only_escalates_uncertain_pages():
+    pages = [
+        Page(
+            image=Image.new("RGB", (100, 100)), width=100, height=100, text_fragments=[]
+        ),
+        Page(
+            image=Image.new("RGB", (101, 100)), width=101, height=100, text_fragments=[]
+        ),
+    ]
+    small = FixedDetector([0.9, 0.9, 0.9])
+    large = FixedDetector([0.95])
+
+    # make the small model unsure about the second (wider) page only
+    original = small.predict
+
+    def predict(images, confidence, image_size, augment=None):
+        return [
+            detections([0.35, 0.4, 0.9]) if image.width == 101 else result
+            for image, result in zip(images, original(images, confidence, image_size))
+        ]
+
+    small.predict = predict
+    cascade = CascadeDetector(small, large, CascadePolicy(uncertainty_threshold=0.5))
+
+    widgets = cascade.extract_widgets(pages, confidence=0.3, batch_size=2)
+
+    assert len(widgets[0]) == 3
+    assert len(widgets[1]) == 1
+    assert large.seen == 1
+    assert (cascade.pages_escalated, cascade.pages_seen) == (1, 2)
+
+
+def test_deadline_policy_projects_the_remaining_pages():
+    policy = DeadlinePolicy(margin=0.9)
+
+    # 2s spent and 1s/page: 6 more pages fit in 90% of 10s, 8 don't
+    assert not policy.over_budget(2.0, 1.0, 6, 10)[0]
+    assert policy.over_budget(2.0, 1.0, 8, 10)[0]
+
+
+def test_deadline_steps_down_a_level_at_a_time():
+    fast = FixedDetector([0.9])
+    deadline = Deadline(10, load_fast=lambda: fast)
+    settings = (ResolutionDetector(), 1024, True, False, None)
+
+    settings = deadline.degrade(*settings)
+    assert deadline.level == "no-tta"
+    assert settings[1:] == (1024, False, False, False)
+
+    settings = deadline.degrade(*settings)
+    assert deadline.level == "fast"
+    assert settings[0] is fast
+
+    settings = deadline.degrade(*settings)
+    assert deadline.level == "low-res"
+    assert settings[1] == 640
+
+    settings = deadline.degrade(*settings)
+    assert deadline.level == "vector"
+    assert isinstance(settings[0], VectorDetector)
+
+    # nothing cheaper left
+    assert deadline.degrade(*settings) == settings
+
+
+def test_deadline_reuses_the_fast_model_across_documents():
+    loads = []
+
+    def load_fast():
+        loads.append(FixedDetector([0.9]))
+        return loads[-1]
+
+    detector = ResolutionDetector()
+    for _ in range(2):
+        deadline = Deadline(
+            10, policy=DeadlinePolicy(levels=("fast",)), load_fast=load_fast
+        )
+        assert deadline.degrade(detector, 1024, False, False, None)[0] is loads[0]
+    assert len(loads) == 1
+
+
+def test_deadline_skips_fast_for_onnx_models():
+    class OnnxDetector(ResolutionDetector):
+        def runs_onnx(self):
+            return True
+
+    deadline = Deadline(
+        10,
+        policy=DeadlinePolicy(levels=("fast", "low-res")),
+        load_fast=lambda: FixedDetector([0.9]),
+    )
+    detector, image_size, *_ = deadline.degrade(
+        OnnxDetector(), 1024, False, False, None
+    )
+
+    assert deadline.level == "low-res"
+    assert isinstance(detector, OnnxDetector) and image_size == 640
+
+
+def test_time_budget_degrades_the_remaining_pages(monkeypatch, tmp_path):
+    detector = ResolutionDetector()
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: detector
+    )
+
+    # no time at all: every page after the first batch runs degraded
+    detections = detect_form(
+        INPUT, model_or_path="stub", image_size=1024, batch_size=1, time_budget=0
+    )
+
+    # the stub has no ONNX variant, so the only step taken is dropping TTA
+    assert detections.degraded == {1: "no-tta"}
+    assert detector.calls == [(1, 1024, None), (1, 1024, False)]
+    assert detections.config["time_budget"] == 0
+
+    detections.dump(tmp_path / "detections.json")
+    assert FormDetections.load(tmp_path / "detections.json").degraded == {1: "no-tta"}
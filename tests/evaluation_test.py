@@ -0,0 +1,101 @@
+from PIL import Image
+
+from commonforms.evaluation import (
+    EvalConfig,
+    evaluate,
+    evaluate_configs,
+    load_coco_pages,
+    pareto_front,
+)
+from commonforms.inference import Detector
+from commonforms.utils import Detections
+
+import commonforms.evaluation
+import json
+import numpy as np
+
+CLASSES = {0: "TextBox", 1: "ChoiceButton", 2: "Signature"}
+
+
+def make(boxes, classes, scores=None):
+    return Detections(
+        xyxyn=np.array(boxes, dtype=np.float64).reshape(-1, 4),
+        class_id=np.array(classes, dtype=np.int64),
+        confidence=np.array(scores if scores is not None else [1.0] * len(classes)),
+    )
+
+
+def test_evaluate_perfect_predictions():
+    gt = [make([[0.1, 0.1, 0.3, 0.2], [0.5, 0.5, 0.52, 0.52]], [0, 1])]
+
+    metrics = evaluate(gt, gt, CLASSES, iou_thresholds=(0.5, 0.75))
+
+    assert metrics["TextBox"]["ap"] == 1.0
+    assert metrics["ChoiceButton"]["recall"] == 1.0
+    assert np.isnan(metrics["Signature"]["ap"])
+    assert metrics["all"]["ap"] == 1.0
+
+
+def test_evaluate_penalizes_misses_and_wrong_classes():
+    gt = [make([[0.1, 0.1, 0.3, 0.2], [0.5, 0.5, 0.52, 0.52]], [0, 0])]
+    # second box is found, but labeled as a checkbox
+    pred = [make([[0.1, 0.1, 0.3, 0.2], [0.5, 0.5, 0.52, 0.52]], [0, 1], [0.9, 0.8])]
+
+    metrics = evaluate(pred, gt, CLASSES)
+
+    assert metrics["TextBox"]["recall"] == 0.5
+    assert np.isnan(metrics["ChoiceButton"]["ap"])
+
+
+class TwoBoxDetector(Detector):
+    def predict(self, images, confidence, image_size, augment=None):
+        return [
+            make([[0.1, 0.1, 0.4, 0.12], [0.5, 0.5, 0.52, 0.52]], [0, 1], [0.9, 0.8])
+            for _ in images
+        ]
+
+
+def test_evaluate_configs_over_coco_split(tmp_path, monkeypatch):
+    (tmp_path / "images").mkdir()
+    Image.new("RGB", (100, 200), "white").save(tmp_path / "images" / "7-0.jpg")
+    coco = {
+        "images": [{"id": 0, "file_name": "7-0.jpg", "width": 100, "height": 200}],
+        "annotations": [
+            {"id": 0, "image_id": 0, "category_id": 0, "bbox": [10, 20, 30, 4]},
+            {"id": 1, "image_id": 0, "category_id": 1, "bbox": [50, 100, 2, 4]},
+        ],
+    }
+    (tmp_path / "annotations.json").write_text(json.dumps(coco))
+    monkeypatch.setattr(
+        commonforms.evaluation,
+        "load_detector",
+        lambda *args, **kwargs: TwoBoxDetector(),
+    )
+
+    pages = load_coco_pages(tmp_path / "annotations.json")
+    assert pages[0][0] == tmp_path / "images" / "7-0.jpg"
+    assert np.allclose(pages[0][1].xyxyn[0], [0.1, 0.1, 0.4, 0.12])
+    assert load_coco_pages(tmp_path / "annotations.json", split_ids={"8"}) == []
+
+    results = evaluate_configs(
+        [EvalConfig.parse("stub:fast@640")],
+        pages,
+        confidences=(0.85, 0.5),
+        isolate=False,
+    )
+
+    assert [r["confidence"] for r in results] == [0.5, 0.85]
+    assert results[0]["config"] == "stub:fast@640"
+    assert results[0]["metrics"]["all"]["ap"] == 1.0
+    # the checkbox is dropped at the higher threshold
+    assert results[1]["metrics"]["ChoiceButton"]["recall"] == 0.0
+    assert [r["pareto"] for r in results] == [True, False]
+
+
+def test_pareto_front():
+    def result(pages_per_second, ap):
+        return {"pages_per_second": pages_per_second, "metrics": {"all": {"ap": ap}}}
+
+    results = [result(10, 0.5), result(5, 0.8), result(5, 0.6), result(1, float("nan"))]
+
+    assert pareto_front(results) == [True, True, False, False]
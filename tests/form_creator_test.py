@@ -0,0 +1,94 @@
+import formalpdf
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, NameObject
+
+from commonforms.form_creator import PyPdfFormCreator, rects_for
+from commonforms.utils import BoundingBox, Widget
+
+
+def make_widgets(page: int) -> list[Widget]:
+    return [
+        Widget(
+            widget_type="TextBox",
+            bounding_box=BoundingBox(x0=0.1, y0=0.1, x1=0.4, y1=0.15),
+            page=page,
+        ),
+        Widget(
+            widget_type="ChoiceButton",
+            bounding_box=BoundingBox(x0=0.5, y0=0.1, x1=0.52, y1=0.12),
+            page=page,
+        ),
+        Widget(
+            widget_type="ChoiceButton",
+            bounding_box=BoundingBox(x0=0.6, y0=0.1, x1=0.62, y1=0.12),
+            page=page,
+        ),
+        Widget(
+            widget_type="Signature",
+            bounding_box=BoundingBox(x0=0.1, y0=0.8, x1=0.4, y1=0.85),
+            page=page,
+        ),
+    ]
+
+
+def test_rects_for_flips_to_pdf_space():
+    reader = PdfReader("./tests/resources/input.pdf")
+    page = reader.pages[0]
+    width, height = float(page.mediabox.width), float(page.mediabox.height)
+
+    rects = rects_for([BoundingBox(x0=0.1, y0=0.1, x1=0.4, y1=0.15)], page)
+
+    assert rects.shape == (1, 4)
+    assert rects[0].tolist() == [
+        0.1 * width,
+        height - 0.15 * height,
+        0.4 * width,
+        height - 0.1 * height,
+    ]
+
+
+def test_add_widgets_registers_fields_and_shares_appearances(tmp_path):
+    output_path = tmp_path / "output.pdf"
+
+    writer = PyPdfFormCreator("./tests/resources/input.pdf")
+    writer.clear_existing_fields()
+    for page_ix in range(2):
+        writer.add_widgets(page_ix, make_widgets(page_ix), use_signature_fields=True)
+    writer.save(output_path)
+    writer.close()
+
+    reader = PdfReader(output_path)
+    acroform = reader.trailer["/Root"]["/AcroForm"]
+    fields = [f.get_object() for f in acroform["/Fields"]]
+    assert len(fields) == 8
+    assert {"/Helv", "/ZaDb"} <= set(acroform["/DR"]["/Font"].keys())
+
+    checkboxes = [f for f in fields if f["/FT"] == "/Btn"]
+    on_streams = {f.raw_get("/AP")["/N"].raw_get("/Yes").idnum for f in checkboxes}
+    assert len(on_streams) == 1
+
+    doc = formalpdf.open(output_path)
+    assert len(doc[0].widgets()) == 4
+    assert len(doc[1].widgets()) == 4
+    doc.document.close()
+
+
+def test_kept_fields_missing_from_the_acroform_are_reattached(tmp_path):
+    # a form whose field is on the page but was dropped from /Fields
+    writer = PyPdfFormCreator("./tests/resources/input.pdf")
+    writer.add_text_box("orphan", 0, BoundingBox(x0=0.1, y0=0.5, x1=0.4, y1=0.55))
+    writer.save(tmp_path / "field.pdf")
+    writer.close()
+    orphaned = PdfWriter(clone_from=tmp_path / "field.pdf")
+    orphaned._root_object["/AcroForm"][NameObject("/Fields")] = ArrayObject()
+    orphaned.write(tmp_path / "orphaned.pdf")
+    assert "orphan" not in (PdfReader(tmp_path / "orphaned.pdf").get_fields() or {})
+
+    writer = PyPdfFormCreator(tmp_path / "orphaned.pdf")
+    writer.add_widgets(0, make_widgets(0))
+    writer.save(tmp_path / "output.pdf")
+    writer.close()
+
+    fields = PdfReader(tmp_path / "output.pdf").get_fields()
+    assert "orphan" in fields
+    assert "textbox_0_0" in fields
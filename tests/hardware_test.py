@@ -0,0 +1,123 @@
+import json
+
+import pytest
+
+import commonforms.autotune
+import commonforms.inference
+from commonforms import detect_form
+from commonforms.autotune import thread_counts, tune
+from commonforms.evaluation import EvalConfig
+from commonforms.hardware import HardwareProfile, Setting, machine_id, profile_path
+
+from detections_test import INPUT, TwoBoxDetector
+
+
+class RecordingDetector(TwoBoxDetector):
+    def __init__(self):
+        self.threads = None
+        self.batches = []
+
+    def set_threads(self, intra_op_threads, inter_op_threads=1):
+        self.threads = (intra_op_threads, inter_op_threads)
+
+    def predict(self, images, confidence, image_size, augment=None):
+        self.batches.append(len(images))
+        return super().predict(images, confidence, image_size, augment)
+
+
+@pytest.fixture
+def profile(tmp_path, monkeypatch):
+    monkeypatch.setenv("COMMONFORMS_CACHE", str(tmp_path))
+    profile = HardwareProfile(machine_id(), 8)
+    profile.add(
+        "STUB",
+        [
+            Setting(batch_size=1, intra_op_threads=1, pages_per_second=1.0),
+            Setting(batch_size=2, intra_op_threads=2, pages_per_second=1.8),
+            Setting(batch_size=8, intra_op_threads=8, pages_per_second=5.0),
+            Setting(
+                batch_size=4,
+                intra_op_threads=8,
+                inter_op_threads=2,
+                pages_per_second=4.0,
+            ),
+        ],
+    )
+    profile.dump()
+    return profile
+
+
+@pytest.fixture
+def stub_detector(monkeypatch):
+    detector = RecordingDetector()
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: detector
+    )
+    return detector
+
+
+def test_best_setting_within_core_cap(profile):
+    loaded = HardwareProfile.load()
+
+    assert loaded == profile
+    assert loaded.best("STUB").batch_size == 8
+    assert loaded.best("STUB", max_cores=4).intra_op_threads == 2
+    assert loaded.best("OTHER") is None
+
+
+def test_profile_from_another_machine_is_ignored(profile):
+    data = json.loads(profile_path().read_text())
+    data["machine"] = "some other machine x128"
+    profile_path().write_text(json.dumps(data))
+
+    assert HardwareProfile.load() is None
+
+
+def test_detectors_apply_the_profile(profile, stub_detector):
+    detect_form(INPUT, model_or_path="stub", max_cores=2)
+
+    assert stub_detector.threads == (2, 1)
+    # both pages go in one batch of the profile's batch size
+    assert stub_detector.batches == [2]
+
+
+def test_cores_cap_threads_without_a_profile(tmp_path, monkeypatch, stub_detector):
+    monkeypatch.setenv("COMMONFORMS_CACHE", str(tmp_path))
+    detect_form(INPUT, model_or_path="stub", max_cores=3, batch_size=1)
+
+    assert stub_detector.threads == (3, 1)
+    assert stub_detector.batches == [1, 1]
+
+
+def test_thread_counts():
+    assert thread_counts(1) == [1]
+    assert thread_counts(6) == [1, 2, 4, 6]
+    assert thread_counts(8) == [1, 2, 4, 8]
+
+
+def test_tune_measures_every_setting(monkeypatch):
+    detector = RecordingDetector()
+    monkeypatch.setattr(
+        commonforms.autotune, "load_detector", lambda *args, **kwargs: detector
+    )
+    # don't resize the test process's own torch thread pools
+    monkeypatch.setattr(commonforms.autotune, "set_torch_threads", lambda *args: None)
+
+    settings = tune(
+        EvalConfig("stub"),
+        [INPUT],
+        max_cores=2,
+        batch_sizes=(1, 2),
+        num_pages=4,
+        isolate=False,
+    )
+
+    assert [(s.intra_op_threads, s.inter_op_threads) for s in settings] == [
+        (1, 1),
+        (1, 1),
+        (2, 1),
+        (2, 1),
+        (2, 2),
+    ]
+    assert all(s.pages_per_second > 0 for s in settings)
+    assert detector.threads == (2, 2)
@@ -1,18 +1,34 @@
 import commonforms
 import commonforms.exceptions
+import commonforms.inference
 
 import formalpdf
+import pypdf
 import pytest
 from PIL import Image
 
-from commonforms.inference import promote_signature_widgets
-from commonforms.utils import BoundingBox, Page, TextFragment, Widget
+from commonforms.evaluation import box_iou
+from commonforms.inference import (
+    Deadline,
+    Detector,
+    FFDetrDetector,
+    detect_pages,
+    load_detector,
+    predict_takes_shape,
+    promote_signature_widgets,
+    render_pdf,
+)
+from commonforms.instrumentation import NULL_OBSERVER
+from commonforms.memory import MemoryMonitor
+from commonforms.utils import BoundingBox, Detections, Page, TextFragment, Widget
 
 
 def test_inference(tmp_path):
     # tmp_path is a built-in pythest fixture where we'll write the outputs
     output_path = tmp_path / "output.pdf"
-    commonforms.prepare_form("./tests/resources/input.pdf", output_path, model_or_path="FFDetr")
+    commonforms.prepare_form(
+        "./tests/resources/input.pdf", output_path, model_or_path="FFDetr"
+    )
 
     assert output_path.exists()
 
@@ -24,7 +40,9 @@ def test_inference(tmp_path):
 
 def test_inference_fast(tmp_path):
     output_path = tmp_path / "output.pdf"
-    commonforms.prepare_form("./tests/resources/input.pdf", output_path, fast=True, model_or_path="FFDNet-L")
+    commonforms.prepare_form(
+        "./tests/resources/input.pdf", output_path, fast=True, model_or_path="FFDNet-L"
+    )
 
     assert output_path.exists()
 
@@ -56,6 +74,22 @@ def test_encrypted_failure(tmp_path):
         commonforms.prepare_form("./tests/resources/encrypted.pdf", output_path)
 
 
+def test_predict_takes_shape():
+    class Current:
+        def predict(self, images, threshold=0.5, shape=None, **kwargs): ...
+
+    class Old:
+        def predict(self, images, threshold=0.5, **kwargs): ...
+
+    assert predict_takes_shape(Current())
+    assert not predict_takes_shape(Old())
+
+
+def test_int8_is_only_for_ffdnet():
+    with pytest.raises(ValueError):
+        load_detector("FFDetr", int8=True)
+
+
 def test_inference_ffdetr(tmp_path):
     # tmp_path is a built-in pythest fixture where we'll write the outputs
     output_path = tmp_path / "output.pdf"
@@ -71,6 +105,106 @@ def test_inference_ffdetr(tmp_path):
     doc.document.close()
 
 
+def test_ffdetr_onnx_matches_torch():
+    pages = render_pdf("./tests/resources/input.pdf")
+
+    torch_results = FFDetrDetector("FFDetr").detect(pages, confidence=0.4)
+    onnx_results = FFDetrDetector("FFDetr", fast=True).detect(pages, confidence=0.4)
+
+    for expected, actual in zip(torch_results, onnx_results):
+        assert abs(len(expected) - len(actual)) <= max(1, len(expected) // 20)
+        if len(expected) == 0:
+            continue
+
+        iou = box_iou(expected.xyxyn, actual.xyxyn)
+        best = iou.argmax(axis=1)
+        matched = iou.max(axis=1) > 0.9
+        assert matched.mean() >= 0.95
+        assert (expected.class_id[matched] == actual.class_id[best[matched]]).all()
+
+
+class OrientationDetector(Detector):
+    def __init__(self):
+        self.batches = []
+
+    def input_shape(self, width, height, image_size):
+        if height > width:
+            return (image_size, image_size // 2)
+        return (image_size // 2, image_size)
+
+    def predict(self, images, confidence, image_size, augment=None):
+        self.batches.append({self.input_shape(*i.size, image_size) for i in images})
+        return [Detections.empty() for _ in images]
+
+
+def test_detect_batches_by_input_shape():
+    portrait = Page(
+        image=Image.new("RGB", (10, 20)), width=10, height=20, text_fragments=[]
+    )
+    landscape = Page(
+        image=Image.new("RGB", (20, 10)), width=20, height=10, text_fragments=[]
+    )
+    detector = OrientationDetector()
+
+    results = detector.detect(
+        [portrait, landscape, portrait, landscape], image_size=64, batch_size=2
+    )
+
+    assert len(results) == 4
+    assert all(len(shapes) == 1 for shapes in detector.batches)
+
+
+def test_render_pdf_parallel_matches_serial():
+    serial = render_pdf("./tests/resources/input.pdf")
+    parallel = render_pdf("./tests/resources/input.pdf", workers=2)
+
+    assert len(parallel) == len(serial)
+    for a, b in zip(serial, parallel):
+        assert a.image.mode == b.image.mode
+        assert a.image.tobytes() == b.image.tobytes()
+        assert a.text_fragments == b.text_fragments
+
+
+def test_detect_pages_renders_every_chunk_in_one_pool(tmp_path, monkeypatch):
+    writer = pypdf.PdfWriter()
+    for _ in range(3):
+        writer.append("./tests/resources/input.pdf")
+    writer.write(tmp_path / "six.pdf")
+
+    executors = []
+
+    def render_executor(workers):
+        executors.append(make_executor(workers))
+        return executors[-1]
+
+    make_executor = commonforms.inference.render_executor
+    monkeypatch.setattr(commonforms.inference, "render_executor", render_executor)
+
+    class CountingDetector(Detector):
+        def predict(self, images, confidence, image_size, augment=None):
+            return [Detections.empty() for _ in images]
+
+    # a deadline runs the pages a batch, here two pages, at a time
+    results, pages, _ = detect_pages(
+        tmp_path / "six.pdf",
+        CountingDetector(),
+        confidence=0.3,
+        image_size=256,
+        batch_size=2,
+        tiled=False,
+        adaptive=False,
+        escalation_policy=None,
+        memory_budget=None,
+        render_workers=2,
+        observer=NULL_OBSERVER,
+        monitor=MemoryMonitor(enabled=False),
+        deadline=Deadline(3600),
+    )
+
+    assert len(results) == len(pages) == 6
+    assert len(executors) == 1
+
+
 def test_promote_signature_widgets_uses_signature_label_on_test_pdf():
     pages = [
         Page(
@@ -119,7 +253,9 @@ def test_promote_signature_widgets_skips_pages_without_signature_label():
             image=Image.new("RGB", (1, 1)),
             width=1,
             height=1,
-            text_fragments=[TextFragment(text="General contact information", x0=0.1, y0=0.2)],
+            text_fragments=[
+                TextFragment(text="General contact information", x0=0.1, y0=0.2)
+            ],
         )
     ]
     results = {
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+from PIL import Image
+
+from commonforms.inference import Detector, render_pdf
+from commonforms.instrumentation import Observer, PrometheusExporter, TraceObserver
+from commonforms.utils import Detections, Page
+
+
+class RecordingObserver(Observer):
+    def __init__(self):
+        self.stages, self.pages, self.batches = [], [], []
+
+    def on_stage(self, event):
+        self.stages.append(event)
+
+    def on_page(self, event):
+        self.pages.append(event)
+
+    def on_batch(self, event):
+        self.batches.append(event)
+
+
+class TwoBoxDetector(Detector):
+    def predict(self, images, confidence, image_size, augment=None):
+        return [
+            Detections(
+                xyxyn=np.array([[0.1, 0.1, 0.4, 0.2], [0.5, 0.5, 0.55, 0.55]]),
+                class_id=np.array([0, 1]),
+                confidence=np.array([0.9, 0.8]),
+            )
+            for _ in images
+        ]
+
+
+def test_detector_reports_batches_and_detections():
+    pages = [
+        Page(image=Image.new("RGB", (50, 50)), width=50, height=50, text_fragments=[])
+        for _ in range(3)
+    ]
+    observer = RecordingObserver()
+    detector = TwoBoxDetector()
+    detector.observer = observer
+
+    detector.extract_widgets(pages, batch_size=2)
+
+    assert sorted(b.size for b in observer.batches) == [1, 2]
+    detect_events = [e for e in observer.pages if e.stage == "detect"]
+    assert [e.page for e in detect_events] == [0, 1, 2]
+    assert detect_events[0].classes == {"TextBox": 1, "ChoiceButton": 1}
+
+
+def test_render_pdf_reports_pages():
+    observer = RecordingObserver()
+    pages = render_pdf("./tests/resources/input.pdf", observer=observer)
+
+    render_events = [e for e in observer.pages if e.stage == "render"]
+    assert len(render_events) == len(pages)
+    assert all(e.duration >= 0 for e in render_events)
+
+
+def test_prometheus_exposition():
+    exporter = PrometheusExporter()
+    with exporter.stage("render", pages=2):
+        pass
+    with exporter.stage("detect"):
+        pass
+
+    text = exporter.exposition()
+    assert 'commonforms_stage_seconds_count{stage="render"} 1' in text
+    assert 'commonforms_stage_seconds_count{stage="detect"} 1' in text
+    assert "commonforms_pages_sum 2" in text
+
+
+def test_trace_has_spans_for_stages_pages_and_batches(tmp_path):
+    pages = [
+        Page(image=Image.new("RGB", (50, 50)), width=50, height=50, text_fragments=[])
+        for _ in range(3)
+    ]
+    trace = TraceObserver(profile_model=True)
+    detector = TwoBoxDetector()
+    detector.observer = trace
+
+    with trace.stage("detect", pages=3):
+        detector.extract_widgets(pages, batch_size=2)
+    trace.write(tmp_path / "trace.json")
+
+    with open(tmp_path / "trace.json") as fp:
+        events = json.load(fp)["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    by_track = {
+        track: [e for e in spans if e["cat"] == track] for track in trace.tracks
+    }
+
+    assert [e["name"] for e in by_track["stage"]] == ["detect"]
+    assert len(by_track["batch"]) == 2
+    assert len([e for e in events if e["ph"] == "i"]) == 3
+    stage = by_track["stage"][0]
+    for batch in by_track["batch"]:
+        assert stage["ts"] <= batch["ts"]
+        assert batch["ts"] + batch["dur"] <= stage["ts"] + stage["dur"]
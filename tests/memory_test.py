@@ -0,0 +1,139 @@
+import pypdf
+import pytest
+
+import commonforms.inference
+from commonforms import detect_form
+from commonforms.inference import detect_pages, render_pdf
+from commonforms.memory import MemoryBudget, MemoryMonitor, MemoryPlan, parse_size
+from commonforms.instrumentation import NULL_OBSERVER, StageEvent
+
+from detections_test import INPUT
+from hardware_test import RecordingDetector
+
+LETTER = (612, 792)
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 * 2**20
+    assert parse_size("1.5GiB") == int(1.5 * 2**30)
+    assert parse_size("4096") == 4096
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_plan_keeps_everything_in_flight_when_it_fits():
+    budget = MemoryBudget(limit=64 * 2**30)
+    plan = budget.plan([LETTER] * 10, input_pixels=1024 * 800, batch_size=4, baseline=0)
+
+    assert plan == MemoryPlan(scale=2.0, batch_size=4, pages_in_flight=10)
+
+
+def test_plan_backs_off_pages_then_batch_then_scale():
+    budget = MemoryBudget(limit=2**30)
+    pixels = 1024 * 800
+
+    def plan(limit):
+        budget.limit = limit
+        return budget.plan(
+            [LETTER] * 100,
+            input_pixels=pixels,
+            batch_size=4,
+            baseline=0,
+            model_side=1024,
+        )
+
+    roomy, tight, tighter = plan(1.5 * 2**30), plan(600 * 2**20), plan(200 * 2**20)
+
+    assert roomy.batch_size == 4 and 4 <= roomy.pages_in_flight < 100
+    assert tight.batch_size < 4 and tight.scale == 2.0
+    assert tighter.batch_size == 1 and tighter.pages_in_flight == 1
+    # never rendered smaller than the model's input
+    assert tighter.scale * LETTER[1] >= 1024
+
+
+def test_shrink_halves_pages_before_batch():
+    assert MemoryPlan(2.0, 4, 16).shrink() == MemoryPlan(2.0, 4, 8)
+    assert MemoryPlan(2.0, 4, 4).shrink() == MemoryPlan(2.0, 2, 2)
+    assert MemoryPlan(2.0, 1, 1).shrink() == MemoryPlan(2.0, 1, 1)
+
+
+def test_monitor_measures_stage_peak():
+    monitor = MemoryMonitor().start()
+    event = StageEvent(stage="render", start=0.0)
+    with monitor.measure(event):
+        data = bytearray(64 * 2**20)
+        data[::4096] = b"x" * len(data[::4096])
+    peak = monitor.stop()
+
+    assert event.peak_rss >= 64 * 2**20
+    assert peak >= event.peak_rss
+    assert MemoryMonitor(enabled=False).start().stop() is None
+
+
+def test_render_pdf_page_range():
+    pages = render_pdf("./tests/resources/input.pdf")
+    rest = render_pdf("./tests/resources/input.pdf", first_page=1, max_pages=5)
+
+    assert len(rest) == len(pages) - 1
+    assert rest[0].text_fragments == pages[1].text_fragments
+
+
+def test_detect_pages_shrinks_the_plan_when_over_budget(tmp_path, monkeypatch):
+    writer = pypdf.PdfWriter()
+    for _ in range(3):
+        writer.append(INPUT)
+    writer.write(tmp_path / "six.pdf")
+
+    monkeypatch.setattr(
+        commonforms.inference,
+        "plan_memory",
+        lambda *args: MemoryPlan(scale=1.0, batch_size=2, pages_in_flight=2),
+    )
+    # a disabled monitor never resets its window, so every chunk is over budget
+    monitor = MemoryMonitor(enabled=False)
+    monitor.window_peak = 2**40
+    detector = RecordingDetector()
+
+    results, pages, plan = detect_pages(
+        tmp_path / "six.pdf",
+        detector,
+        confidence=0.3,
+        image_size=1024,
+        batch_size=2,
+        tiled=False,
+        adaptive=False,
+        escalation_policy=None,
+        memory_budget=MemoryBudget(limit=2**30),
+        render_workers=1,
+        observer=NULL_OBSERVER,
+        monitor=monitor,
+    )
+
+    assert len(results) == len(pages) == 6
+    # the first chunk runs with the plan, the rest with it halved
+    assert detector.batches == [2, 1, 1, 1, 1]
+    assert plan == MemoryPlan(scale=1.0, batch_size=1, pages_in_flight=1)
+
+
+def test_reused_detectors_release_their_buffers():
+    class PooledDetector(RecordingDetector):
+        released = 0
+
+        def release_buffers(self):
+            self.released += 1
+
+    detector = PooledDetector()
+    detect_form(INPUT, detector=detector)
+    detect_form(INPUT, detector=detector)
+
+    assert detector.released == 2
+
+
+def test_estimate_counts_the_buffer_pool():
+    budget = MemoryBudget(limit=2**30, bytes_per_input_pixel=0)
+    plan = MemoryPlan(scale=1.0, batch_size=2, pages_in_flight=2)
+    page = budget.page_bytes(*LETTER, 1.0)
+
+    # two pages in flight and in the batch, plus a pooled float32 page, resized
+    # page and batch of inputs
+    assert budget.estimate(LETTER, 1000, plan) == 4 * page + 3 * page + 3 * 12000
@@ -0,0 +1,115 @@
+import numpy as np
+from PIL import Image
+
+from commonforms.inference import Detector
+from commonforms.tiling import merge_tiles, tile_windows
+from commonforms.utils import Detections, Page
+
+
+def test_tile_windows_cover_page_with_overlap():
+    windows = tile_windows(2400, 1000, 1024, overlap=0.2)
+
+    assert all(y0 == 0 and y1 == 1000 for _, y0, _, y1 in windows)
+    assert windows[0][0] == 0
+    assert windows[-1][2] == 2400
+    for (_, _, prev_x1, _), (x0, _, _, _) in zip(windows, windows[1:]):
+        assert prev_x1 - x0 >= 0.2 * 1024
+
+
+def test_tile_windows_small_page_is_single_tile():
+    assert tile_windows(800, 600, 1024) == [(0, 0, 800, 600)]
+
+
+def test_merge_tiles_drops_clipped_duplicates():
+    windows = [(0, 0, 100, 100), (50, 0, 150, 100)]
+    # a widget at x=[60, 90] is seen whole by both tiles, and a widget at
+    # x=[95, 120] is clipped by the right edge of the first tile
+    left = Detections(
+        xyxyn=np.array([[0.6, 0.1, 0.9, 0.2], [0.95, 0.5, 1.0, 0.6]]),
+        class_id=np.array([0, 0]),
+        confidence=np.array([0.9, 0.8]),
+    )
+    right = Detections(
+        xyxyn=np.array([[0.1, 0.1, 0.4, 0.2], [0.45, 0.5, 0.7, 0.6]]),
+        class_id=np.array([0, 0]),
+        confidence=np.array([0.7, 0.8]),
+    )
+
+    merged = merge_tiles(150, 100, windows, [left, right])
+
+    assert len(merged) == 2
+    np.testing.assert_allclose(
+        sorted(merged.xyxyn[:, 0]), [60 / 150, 95 / 150], atol=1e-6
+    )
+
+
+def test_merge_tiles_keeps_nested_fields():
+    windows = [(0, 0, 100, 100), (50, 0, 150, 100)]
+
+    # a text box at x=[55, 95] with a check box inside it at x=[60, 70], seen
+    # whole by both tiles and by the pass over the whole page
+    def nested(x0, width):
+        return Detections(
+            xyxyn=np.array(
+                [
+                    [(55 - x0) / width, 0.1, (95 - x0) / width, 0.4],
+                    [(60 - x0) / width, 0.2, (70 - x0) / width, 0.3],
+                ]
+            ),
+            class_id=np.array([0, 1]),
+            confidence=np.array([0.9, 0.8]),
+        )
+
+    merged = merge_tiles(
+        150,
+        100,
+        windows,
+        [nested(0, 100), nested(50, 100)],
+        page_detections=nested(0, 150),
+    )
+
+    assert sorted(merged.class_id) == [0, 1]
+    np.testing.assert_allclose(
+        merged.xyxyn[merged.class_id == 1], [[60 / 150, 0.2, 70 / 150, 0.3]]
+    )
+
+
+class ConstantDetector(Detector):
+    """Finds one checkbox in the middle of every image it is given."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, images, confidence, image_size, augment=None):
+        self.calls.append([image.size for image in images])
+        return [
+            Detections(
+                xyxyn=np.array([[0.45, 0.45, 0.55, 0.55]]),
+                class_id=np.array([1]),
+                confidence=np.array([0.9]),
+            )
+            for _ in images
+        ]
+
+
+def test_tiled_extract_widgets_only_tiles_large_pages():
+    pages = [
+        Page(
+            image=Image.new("RGB", (500, 500)), width=500, height=500, text_fragments=[]
+        ),
+        Page(
+            image=Image.new("RGB", (2000, 1000)),
+            width=2000,
+            height=1000,
+            text_fragments=[],
+        ),
+    ]
+    detector = ConstantDetector()
+
+    widgets = detector.extract_widgets(pages, image_size=1000, batch_size=2, tiled=True)
+
+    sizes = [size for call in detector.calls for size in call]
+    assert sizes.count((1000, 1000)) == 3
+    assert len(widgets[0]) == 1
+    assert all(w.widget_type == "ChoiceButton" for w in widgets[1])
+    assert len(widgets[1]) >= 2
@@ -0,0 +1,104 @@
+import numpy as np
+import pypdfium2
+import pytest
+
+import commonforms.inference
+from commonforms import detect_form
+from commonforms.escalation import VectorPolicy
+from commonforms.evaluation import box_iou
+from commonforms.utils import Detections
+from commonforms.vector import CHOICE_BUTTON, TEXT_BOX, page_vectors, snap_to_candidates
+
+from detections_test import INPUT, TwoBoxDetector
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    pdf = pypdfium2.PdfDocument(INPUT)
+    try:
+        return page_vectors(pdf[0])
+    finally:
+        pdf.close()
+
+
+def best_iou(candidates, box):
+    return box_iou(candidates.xyxyn, np.array([box])).max()
+
+
+def test_page_vectors_finds_drawn_fields(vectors):
+    candidates = vectors.candidates
+    assert vectors.image_coverage < VectorPolicy.max_image_coverage
+    assert vectors.text_chars > 100
+    assert (candidates.xyxyn >= 0).all() and (candidates.xyxyn <= 1).all()
+
+    buttons = candidates[candidates.class_id == CHOICE_BUTTON]
+    text_boxes = candidates[candidates.class_id == TEXT_BOX]
+    assert len(buttons) >= 16
+    # the "permanent address change" check box
+    assert best_iou(buttons, [0.09, 0.481, 0.107, 0.494]) > 0.8
+    # a comb of boxes for the policy number, found as one field
+    assert best_iou(text_boxes, [0.09, 0.539, 0.435, 0.565]) > 0.8
+    # an underline next to its label
+    assert best_iou(text_boxes, [0.225, 0.855, 0.913, 0.872]) > 0.8
+
+
+def test_snap_to_candidates():
+    candidates = Detections(
+        xyxyn=np.array([[0.1, 0.1, 0.3, 0.12], [0.5, 0.5, 0.52, 0.52]]),
+        class_id=np.array([0, 1]),
+        confidence=np.array([0.8, 0.85]),
+    )
+    detections = Detections(
+        xyxyn=np.array(
+            [
+                [0.101, 0.098, 0.298, 0.121],  # matches the text box
+                [0.49, 0.49, 0.51, 0.51],  # weak overlap, kept as is
+                [0.1, 0.1, 0.3, 0.12],  # same box but a different class
+            ]
+        ),
+        class_id=np.array([0, 1, 1]),
+        confidence=np.array([0.9, 0.6, 0.5]),
+    )
+
+    snapped = snap_to_candidates(detections, candidates)
+
+    np.testing.assert_array_equal(snapped.xyxyn[0], candidates.xyxyn[0])
+    np.testing.assert_array_equal(snapped.xyxyn[1:], detections.xyxyn[1:])
+    np.testing.assert_array_equal(snapped.confidence, detections.confidence)
+
+
+def test_vector_model_needs_no_render(monkeypatch):
+    def render_page(*args, **kwargs):
+        raise AssertionError("the vector detector shouldn't render pages")
+
+    monkeypatch.setattr(commonforms.inference, "render_page", render_page)
+    detections = detect_form(INPUT, model_or_path="vector")
+
+    assert detections.num_pages == 2
+    assert all(len(widgets) > 20 for widgets in detections.widgets.values())
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    monkeypatch.setattr(
+        commonforms.inference, "load_detector", lambda *args, **kwargs: TwoBoxDetector()
+    )
+
+
+def test_vector_prior_skips_the_model_on_trusted_pages(stub_model, vectors):
+    detections = detect_form(INPUT, model_or_path="stub", vector_prior=True)
+
+    # the stub always finds two boxes; the candidates stand in for it
+    assert len(detections.widgets[0]) == len(vectors.candidates)
+    assert detections.config["vector_policy"]["min_candidates"] == 3
+
+
+def test_vector_prior_runs_the_model_on_untrusted_pages(stub_model):
+    detections = detect_form(
+        INPUT,
+        model_or_path="stub",
+        vector_prior=True,
+        vector_policy=VectorPolicy(min_candidates=1000),
+    )
+
+    assert [len(widgets) for widgets in detections.widgets.values()] == [2, 2]